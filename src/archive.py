@@ -0,0 +1,156 @@
+"""
+Compact, append-only archive of genomes.
+
+The archive is made of two files that are only ever appended to:
+- the data file, holding the flat float32 genomes one after the other,
+- the index file (same name plus ".idx"), holding one fixed-size entry per genome with its
+  offset in the data file and its metadata (step, fitness, goopie and parent id, brain type).
+
+Both are memory-mappable, so a single record can be read by index without deserializing the
+rest of the archive. Writes happen in a background thread, the caller only pays for a queue put.
+"""
+import queue
+import threading
+from pathlib import Path
+import numpy as np
+
+# brain type stored in the index, as the position in this tuple
+BRAIN_TYPES = ("cnn", "neat")
+
+DATA_MAGIC = b"GOOPDAT1"
+INDEX_MAGIC = b"GOOPIDX1"
+HEADER_SIZE = 16
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<i8"),
+    ("length", "<i8"),
+    ("step", "<i8"),
+    ("goopie_id", "<i8"),
+    ("parent_id", "<i8"),
+    ("brain_type", "<i8"),
+    ("fitness", "<f8"),
+])
+
+
+class GenomeArchive:
+    """
+    Append-only archive of genomes with their metadata, written from a background thread.
+    A read-only archive must already exist, and is never created nor appended to.
+    """
+    def __init__(self, path: str, read_only: bool = False) -> None:
+        self.data_path = Path(path)
+        self.index_path = self.data_path.with_name(self.data_path.name + ".idx")
+        self.read_only = read_only
+        if read_only:
+            for file_path in (self.data_path, self.index_path):
+                if not file_path.exists():
+                    raise FileNotFoundError(f"Genome archive file {file_path} does not exist.")
+        else:
+            self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        for file_path, magic in ((self.data_path, DATA_MAGIC), (self.index_path, INDEX_MAGIC)):
+            if not file_path.exists():
+                with open(file_path, "wb") as f:
+                    f.write(magic.ljust(HEADER_SIZE, b"\0"))
+            else:
+                with open(file_path, "rb") as f:
+                    if f.read(len(magic)) != magic:
+                        raise ValueError(f"{file_path} is not a genome archive file.")
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread = None
+
+    def append(self, genome: np.ndarray, step: int, fitness: float, goopie_id: int = -1, parent_id: int = -1, brain_type: str = "cnn"):
+        """
+        Queues a genome to be appended to the archive by the background writer.
+        """
+        if self.read_only:
+            raise ValueError(f"Genome archive {self.data_path} is read-only.")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, daemon=True)
+            self._thread.start()
+        entry = np.zeros((), dtype=INDEX_DTYPE)
+        entry["length"] = len(genome)
+        entry["step"] = step
+        entry["goopie_id"] = goopie_id
+        entry["parent_id"] = parent_id
+        entry["brain_type"] = BRAIN_TYPES.index(brain_type)
+        entry["fitness"] = fitness
+        self._queue.put((np.array(genome, dtype=np.float32), entry))
+
+    def flush(self):
+        """
+        Waits until all the queued genomes are on disk.
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _writer(self):
+        with open(self.data_path, "ab") as data_file, open(self.index_path, "ab") as index_file:
+            while True:
+                item = self._queue.get()
+                # write everything that is already waiting in one go
+                items = [item]
+                while item is not None:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    items.append(item)
+
+                for entry in items:
+                    if entry is None:
+                        continue
+                    genome, index_entry = entry
+                    index_entry["offset"] = data_file.tell() - HEADER_SIZE
+                    data_file.write(genome.tobytes())
+                    # the data goes to disk before its index entry, so the index never points to missing data
+                    data_file.flush()
+                    index_file.write(index_entry.tobytes())
+                index_file.flush()
+                for _ in items:
+                    self._queue.task_done()
+                if items[-1] is None:
+                    return
+
+    def __len__(self):
+        return (self.index_path.stat().st_size - HEADER_SIZE) // INDEX_DTYPE.itemsize
+
+    def index(self) -> np.ndarray:
+        """
+        Memory-mapped metadata of all the records written so far.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(self.index_path, dtype=INDEX_DTYPE, mode="r", offset=HEADER_SIZE, shape=(len(self),))
+
+    def read(self, record: int) -> tuple[np.ndarray, dict]:
+        """
+        Reads a single record, negative indices count from the end.
+
+        Returns
+        -------
+        tuple[np.ndarray, dict]
+            the genome and its metadata
+        """
+        num_records = len(self)
+        if record < 0:
+            record += num_records
+        if not 0 <= record < num_records:
+            raise IndexError(f"Record {record} is not in the archive, which has {num_records} records.")
+        entry = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode="r", offset=HEADER_SIZE + record * INDEX_DTYPE.itemsize, shape=(1,))[0]
+        genome = np.array(np.memmap(self.data_path, dtype=np.float32, mode="r", offset=HEADER_SIZE + int(entry["offset"]), shape=(int(entry["length"]),)))
+        metadata = {name: entry[name].item() for name in INDEX_DTYPE.names if name != "offset"}
+        metadata["brain_type"] = BRAIN_TYPES[metadata["brain_type"]]
+        return genome, metadata
+
+    def best_record(self) -> int:
+        """
+        Index of the record with the highest fitness.
+        """
+        if len(self) == 0:
+            raise ValueError(f"Genome archive {self.data_path} is empty.")
+        return int(np.argmax(self.index()["fitness"]))
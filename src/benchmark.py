@@ -0,0 +1,187 @@
+"""
+Reproducible benchmark suite for the step loop.
+
+Every scenario builds a seeded Simulation (random brains, no blueprint, no archive), runs a few
+untimed warm-up steps (the first calls into torch alone take seconds), then a fixed number of steps
+headless, and reports steps/sec, the time spent in every phase of the step and the peak memory. Each run happens in a fresh process, so that the peak memory of a scenario is not
+polluted by the previous ones. Results are saved as JSON, to compare commits on the same machine:
+
+    python src/benchmark.py --output before.json
+    python src/benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import math
+import multiprocessing as mp
+import platform
+import subprocess
+from pathlib import Path
+
+DEFAULT_SIZES = (100, 500, 2000)
+
+
+def sparse(num_goopies: int) -> dict:
+    # few encounters: a huge arena, where most vision queries find nothing
+    return dict(num_goopies=num_goopies, num_food=num_goopies, space_size=300 * math.sqrt(num_goopies))
+
+
+def dense_crowd(num_goopies: int) -> dict:
+    # every goopie sees and touches many others
+    return dict(num_goopies=num_goopies, num_food=num_goopies, space_size=30 * math.sqrt(num_goopies))
+
+
+def wall_hugging(num_goopies: int) -> dict:
+    # everyone is moved along the walls, facing outwards
+    return dict(num_goopies=num_goopies, num_food=num_goopies, space_size=100 * math.sqrt(num_goopies), setup=_move_to_walls)
+
+
+def food_rich(num_goopies: int) -> dict:
+    return dict(num_goopies=num_goopies, num_food=10 * num_goopies, space_size=100 * math.sqrt(num_goopies))
+
+
+def food_10k(num_goopies: int) -> dict:
+    return dict(num_goopies=num_goopies, num_food=10000, space_size=2500)
+
+
+def food_100k(num_goopies: int) -> dict:
+    # food kept in the NumPy food field, 100k pymunk bodies take seconds to build
+    return dict(num_goopies=num_goopies, num_food=100000, space_size=5000, food_layer="field")
+
+
+SCENARIOS = {
+    "sparse": sparse,
+    "dense_crowd": dense_crowd,
+    "wall_hugging": wall_hugging,
+    "food_rich": food_rich,
+    "food_10k": food_10k,
+    "food_100k": food_100k,
+}
+
+
+def _move_to_walls(simulation):
+    distance = simulation.space_size - 30
+    for i, goopie in enumerate(simulation.goopies):
+        body = goopie.shape.body
+        side = i % 4
+        along = simulation.generator.uniform(-distance, distance)
+        body.position = [(distance, along), (along, distance), (-distance, along), (along, -distance)][side]
+        body.angle = side * math.pi / 2
+
+
+def run_scenario(name: str, num_goopies: int, steps: int, seed: int, warmup: int = 5, brain_backend: str = "torch") -> dict:
+    """
+    Builds and runs a single scenario in the current process, timing only the steps after the warm-up ones.
+    """
+    import resource
+    from simulation import Simulation
+    from headless import run_headless
+
+    kwargs = SCENARIOS[name](num_goopies)
+    setup = kwargs.pop("setup", None)
+    kwargs["brain_backend"] = brain_backend
+    simulation = Simulation(**kwargs, blueprint=None, archive_path=None, random_respawn_rate=1.0, seed=seed)
+    if setup is not None:
+        setup(simulation)
+    for _ in range(warmup):
+        simulation.step()
+    simulation.metrics.reset()
+    report = run_headless(simulation, steps=steps)
+    report["scenario"] = name
+    report["size"] = num_goopies
+    report["config"] = dict(kwargs)
+    report["warmup"] = warmup
+    report["phase_ms_per_step"] = {phase: 1000 * seconds / max(report["steps"], 1) for phase, seconds in report["phase_seconds"].items()}
+    # ru_maxrss is in kilobytes on Linux
+    report["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return report
+
+
+def _run_scenario_process(conn, name: str, num_goopies: int, steps: int, seed: int, warmup: int, brain_backend: str):
+    conn.send(run_scenario(name, num_goopies, steps, seed, warmup, brain_backend))
+    conn.close()
+
+
+def run_suite(scenarios: list[str], sizes: list[int], steps: int, seed: int, warmup: int = 5, brain_backend: str = "torch") -> list[dict]:
+    """
+    Runs every scenario at every population size, each in its own process.
+    A scenario whose process dies (e.g. out of memory) is reported and left out of the results.
+    """
+    context = mp.get_context("spawn")
+    results = []
+    for name in scenarios:
+        for size in sizes:
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_run_scenario_process, args=(child_conn, name, size, steps, seed, warmup, brain_backend))
+            process.start()
+            # only the child holds its end, so that recv raises EOFError if it dies before sending its report
+            child_conn.close()
+            try:
+                report = parent_conn.recv()
+            except EOFError:
+                process.join()
+                print(f"{name:<14}{size:>6} goopies: failed, the scenario process exited with code {process.exitcode}")
+                continue
+            finally:
+                parent_conn.close()
+            process.join()
+            results.append(report)
+            print(f"{name:<14}{size:>6} goopies: {report['steps_per_second']:8.1f} steps/sec, "
+                  f"{report['agent_steps_per_second']:10.0f} agent-steps/sec, {report['peak_memory_mb']:7.1f} MB")
+    return results
+
+
+def machine_info() -> dict:
+    import numpy as np
+    import pymunk
+    import torch
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": mp.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pymunk": pymunk.version,
+        "torch": torch.__version__,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict]) -> str:
+    """
+    Speedup of every scenario over the same scenario of a baseline run.
+    """
+    baseline_rates = {(r["scenario"], r["size"]): r["steps_per_second"] for r in baseline}
+    lines = ["Speedup over baseline:"]
+    for report in results:
+        key = (report["scenario"], report["size"])
+        if key in baseline_rates and baseline_rates[key] > 0:
+            lines.append(f"  {key[0]:<14}{key[1]:>6} goopies: {report['steps_per_second'] / baseline_rates[key]:6.2f}x")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the simulation step loop on seeded scenarios.")
+    parser.add_argument("--scenarios", type=str, nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS), help="scenarios to run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="initial population sizes of every scenario")
+    parser.add_argument("--steps", type=int, default=200, help="steps of every run")
+    parser.add_argument("--seed", type=int, default=42, help="seed of every scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed steps run before the timed ones")
+    parser.add_argument("--brain-backend", type=str, default="torch", choices=["torch", "numpy"], help="library evaluating the brains")
+    parser.add_argument("--output", type=str, default="benchmark.json", help="JSON file where the results are saved")
+    parser.add_argument("--compare", type=str, default=None, help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = run_suite(args.scenarios, args.sizes, args.steps, args.seed, args.warmup, args.brain_backend)
+    output = {"machine": machine_info(), "steps": args.steps, "warmup": args.warmup, "seed": args.seed, "results": results}
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)["results"]))
@@ -1,71 +1,285 @@
-import torch
-import torch.nn as nn
-from abc import ABC, abstractmethod
-
-class Brain(nn.Module, ABC):
-    def __init__(self):
-        super().__init__()
-
-    @abstractmethod
-    def forward(self, vision):
-        ...
-    
-    @abstractmethod
-    def mutate(self, mutation_prob, mutation_amount):
-        ...
-
-    @abstractmethod
-    def _get_n_parameters(self):
-        ...
-
-class CNNBrain(Brain):
-    def __init__(self, vision_width, vision_channels) -> None:
-        super().__init__()
-        self.conv = nn.Conv1d(vision_channels, 1, 1)
-        # self.relu = nn.ReLU()
-        self.pool = nn.AvgPool1d(2)
-        self.fc = nn.Linear(vision_width // 2, 2)
-
-    def forward(self, vision_buffer: torch.Tensor, energy: float, speed: float):
-        vision = self.pool(self.conv(vision_buffer))
-        # x = torch.hstack([vision, torch.tensor([energy, speed]).view(1, 2)])
-        x = vision
-        x = self.fc(x)
-        x = torch.tanh(x)
-        return x[0, 0], x[0, 1]
+"""
+Brains of the goopies, stored as flat genomes and evaluated for the whole population at once.
+
+Two backends evaluate the same genomes: "torch" and "numpy". Torch is only imported when its backend
+is selected (or when a .pt checkpoint is read), which saves most of the start time and memory of a
+process with the numpy backend. `convert_checkpoint.py` converts .pt checkpoints to .npz files once.
+"""
+import math
+import numpy as np
+import genetics
+
+BACKENDS = ("torch", "numpy")
+# largest difference allowed between a compiled brain and its layers, for float32 rounding
+VERIFY_TOLERANCE = 1e-4
+
+
+def load_state_dict_file(path: str) -> dict[str, np.ndarray]:
+    """
+    Reads the parameters of a brain from a torch .pt checkpoint or from a .npz file written by convert_checkpoint.py.
+    """
+    if str(path).endswith(".npz"):
+        with np.load(path) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+    import torch
+    return {name: value.numpy() for name, value in torch.load(path).items()}
+
+class GenomeLayout:
+    """
+    Layout of a flat float32 genome: the name, shape and position of every parameter tensor of a brain,
+    in the same order as in its state dict.
+    """
+    def __init__(self, shapes: dict[str, tuple[int, ...]]) -> None:
+        self.shapes = dict(shapes)
+        self.offsets: dict[str, tuple[int, int]] = {}
+        n_params = 0
+        for name, shape in self.shapes.items():
+            size = math.prod(shape)
+            self.offsets[name] = (n_params, n_params + size)
+            n_params += size
+        self.n_params = n_params
+
+    def __len__(self):
+        return self.n_params
+
+    def view(self, genomes: np.ndarray, name: str) -> np.ndarray:
+        """
+        View of the given parameter tensor in a genome, or in a (N, n_params) batch of genomes.
+        """
+        start, end = self.offsets[name]
+        return genomes[..., start:end].reshape(genomes.shape[:-1] + self.shapes[name])
+
+    def to_state_dict(self, genome: np.ndarray) -> dict[str, np.ndarray]:
+        return {name: self.view(genome, name).copy() for name in self.shapes}
+
+    def from_state_dict(self, state_dict: dict) -> np.ndarray:
+        genome = np.zeros(self.n_params, dtype=np.float32)
+        for name, (start, end) in self.offsets.items():
+            value = np.asarray(state_dict[name], dtype=np.float32)
+            if value.shape != self.shapes[name]:
+                raise ValueError(f"Parameter {name} has shape {value.shape}, expected {self.shapes[name]} (was the brain trained with another vision?).")
+            genome[start:end] = value.reshape(-1)
+        return genome
+
+class CNNBrainPopulation:
+    """
+    Stores the genomes of a whole population of CNNBrains as the rows of a single
+    (capacity, n_params) float32 array, so that every brain can be evaluated with one batched call.
+    Each row is laid out as conv.weight | conv.bias | fc.weight | fc.bias, see `layout`.
+    The brains are evaluated with torch or with numpy, depending on the backend.
+
+    Everything before the tanh of a brain is linear in its vision buffer. If compiled, the brains are
+    evaluated as tanh(weights @ vision + bias), with one (2, vision_channels * vision_width) matrix and
+    bias per row, folded from the genome the first time the row is evaluated after it changed. The
+    genomes must therefore only be changed through the methods of the population (`set_genomes`,
+    `mutate`, ...), which mark the rows to compile again. If verify is also set, every compiled
+    evaluation is checked against the layers it was folded from.
+    """
+    def __init__(self, vision_width: int, vision_channels: int, capacity: int = 64, generator: np.random.Generator = None, backend: str = "torch",
+                 compiled: bool = False, verify: bool = False) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown brain backend {backend}, expected one of {BACKENDS}.")
+        self.backend = backend
+        self.compiled = compiled
+        self.verify = verify
+        self.vision_width = vision_width
+        self.vision_channels = vision_channels
+        self.pooled_width = vision_width // 2
+        self.layout = GenomeLayout({
+            "conv.weight": (1, vision_channels, 1),
+            "conv.bias": (1,),
+            "fc.weight": (2, self.pooled_width),
+            "fc.bias": (2,),
+        })
+        self.n_params = self.layout.n_params
+        self.genomes = np.zeros((capacity, self.n_params), dtype=np.float32)
+        # affine map of every row, valid unless the row is dirty
+        self.weights = np.zeros((capacity, 2, vision_channels * vision_width), dtype=np.float32)
+        self.biases = np.zeros((capacity, 2), dtype=np.float32)
+        self.dirty = np.ones(capacity, dtype=bool)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        # random generator for initialization and mutations
+        self.generator = generator if generator is not None else np.random.default_rng()
+
+    def __len__(self):
+        return self.genomes.shape[0] - len(self.free_slots)
+
+    def allocate(self, initialize: bool = True) -> int:
+        """
+        Reserves a row for a new brain, initialized like the torch modules of a fresh CNNBrain
+        unless its genome is going to be overwritten anyway.
+        """
+        if len(self.free_slots) == 0:
+            capacity = self.genomes.shape[0]
+            self.genomes = np.concatenate([self.genomes, np.zeros_like(self.genomes)])
+            self.weights = np.concatenate([self.weights, np.zeros_like(self.weights)])
+            self.biases = np.concatenate([self.biases, np.zeros_like(self.biases)])
+            self.dirty = np.concatenate([self.dirty, np.ones_like(self.dirty)])
+            self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free_slots.pop()
+        self.dirty[slot] = True
+        if initialize:
+            self.initialize(slot)
+        return slot
+
+    def free(self, slot: int):
+        self.free_slots.append(slot)
+
+    def initialize(self, slot: int):
+        # same bounds as the default initialization of nn.Conv1d and nn.Linear
+        conv_bound = 1 / math.sqrt(self.vision_channels)
+        fc_bound = 1 / math.sqrt(self.pooled_width)
+        bounds = np.zeros(self.n_params, dtype=np.float32)
+        for name, bound in (("conv.weight", conv_bound), ("conv.bias", conv_bound), ("fc.weight", fc_bound), ("fc.bias", fc_bound)):
+            bounds[slice(*self.layout.offsets[name])] = bound
+        self.genomes[slot] = self.generator.uniform(-bounds, bounds)
+        self.dirty[slot] = True
+
+    def set_genomes(self, slots: np.ndarray, genomes: np.ndarray):
+        self.genomes[slots] = genomes
+        self.dirty[slots] = True
+
+    def state_dict(self, slot: int) -> dict:
+        """
+        Parameters of the brain as a state dict of torch tensors, which can be loaded by a torch_brain.CNNBrain.
+        """
+        import torch
+        return {name: torch.from_numpy(value) for name, value in self.layout.to_state_dict(self.genomes[slot]).items()}
+
+    def load_state_dict(self, slot: int, state_dict: dict):
+        self.set_genomes(slot, self.layout.from_state_dict(state_dict))
+
+    def mutate(self, slots: np.ndarray, mutation_prob: float, mutation_amount: float):
+        self.set_genomes(slots, genetics.mutate(self.genomes[slots], mutation_prob, mutation_amount, self.generator))
+
+    def compile(self, slots: np.ndarray = None):
+        """
+        Folds the linear part of the brains in the given rows (all of them by default) into their affine
+        maps, for the rows whose genome changed since they were last compiled.
+
+        The linear part is treated as a black box: the bias is its image of a zero vision buffer, and
+        every column of the matrix its image of a buffer with a single 1, minus the bias. Computed in
+        float64, so that the folded map differs from the layers only by the float32 rounding.
+        """
+        slots = np.arange(len(self.genomes)) if slots is None else np.asarray(slots)
+        slots = np.unique(slots[self.dirty[slots]])
+        if len(slots) == 0:
+            return
+        n_inputs = self.vision_channels * self.vision_width
+        probes = np.concatenate([np.zeros((1, n_inputs)), np.eye(n_inputs)]).reshape(n_inputs + 1, self.vision_channels, self.vision_width)
+        genomes = np.repeat(self.genomes[slots].astype(np.float64), n_inputs + 1, axis=0)
+        outputs = self._linear_numpy(genomes, np.tile(probes, (len(slots), 1, 1))).reshape(len(slots), n_inputs + 1, 2)
+        self.biases[slots] = outputs[:, 0]
+        self.weights[slots] = (outputs[:, 1:] - outputs[:, :1]).transpose(0, 2, 1)
+        self.dirty[slots] = False
+
+    def forward(self, slots: np.ndarray, vision_buffers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the brains in the given rows on a (N, vision_channels, vision_width) float32 batch of vision buffers.
+        Returns the turn and acceleration outputs as two arrays of shape (N,).
+        """
+        if self.compiled:
+            self.compile(slots)
+            x = self._affine(self.weights[slots], self.biases[slots], vision_buffers.reshape(len(slots), -1))
+            if self.verify:
+                self._verify(slots, vision_buffers, x)
+        elif self.backend == "numpy":
+            x = self._linear_numpy(self.genomes[slots], vision_buffers)
+        else:
+            x = self._linear_torch(self.genomes[slots], vision_buffers)
+        x = np.tanh(x) if self.backend == "numpy" else self._tanh_torch(x)
+        return x[:, 0], x[:, 1]
+
+    def _linear_numpy(self, genomes: np.ndarray, vision_buffers: np.ndarray) -> np.ndarray:
+        # conv -> pool -> fc, all the layers before the tanh
+        n = len(genomes)
+        conv_weight = self.layout.view(genomes, "conv.weight").reshape(n, self.vision_channels)
+        conv_bias = self.layout.view(genomes, "conv.bias")
+        fc_weight = self.layout.view(genomes, "fc.weight")
+        fc_bias = self.layout.view(genomes, "fc.bias")
+
+        x = np.einsum("nc,ncw->nw", conv_weight, vision_buffers) + conv_bias
+        # average pooling with kernel 2, dropping the last column if the width is odd
+        x = x[:, :2 * self.pooled_width].reshape(n, self.pooled_width, 2).mean(axis=2, dtype=x.dtype)
+        return np.einsum("nop,np->no", fc_weight, x) + fc_bias
+
+    def _linear_torch(self, genomes: np.ndarray, vision_buffers: np.ndarray):
+        import torch
+
+        n = len(genomes)
+        vision_buffers = torch.from_numpy(vision_buffers)
+        conv_weight = torch.from_numpy(self.layout.view(genomes, "conv.weight")).view(n, self.vision_channels)
+        conv_bias = torch.from_numpy(self.layout.view(genomes, "conv.bias"))
+        fc_weight = torch.from_numpy(self.layout.view(genomes, "fc.weight"))
+        fc_bias = torch.from_numpy(self.layout.view(genomes, "fc.bias"))
+
+        x = torch.einsum("nc,ncw->nw", conv_weight, vision_buffers) + conv_bias
+        # average pooling with kernel 2, dropping the last column if the width is odd
+        x = x[:, :2 * self.pooled_width].reshape(n, self.pooled_width, 2).mean(dim=2)
+        return torch.einsum("nop,np->no", fc_weight, x) + fc_bias
+
+    def _affine(self, weights: np.ndarray, biases: np.ndarray, inputs: np.ndarray):
+        if self.backend == "numpy":
+            return np.einsum("noi,ni->no", weights, inputs) + biases
+        import torch
+        return torch.einsum("noi,ni->no", torch.from_numpy(weights), torch.from_numpy(inputs)) + torch.from_numpy(biases)
+
+    def _tanh_torch(self, x) -> np.ndarray:
+        import torch
+        return torch.tanh(x).numpy()
+
+    def _verify(self, slots: np.ndarray, vision_buffers: np.ndarray, compiled):
+        if self.backend == "numpy":
+            expected = self._linear_numpy(self.genomes[slots], vision_buffers)
+        else:
+            expected = self._linear_torch(self.genomes[slots], vision_buffers).numpy()
+        error = np.abs(np.asarray(compiled) - expected).max(initial=0.0)
+        if error > VERIFY_TOLERANCE:
+            raise RuntimeError(f"Compiled brains differ from their layers by {error}, more than {VERIFY_TOLERANCE}.")
+
+class PopulationBrain:
+    """
+    Handle to a single brain stored as one row of a CNNBrainPopulation.
+    Exposes the same interface as a CNNBrain module, without owning any torch module.
+    """
+    def __init__(self, population: CNNBrainPopulation, initialize: bool = True) -> None:
+        self.population = population
+        self.slot = population.allocate(initialize)
+
+    def __call__(self, vision_buffer: np.ndarray, energy: float, speed: float):
+        turn, accelerate = self.population.forward(np.array([self.slot]), np.asarray(vision_buffer, dtype=np.float32)[None])
+        return turn[0], accelerate[0]
 
     def mutate(self, mutation_prob: float, mutation_amount: float):
-        for p in self.parameters():
-            mutation_mask = torch.distributions.Categorical(probs=torch.tensor([1 - mutation_prob, mutation_prob])).sample(p.size())
-            mutation = torch.distributions.Normal(loc=0, scale=mutation_amount).sample(p.size())
-            # print("----------------------------")
-            # print(p.data)
-            # print("mutation:", mutation*mutation_mask)
-            p.data += mutation * mutation_mask
-            # print(p.data)
+        self.population.mutate(np.array([self.slot]), mutation_prob, mutation_amount)
+
+    def state_dict(self) -> dict:
+        return self.population.state_dict(self.slot)
+
+    def load_state_dict(self, state_dict: dict):
+        self.population.load_state_dict(self.slot, state_dict)
+
+    def get_genome(self) -> np.ndarray:
+        """
+        Returns a copy of the flat float32 genome, laid out as described by the population layout.
+        """
+        return self.population.genomes[self.slot].copy()
+
+    def set_genome(self, genome: np.ndarray):
+        self.population.set_genomes(self.slot, genome)
 
+    def release(self):
+        """
+        Frees the row in the shared population, moving the genome into a private one
+        so that the brain can still be read (e.g. by the best goopies) after its goopie died.
+        """
+        genome = self.get_genome()
+        self.population.free(self.slot)
+        self.population = CNNBrainPopulation(self.population.vision_width, self.population.vision_channels, capacity=1,
+                                             generator=self.population.generator, backend=self.population.backend,
+                                             compiled=self.population.compiled, verify=self.population.verify)
+        self.slot = self.population.allocate(initialize=False)
+        self.population.set_genomes(self.slot, genome)
 
     def __str__(self):
-        return f"Vision Brain with {self._get_n_parameters(self.conv)} conv params and  {self._get_n_parameters(self.fc)} FC parameters."
-    
-    def _get_n_parameters(self, model: nn.Module):
-        return sum(p.numel() for p in model.parameters())
-    
-class NeatBrain(Brain):
-    def __init__(self, n_inputs, n_outputs):
-        super().__init__()
-        self.n_inputs = n_inputs
-        self.n_outputs = n_outputs
-        
-    def forward(self, vision):
-        pass
-
-    def mutate(self, mutation_prob, mutation_amount):
-        pass
-
-    def _get_n_parameters(self):
-        pass
-
-if __name__ == "__main__":
-    b = Brain(10, 3)
-    print(b)
\ No newline at end of file
+        return f"Vision Brain with {self.population.n_params} parameters in slot {self.slot}."
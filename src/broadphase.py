@@ -0,0 +1,177 @@
+"""
+Broadphase of the pymunk space of a Simulation.
+
+Pymunk finds the colliding shapes with a bounding box tree by default, or with a spatial hash, which
+is usually faster for many shapes of similar size but depends on its cell size. The BroadphaseTuner
+configures the space of the simulation with one of the two, and in "auto" mode periodically measures
+the cost of a space step with each option on a copy of the live population, then switches the space
+to the cheapest one.
+"""
+import timeit
+import pymunk
+from goopie import Goopie
+from vision import Vision
+
+# the spatial hash should have about this many cells per shape, as advised by pymunk
+HASH_CELLS_PER_SHAPE = 10
+MIN_HASH_CELLS = 1000
+
+
+class BroadphaseOption:
+    """
+    The bounding box tree if dim is None, otherwise a spatial hash of cells of size dim and (at least)
+    count cells.
+    """
+    __slots__ = ("dim", "count")
+
+    def __init__(self, dim: float = None, count: int = None) -> None:
+        self.dim = dim
+        self.count = count
+
+    @property
+    def name(self) -> str:
+        return "bbtree" if self.dim is None else f"hash dim={self.dim:g} count={self.count}"
+
+    def apply(self, space: pymunk.Space):
+        """
+        Switches the space to the spatial hash, in place. A space cannot go back to the tree, see BroadphaseTuner.
+        """
+        if self.dim is not None:
+            space.use_spatial_hash(self.dim, self.count)
+
+
+class BroadphaseTuner:
+    """
+    Parameters
+    ----------
+    mode : str
+        "bbtree" keeps the default bounding box tree, "hash" always uses a spatial hash sized after the
+        shapes of the simulation, "auto" benchmarks both every `interval` steps and keeps the fastest
+    interval : int
+        steps between two benchmarks in auto mode
+    trial_steps : int
+        space steps measured for every option, after one warm-up step
+    """
+    MODES = ("bbtree", "hash", "auto")
+
+    def __init__(self, mode: str = "bbtree", interval: int = 2000, trial_steps: int = 10) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown broadphase {mode}, expected one of {', '.join(self.MODES)}.")
+        self.mode = mode
+        self.interval = interval
+        self.trial_steps = trial_steps
+        self.current = BroadphaseOption()
+        # step, chosen option and measured cost of every option of the last benchmark
+        self.report: dict = None
+
+    def configure(self, space: pymunk.Space, simulation):
+        """
+        Applies the current option to a new, empty space of the simulation. In hash mode the option
+        is first derived from the configured population.
+        """
+        if self.mode == "hash":
+            self.current = self.candidates(simulation, simulation.num_goopies + simulation.num_food)[1]
+        self.current.apply(space)
+
+    def due(self, step: int) -> bool:
+        return self.mode == "auto" and step % self.interval == 0
+
+    def candidates(self, simulation, num_shapes: int = None) -> list[BroadphaseOption]:
+        """
+        The tree and the spatial hashes worth trying: cells as big as the average moving shape (the
+        goopies, and their vision sensors if any), as a goopie, and twice as big, all with about
+        HASH_CELLS_PER_SHAPE cells per shape of the space.
+        """
+        if num_shapes is None:
+            num_shapes = len(simulation.space.shapes)
+        count = max(MIN_HASH_CELLS, HASH_CELLS_PER_SHAPE * num_shapes)
+        diameters = [2 * Goopie.RADIUS] + ([2 * Vision.VISION_RADIUS] if simulation.vision_sensors else [])
+        average = sum(diameters) / len(diameters)
+        options = [BroadphaseOption()]
+        for dim in dict.fromkeys([average, 2 * Goopie.RADIUS, 2 * average]):
+            options.append(BroadphaseOption(dim, count))
+        return options
+
+    def benchmark(self, simulation, options: list[BroadphaseOption]) -> dict[str, float]:
+        """
+        Measures the cost of a space step with each option, in seconds, on a copy of the live population.
+        """
+        costs = {}
+        for option in options:
+            space = _mirror(simulation)
+            option.apply(space)
+            space.step(0.01)
+            start_time = timeit.default_timer()
+            for _ in range(self.trial_steps):
+                space.step(0.01)
+            costs[option.name] = (timeit.default_timer() - start_time) / self.trial_steps
+        return costs
+
+    def tune(self, simulation) -> dict:
+        """
+        Benchmarks the options on the live population and switches the space of the simulation to the
+        fastest one. Pymunk cannot turn a spatial hash back into a tree in place, and rebuilding the
+        world would replace the goopies under the viewer, so once the space uses a hash the tree is
+        still measured but only the hashes can be chosen.
+
+        Returns
+        -------
+        dict
+            the step, the chosen option, the cost of a space step with every option in milliseconds, and
+            the fastest option if it could not be chosen
+        """
+        options = self.candidates(simulation)
+        costs = self.benchmark(simulation, options)
+        fastest = min(options, key=lambda option: costs[option.name])
+        allowed = options if self.current.dim is None else [option for option in options if option.dim is not None]
+        best = min(allowed, key=lambda option: costs[option.name])
+        if best.name != self.current.name:
+            self.current = best
+            best.apply(simulation.space)
+        self.report = {
+            "step": simulation.num_steps,
+            "choice": best.name,
+            "costs_ms": {name: 1000 * cost for name, cost in costs.items()},
+            "skipped": fastest.name if fastest is not best else None,
+        }
+        return self.report
+
+
+def _ignore_collision(arbiter: pymunk.Arbiter, space: pymunk.Space, data) -> bool:
+    return False
+
+
+def _mirror(simulation) -> pymunk.Space:
+    """
+    New space with a copy of the walls, goopies and food of the simulation. The pairs handled by the
+    simulation are ignored by handlers that do nothing else, so that the same contacts are found and
+    called back, without eating nor seeing anything.
+    """
+    space = pymunk.Space()
+    for handled in simulation.space_handlers:
+        space.add_collision_handler(*handled).pre_solve = _ignore_collision
+    objects = []
+    for wall in simulation.walls:
+        segment = pymunk.Segment(space.static_body, wall.a, wall.b, wall.radius)
+        segment.elasticity, segment.friction, segment.collision_type = wall.elasticity, wall.friction, wall.collision_type
+        objects.append(segment)
+    for goopie in simulation.goopies:
+        source = goopie.shape
+        body = pymunk.Body(source.body.mass, source.body.moment)
+        body.position, body.velocity, body.angle = source.body.position, source.body.velocity, source.body.angle
+        shape = pymunk.Circle(body, source.radius)
+        shape.elasticity, shape.friction, shape.collision_type = source.elasticity, source.friction, source.collision_type
+        objects.extend([body, shape])
+        if goopie.vision_shape is not None:
+            vision_shape = pymunk.Circle(body, goopie.vision_shape.radius)
+            vision_shape.sensor, vision_shape.collision_type = True, goopie.vision_shape.collision_type
+            objects.append(vision_shape)
+    for food in simulation.foods:
+        source = food.shape
+        body = pymunk.Body(body_type=pymunk.Body.STATIC)
+        body.position = source.body.position
+        shape = pymunk.Circle(body, source.radius)
+        shape.elasticity, shape.friction, shape.collision_type = source.elasticity, source.friction, source.collision_type
+        objects.extend([body, shape])
+    space.add(*objects)
+    return space
@@ -0,0 +1,25 @@
+"""
+Converts torch .pt brain checkpoints to .npz files, which are read without importing torch:
+
+    python src/convert_checkpoint.py checkpoints/best_goopie.pt
+
+writes checkpoints/best_goopie.npz, with one array per parameter of the state dict.
+"""
+import argparse
+from pathlib import Path
+import numpy as np
+from brain import load_state_dict_file
+
+
+def convert_checkpoint(path: str, output: str = None) -> str:
+    output = output if output is not None else str(Path(path).with_suffix(".npz"))
+    np.savez(output, **load_state_dict_file(path))
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts torch .pt brain checkpoints to .npz files.")
+    parser.add_argument("checkpoints", type=str, nargs="+", help=".pt files to convert, each written next to it with the .npz extension")
+    args = parser.parse_args()
+    for checkpoint in args.checkpoints:
+        print(f"{checkpoint} -> {convert_checkpoint(checkpoint)}")
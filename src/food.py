@@ -4,15 +4,11 @@ import numpy as np
 class Food:
     MASS = 1
     RADIUS = 10
+    AMOUNT = 0.3
     COLLISION_TYPE = 2
     def __init__(self, x: float = None, y:float = None, generation_range: float = 2000, generator = np.random.default_rng()) -> None:
         moment = pymunk.moment_for_circle(self.MASS, 0, self.RADIUS)          
         circle_body = pymunk.Body(self.MASS, moment, pymunk.Body.STATIC)  
-        if x is None:
-            x = generator.uniform(-generation_range, generation_range)
-        if y is None:
-            y = generator.uniform(-generation_range, generation_range)
-        circle_body.position = x, y
         circle_body.velocity = 0, 0
         circle_shape = pymunk.Circle(circle_body, self.RADIUS)
         circle_shape.elasticity = 0.8
@@ -21,7 +17,21 @@ class Food:
         circle_shape.food = self
         self.shape = circle_shape
         self.sprite = None
-        self.amount = 0.3
+        self.reset(x, y, generation_range, generator)
+
+    def reset(self, x: float = None, y:float = None, generation_range: float = 2000, generator = np.random.default_rng()):
+        """
+        Places the food at the given (or a random) position with its initial amount,
+        also used to recycle eaten food.
+        """
+        if x is None:
+            x = generator.uniform(-generation_range, generation_range)
+        if y is None:
+            y = generator.uniform(-generation_range, generation_range)
+        self.shape.body.position = x, y
+        self.grid_slot: int = None
+        self.entity_id: int = None
+        self.amount = self.AMOUNT
     
     def get_position(self) -> pymunk.Vec2d:
         return self.shape.body.position
@@ -0,0 +1,88 @@
+import numpy as np
+from food import Food
+from spatial_index import SpatialGrid
+
+
+class FoodField:
+    """
+    Food stored as NumPy arrays bucketed in a SpatialGrid, instead of a static pymunk body and circle
+    per item, so that worlds with hundreds of thousands of food items never touch the pymunk space.
+
+    Every item has a slot in the grid (position and radius) and an amount in `amounts`, indexed by the
+    same slot. The goopies eat the items overlapping their circle, found with one bulk grid query per
+    step, and the items eaten and spawned during a step are applied together by commit(), at its end,
+    like the LifecycleQueue does for the pymunk food.
+    """
+    def __init__(self, cell_size: float, radius: float = Food.RADIUS, amount: float = Food.AMOUNT, capacity: int = 64) -> None:
+        self.radius = radius
+        self.amount = amount
+        self.grid = SpatialGrid(cell_size, capacity)
+        self.amounts = np.zeros(capacity)
+        self._eaten: list[np.ndarray] = []
+        self._spawned: list[np.ndarray] = []
+
+    def __len__(self):
+        return len(self.grid)
+
+    def add(self, positions: np.ndarray, amounts: np.ndarray = None) -> np.ndarray:
+        """
+        Adds items at the given (N, 2) positions, with the given or the initial amount, returning their slots.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        slots = self.grid.insert_many(positions, np.full(len(positions), self.radius), [None] * len(positions))
+        if len(self.amounts) < len(self.grid.entities):
+            self.amounts = np.concatenate([self.amounts, np.zeros(len(self.grid.entities) - len(self.amounts))])
+        self.amounts[slots] = self.amount if amounts is None else amounts
+        return slots
+
+    def remove(self, slots: np.ndarray):
+        self.grid.remove_many(np.asarray(slots, dtype=np.int64).tolist())
+        self.amounts[slots] = 0
+
+    def state(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (N, 2) positions and (N,) amounts of all the items, in slot order.
+        """
+        slots = np.flatnonzero(self.grid.active)
+        return self.grid.positions[slots], self.amounts[slots]
+
+    def find_eaten(self, positions: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the items eaten by the circles of the given radius around the given positions: every
+        item overlapping one of them is eaten by the first one, in the order of the positions.
+        The items are queued to be removed by commit().
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            the index of the position eating each item and its slot, by increasing slot
+        """
+        eaters, slots = self.grid.query_pairs(positions, radius)
+        # sorted by slot, then by eater, so that the first pair of each slot is its first eater
+        order = np.lexsort((eaters, slots))
+        eaters, slots = eaters[order], slots[order]
+        first = np.concatenate([[True], slots[1:] != slots[:-1]]) if len(slots) > 0 else np.zeros(0, dtype=bool)
+        eaters, slots = eaters[first], slots[first]
+        self._eaten.append(slots)
+        return eaters, slots
+
+    def spawn(self, positions: np.ndarray):
+        """
+        Queues new items at the given (N, 2) positions, added by commit().
+        """
+        self._spawned.append(np.asarray(positions, dtype=np.float64).reshape(-1, 2))
+
+    def commit(self) -> tuple[int, int]:
+        """
+        Removes the items eaten and adds the items spawned since the last commit, in bulk.
+        Returns the number of items removed and added.
+        """
+        eaten = np.concatenate([np.zeros(0, dtype=np.int64)] + self._eaten)
+        spawned = np.concatenate([np.zeros((0, 2))] + self._spawned)
+        self._eaten = []
+        self._spawned = []
+        if len(eaten) > 0:
+            self.remove(eaten)
+        if len(spawned) > 0:
+            self.add(spawned)
+        return len(eaten), len(spawned)
@@ -0,0 +1,24 @@
+"""
+Genetic operators working on batches of flat float32 genomes, one genome per row.
+Each operator draws all the random numbers it needs for the whole batch at once.
+"""
+import numpy as np
+
+
+def mutate(genomes: np.ndarray, mutation_prob: float, mutation_amount: float, generator: np.random.Generator) -> np.ndarray:
+    """
+    Returns mutated copies of the given (N, n_params) genomes: each parameter is perturbed with
+    probability mutation_prob by gaussian noise of standard deviation mutation_amount.
+    """
+    mutation_mask = generator.random(genomes.shape, dtype=np.float32) < mutation_prob
+    mutation = generator.standard_normal(genomes.shape, dtype=np.float32) * np.float32(mutation_amount)
+    return genomes + mutation * mutation_mask
+
+
+def crossover(genomes_a: np.ndarray, genomes_b: np.ndarray, generator: np.random.Generator) -> np.ndarray:
+    """
+    Uniform crossover of two (N, n_params) batches of genomes: each parameter of the i-th child
+    comes from either the i-th genome of the first or of the second batch with equal probability.
+    """
+    from_a = generator.random(genomes_a.shape, dtype=np.float32) < 0.5
+    return np.where(from_a, genomes_a, genomes_b)
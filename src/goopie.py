@@ -1,59 +1,102 @@
 import pymunk
+from pathlib import Path
 import math
 import numpy as np
 from food import Food
-import torch
-from brain import Brain
 from abc import ABC, abstractmethod
 from vision import Vision, WideVision, ClosestVision
-from brain import Brain, CNNBrain, NeatBrain
+from brain import PopulationBrain
+from neat import NeatBrain
+from population import PopulationStore
+
+def _population_field(name: str) -> property:
+    """
+    Property reading and writing the field of a goopie stored in its PopulationStore.
+    """
+    def getter(self):
+        return getattr(self.population, name)[self.slot].item()
+
+    def setter(self, value):
+        getattr(self.population, name)[self.slot] = value
+
+    return property(getter, setter)
 
 class Goopie(ABC):
+    """
+    Thin handle to a goopie: its physical shapes, sprites, vision and brain, plus the slot of its
+    state (energy, age, fitness, ...) in the population store of the simulation.
+    """
     MASS = 0.05
     RADIUS = 30
     COLLISION_TYPE = 1
+    METABOLISM_RATE = 0.1
+    REPRODUCTION_AGE = 3
+    REPRODUCTION_ENERGY = 0.8
+    CHILD_ENERGY = 0.4
+
+    __slots__ = ("simulation", "population", "slot", "shape", "vision_shape", "sprite", "vision_arc", "grid_slot", "entity_id", "vision", "brain")
+
+    id = _population_field("id")
+    parent_id = _population_field("parent_id")
+    energy = _population_field("energy")
+    age = _population_field("age")
+    fitness = _population_field("fitness")
+    alive = _population_field("alive")
+    max_turn = _population_field("max_turn")
+    max_acceleration = _population_field("max_acceleration")
+    max_speed = _population_field("max_speed")
+
     def __init__(self, simulation, x: float = None, y:float = None, angle:float = None, generation_range: float = 2000, generator = np.random.default_rng()) -> None:
         
         self.simulation = simulation
+        self.population: PopulationStore = simulation.population
+        self.slot = self.population.allocate()
         self.create_shapes(x, y, angle, generation_range, generator)
         self.sprite = None
         self.vision_arc = None
-        self.age = 0
-
-        self.energy = 0.5
-        self.alive = True
-        self.max_turn = 1
-        self.max_acceleration = 20
-        self.max_speed = 200
-        self.fitness: float = 0.0
+        self.grid_slot: int = None
+        # id in the entity registry of the simulation, while the goopie lives in it
+        self.entity_id: int = None
         self.vision : Vision = None 
-        self.brain : Brain = None
+        self.brain : PopulationBrain | NeatBrain = None
     
     def create_shapes(self, x: float = None, y:float = None, angle:float = None, generation_range: float = 2000, generator = np.random.default_rng()):
-        moment = pymunk.moment_for_circle(self.MASS, 0, self.RADIUS)          
-        circle_body = pymunk.Body(self.MASS, moment)  
         if x is None:
             x = generator.uniform(-generation_range, generation_range)
         if y is None:
             y = generator.uniform(-generation_range, generation_range)
+        if angle is None:
+            angle = generator.uniform(-math.pi, math.pi)
+
+        # the body and shapes of a dead goopie are reused if available
+        recycled = self.simulation.goopie_shape_pool.acquire()
+        if recycled is None:
+            moment = pymunk.moment_for_circle(self.MASS, 0, self.RADIUS)          
+            circle_body = pymunk.Body(self.MASS, moment)  
+            shape = pymunk.Circle(circle_body, self.RADIUS)
+            shape.elasticity = 0.4
+            shape.friction = 1.0
+            shape.collision_type = self.COLLISION_TYPE
+            # create the vision shape, only needed if the simulation perceives through pymunk sensors
+            vision_shape = None
+            if self.simulation.vision_sensors:
+                vision_shape = pymunk.Circle(circle_body, Vision.VISION_RADIUS)
+                vision_shape.collision_type = Vision.VISION_COLLISION_TYPE
+                vision_shape.sensor = True
+        else:
+            shape, vision_shape = recycled
+            circle_body = shape.body
+            circle_body.angular_velocity = 0
+            circle_body.force = 0, 0
+            circle_body.torque = 0
         circle_body.position = x, y
         circle_body.velocity = 0, 0
+        circle_body.angle = angle
         circle_body.velocity_func = self.limit_velocity
-        if angle is not None:
-            circle_body.angle = angle
-        else:
-            circle_body.angle = generator.uniform(-math.pi, math.pi)
-        shape = pymunk.Circle(circle_body, self.RADIUS)
-        shape.elasticity = 0.4
-        shape.friction = 1.0
-        shape.collision_type = self.COLLISION_TYPE
         shape.goopie = self 
+        if vision_shape is not None:
+            vision_shape.goopie = self
         self.shape = shape
-        # create the vision shape
-        vision_shape = pymunk.Circle(circle_body, Vision.VISION_RADIUS)
-        vision_shape.collision_type = Vision.VISION_COLLISION_TYPE
-        vision_shape.sensor = True
-        vision_shape.goopie = self
         self.vision_shape = vision_shape
 
     def limit_velocity(self, body: pymunk.Body, gravity, damping, dt):
@@ -77,7 +120,6 @@ class Goopie(ABC):
         amount = min(1 - self.energy, food.amount)
         self.energy += amount 
         self.fitness += amount
-        print(self.energy)
         return True
 
     def is_alive(self):
@@ -89,38 +131,29 @@ class Goopie(ABC):
     def update_vision(self, shape: pymunk.Shape, type: str):
         self.vision.update(shape, type)
 
-
-    @abstractmethod
-    def step(self, dt: float):
+    def release(self):
         """
-        Abstract function that implements the logic for a step.
-
-        Parameters
-        ----------
-        dt : float
-            delta time
+        Frees the slots held by the goopie in the population-wide state, brain and vision stores,
+        and gives its body and shapes back to the pool of the simulation.
+        The state and brain weights remain readable afterwards.
         """
-        ...
-
+        self.vision.release()
+        self.brain.release()
+        self.population, self.slot = self.population.detach(self.slot)
+        self.simulation.goopie_shape_pool.release((self.shape, self.vision_shape))
+        self.shape = None
+        self.vision_shape = None
 
-    def movement_step(self, turn: float, acceleration: float):
-        """
-        Updates the goopies velocity and angle based on its acceleration. Velocity will always be in the front, never laterally.
-        """
-        angle = self.shape.body.angle
-        angle += self.max_turn * turn
-        speed = self.shape.body.velocity.length
-        
-        velocity = speed * math.cos(angle), speed * math.sin(angle)
-        self.shape.body.angle = angle
-        self.shape.body.velocity = velocity
-        self.shape.body.apply_force_at_local_point((acceleration * self.max_acceleration, 0), (0,0))
 
     def mutate(self, mutation_prob: float, mutation_amount: float):
         self.brain.mutate(mutation_prob, mutation_amount)
 
     def save(self, path: str):
-        # for now save only the brain
+        # for now save only the brain, as a .npz file or as a torch .pt checkpoint
+        if path.endswith(".npz"):
+            np.savez(path, **self.brain.population.layout.to_state_dict(self.brain.get_genome()))
+            return
+        import torch
         torch.save(self.brain.state_dict(), path)
 
     @abstractmethod
@@ -129,37 +162,34 @@ class Goopie(ABC):
 
 class CNNGoopie(Goopie):
 
-    def __init__(self, simulation,  x: float = None, y:float = None, angle:float = None, generation_range: float = 2000, generator = np.random.default_rng()):
+    __slots__ = ()
+
+    def __init__(self, simulation,  x: float = None, y:float = None, angle:float = None, generation_range: float = 2000, generator = np.random.default_rng(), random_brain: bool = True):
         super().__init__(simulation, x, y, angle, generation_range, generator)
 
-        self.vision = WideVision(self)
-        self.brain = CNNBrain(self.vision.VISION_BUFFER_WIDTH, 3).requires_grad_(False)
+        self.vision = simulation.vision_class(self)
+        # the random initialization is skipped if the genome is going to be set right away
+        self.brain = PopulationBrain(simulation.brains, initialize=random_brain)
     
-    def step(self, dt: float):
-        self.energy -= 0.1*dt
-        self.simulation.biomass += 0.1*dt
-        self.age += dt
-        if self.energy <= 0:
-            self.alive = False
-
-        # forward in the brain
-        turn, accelerate = self.brain(self.vision.visual_buffer, self.energy, self.shape.body.velocity.length / self.max_speed)
-
-        # make the goopie move
-        self.movement_step(turn, accelerate)
-
     def reproduce(self):
-        if self.age > 3 and self.energy > 0.8:
-            print(self.energy)
-            child = CNNGoopie(self.simulation, self.get_position().x, self.get_position().y)
-
-            child.brain.load_state_dict(self.brain.state_dict())
-            child.mutate(self.simulation.mutation_prob, self.simulation.mutation_amount)
-            child.energy = 0.4
-            self.energy -= 0.4
-            return child
+        if self.age > self.REPRODUCTION_AGE and self.energy > self.REPRODUCTION_ENERGY:
+            return self.simulation.breed([self])[0]
         return None
             
 
-class NEATGoopie():
-    pass
\ No newline at end of file
+class NEATGoopie(CNNGoopie):
+    """
+    Goopie with the same body, vision and life cycle as a CNNGoopie, thinking with a NEAT network
+    stored in the NeatBrainPopulation of the simulation.
+    """
+    __slots__ = ()
+
+    def __init__(self, simulation,  x: float = None, y:float = None, angle:float = None, generation_range: float = 2000, generator = np.random.default_rng(), random_brain: bool = True):
+        Goopie.__init__(self, simulation, x, y, angle, generation_range, generator)
+
+        self.vision = simulation.vision_class(self)
+        self.brain = NeatBrain(simulation.brains, initialize=random_brain)
+
+    def save(self, path: str):
+        # the flat genome, NEAT networks have no torch state dict
+        np.savez(Path(path).with_suffix(".npz"), genome=self.brain.get_genome())
\ No newline at end of file
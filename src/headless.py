@@ -0,0 +1,80 @@
+"""
+Runs a Simulation without any window in a tight loop, measuring its throughput.
+This module must never import pyglet, so that it can be used on machines without a display.
+"""
+import timeit
+from simulation import Simulation
+
+
+def run_headless(simulation: Simulation, steps: int = None, seconds: float = None) -> dict:
+    """
+    Steps the simulation until the given number of steps or wall-clock seconds is reached,
+    whichever comes first. At least one of the two budgets must be given.
+
+    Returns
+    -------
+    dict
+        report with the number of steps, steps/sec, agent-steps/sec and the total time spent in every phase of the step
+    """
+    if steps is None and seconds is None:
+        raise ValueError("A headless run needs a step or time budget.")
+    timer = timeit.default_timer
+    num_steps = 0
+    agent_steps = 0
+    phase_totals: dict[str, float] = {}
+    start_time = timer()
+    elapsed = 0.0
+    while (steps is None or num_steps < steps) and (seconds is None or elapsed < seconds):
+        agent_steps += len(simulation.goopies)
+        simulation.step()
+        for phase, duration in simulation.phase_times.items():
+            phase_totals[phase] = phase_totals.get(phase, 0.0) + duration
+        num_steps += 1
+        elapsed = timer() - start_time
+
+    return {
+        "steps": num_steps,
+        "seconds": elapsed,
+        "steps_per_second": num_steps / elapsed if elapsed > 0 else 0.0,
+        "agent_steps": agent_steps,
+        "agent_steps_per_second": agent_steps / elapsed if elapsed > 0 else 0.0,
+        "goopies": len(simulation.goopies),
+        "food": simulation.food_count(),
+        "best_fitness": simulation.best_fitness,
+        "phase_seconds": phase_totals,
+        "metrics": simulation.metrics.summary(),
+        "pools": simulation.pool_stats(),
+        "broadphase": simulation.broadphase_tuner.current.name,
+        "broadphase_benchmark": simulation.broadphase_tuner.report,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Steps: {report['steps']} in {report['seconds']:.2f}s",
+        f"Steps/sec: {report['steps_per_second']:.1f}      Agent-steps/sec: {report['agent_steps_per_second']:.0f}",
+        f"Goopies: {report['goopies']}      Food: {report['food']}      Best: {report['best_fitness']:.4f}",
+        "Phase timings:",
+    ]
+    total = sum(report["phase_seconds"].values())
+    for phase, duration in report["phase_seconds"].items():
+        mean_ms = 1000 * duration / max(report["steps"], 1)
+        share = 100 * duration / total if total > 0 else 0.0
+        lines.append(f"  {phase:<14}{duration:9.3f}s {mean_ms:9.3f}ms/step {share:6.1f}%")
+    counters = {name: summary for name, summary in report["metrics"].items() if name not in report["phase_seconds"]}
+    if len(counters) > 0:
+        lines.append("Counters per step (last steps):      mean       p50       p99       max")
+        for name, summary in counters.items():
+            lines.append(f"  {name:<30}{summary['mean']:10.1f}{summary['p50']:10.1f}{summary['p99']:10.1f}{summary['max']:10.0f}")
+    lines.append("Object pools:")
+    for name, stats in report["pools"].items():
+        lines.append(f"  {name:<14}hits {stats['hits']:8d}   misses {stats['misses']:8d}   hit rate {100 * stats['hit_rate']:5.1f}%   free {stats['free']:6d}")
+    lines.append(f"Broadphase: {report['broadphase']}")
+    benchmark = report["broadphase_benchmark"]
+    if benchmark is not None:
+        lines.append(f"  last benchmark at step {benchmark['step']}, space step cost of every option:")
+        for name, cost in benchmark["costs_ms"].items():
+            lines.append(f"  {name:<30}{cost:9.3f}ms{'   <- chosen' if name == benchmark['choice'] else ''}")
+        if benchmark["skipped"] is not None:
+            lines.append(f"  {benchmark['skipped']} was faster, but the space cannot leave its spatial hash")
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+"""
+Instanced rendering of circular entities (goopies, food, vision rings) with pyglet's OpenGL bindings.
+
+Every entity type is a single quad drawn once per entity with glDrawArraysInstanced: the (x, y, angle)
+of all the entities are uploaded from a NumPy array into one instance buffer per frame, so the Python
+cost of a frame does not depend on the number of entities. The shaders read the camera transform from
+the WindowBlock uniform block shared with all the pyglet default shaders.
+"""
+import ctypes
+import numpy as np
+from pyglet import gl
+from pyglet.graphics.shader import Shader, ShaderProgram
+from pyglet.graphics.vertexarray import VertexArray
+from pyglet.graphics.vertexbuffer import BufferObject
+
+VERTEX_SOURCE = """#version 330 core
+layout(location = 0) in vec2 corner;
+layout(location = 1) in vec3 instance;
+
+uniform WindowBlock
+{
+    mat4 projection;
+    mat4 view;
+} window;
+
+uniform float radius;
+
+out vec2 local;
+
+void main()
+{
+    // images point upwards, the angle of the bodies is measured from the x axis
+    float angle = instance.z - 1.5707963;
+    vec2 rotated = vec2(cos(angle) * corner.x - sin(angle) * corner.y, sin(angle) * corner.x + cos(angle) * corner.y);
+    local = corner;
+    gl_Position = window.projection * window.view * vec4(instance.xy + radius * rotated, 0.0, 1.0);
+}
+"""
+
+FRAGMENT_SOURCE = """#version 330 core
+in vec2 local;
+
+uniform sampler2D image;
+uniform bool textured;
+uniform vec2 uv_max;
+uniform vec4 color;
+uniform float ring_pixels;
+
+out vec4 final_color;
+
+void main()
+{
+    if (textured) {
+        final_color = texture(image, (local * 0.5 + 0.5) * uv_max) * color;
+        return;
+    }
+    // ring of constant width on screen, whatever the zoom
+    float r = length(local);
+    if (r > 1.0 || r < 1.0 - ring_pixels * fwidth(r))
+        discard;
+    final_color = color;
+}
+"""
+
+# two triangles covering the [-1, 1] square
+QUAD = np.array([-1, -1, 1, -1, 1, 1, -1, -1, 1, 1, -1, 1], dtype=np.float32)
+
+_program: ShaderProgram = None
+
+
+def _get_program() -> ShaderProgram:
+    # compiled once, on first use, when the GL context exists
+    global _program
+    if _program is None:
+        _program = ShaderProgram(Shader(VERTEX_SOURCE, "vertex"), Shader(FRAGMENT_SOURCE, "fragment"))
+    return _program
+
+
+class InstancedCircles:
+    """
+    Many circles of the same radius, either textured with an image (rotated with their angle) or drawn as rings.
+    """
+    def __init__(self, radius: float, texture=None, color: tuple = (1.0, 1.0, 1.0, 1.0), ring_pixels: float = 1.0, capacity: int = 1024) -> None:
+        self.radius = radius
+        self.texture = texture
+        self.color = color
+        self.ring_pixels = ring_pixels
+        self.program = _get_program()
+        self.count = 0
+        self.capacity = capacity
+
+        self.vao = VertexArray()
+        self.vao.bind()
+        self.quad_buffer = BufferObject(QUAD.nbytes, gl.GL_STATIC_DRAW)
+        self.quad_buffer.bind()
+        self.quad_buffer.set_data(QUAD.ctypes.data)
+        gl.glEnableVertexAttribArray(0)
+        gl.glVertexAttribPointer(0, 2, gl.GL_FLOAT, gl.GL_FALSE, 0, 0)
+
+        self.instance_buffer = BufferObject(capacity * 3 * 4, gl.GL_STREAM_DRAW)
+        self.instance_buffer.bind()
+        gl.glEnableVertexAttribArray(1)
+        gl.glVertexAttribPointer(1, 3, gl.GL_FLOAT, gl.GL_FALSE, 0, 0)
+        # one (x, y, angle) per instance, not per vertex
+        gl.glVertexAttribDivisor(1, 1)
+        self.vao.unbind()
+
+    def update(self, instances: np.ndarray):
+        """
+        Uploads the (N, 3) array of x, y and angle of the instances to draw.
+        """
+        instances = np.ascontiguousarray(instances, dtype=np.float32)
+        self.count = len(instances)
+        if self.count > self.capacity:
+            while self.capacity < self.count:
+                self.capacity *= 2
+            self.instance_buffer.resize(self.capacity * 3 * 4)
+        if self.count > 0:
+            self.instance_buffer.set_data_region(instances.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)), 0, instances.nbytes)
+
+    def draw(self):
+        if self.count == 0:
+            return
+        program = self.program
+        program.use()
+        program["radius"] = self.radius
+        program["color"] = self.color
+        program["textured"] = self.texture is not None
+        program["ring_pixels"] = self.ring_pixels
+        if self.texture is not None:
+            gl.glActiveTexture(gl.GL_TEXTURE0)
+            gl.glBindTexture(self.texture.target, self.texture.id)
+            program["image"] = 0
+            program["uv_max"] = self.texture.tex_coords[6], self.texture.tex_coords[7]
+        gl.glEnable(gl.GL_BLEND)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        self.vao.bind()
+        gl.glDrawArraysInstanced(gl.GL_TRIANGLES, 0, 6, self.count)
+        self.vao.unbind()
+        program.stop()
+
+    def delete(self):
+        self.quad_buffer.delete()
+        self.instance_buffer.delete()
+        self.vao.delete()
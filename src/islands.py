@@ -0,0 +1,241 @@
+"""
+Island model evolution: several independent simulations evolve in parallel processes, and
+periodically the best genomes of each island migrate to its neighbor in a ring.
+
+Migrants travel as flat float32 weight arrays through a block of shared memory, never as pickled
+goopies. The main process merges the best genomes of all the islands in a global hall of fame.
+"""
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+import timeit
+import numpy as np
+
+
+class MigrationBuffer:
+    """
+    Shared memory holding the top genomes of every island, one row of `migrants` genomes per island.
+    Empty entries have a fitness of -inf.
+    """
+    def __init__(self, num_islands: int, migrants: int, n_params: int, name: str = None) -> None:
+        self.shape = (num_islands, migrants, n_params)
+        fitness_size = num_islands * migrants * np.dtype(np.float64).itemsize
+        genomes_size = num_islands * migrants * n_params * np.dtype(np.float32).itemsize
+        self.owner = name is None
+        self.memory = SharedMemory(name=name, create=self.owner, size=fitness_size + genomes_size)
+        self.fitness = np.ndarray(self.shape[:2], dtype=np.float64, buffer=self.memory.buf)
+        self.genomes = np.ndarray(self.shape, dtype=np.float32, buffer=self.memory.buf, offset=fitness_size)
+        if self.owner:
+            self.fitness.fill(-np.inf)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, island: int, fitness: np.ndarray, genomes: np.ndarray):
+        self.fitness[island] = -np.inf
+        self.fitness[island, :len(fitness)] = fitness
+        self.genomes[island, :len(genomes)] = genomes
+
+    def read(self, island: int) -> tuple[np.ndarray, np.ndarray]:
+        valid = np.isfinite(self.fitness[island])
+        return self.fitness[island][valid].copy(), self.genomes[island][valid].copy()
+
+    def close(self):
+        # the arrays must be released before the memory can be closed
+        del self.fitness, self.genomes
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def island_worker(island: int, num_islands: int, conn: Connection, buffer_name: str, migrants: int, simulation_kwargs: dict):
+    """
+    Process running a single island, driven by the commands received through the connection:
+    ("evolve", steps) runs the simulation and publishes its best genomes, "migrate" imports the
+    genomes of the previous island in the ring, "stop" ends the process.
+    """
+    if simulation_kwargs.get("brain_backend", "torch") == "torch":
+        import torch
+        # one core per island, otherwise the torch threads of all the islands fight for the same cores
+        torch.set_num_threads(1)
+    from simulation import Simulation
+    from headless import run_headless
+
+    simulation = Simulation(**simulation_kwargs)
+    buffer = MigrationBuffer(num_islands, migrants, simulation.brains.n_params, name=buffer_name)
+    while True:
+        command = conn.recv()
+        if command[0] == "evolve":
+            report = run_headless(simulation, steps=command[1])
+            best = simulation.best_goopies[:migrants]
+            buffer.write(island, np.array([g.fitness for g in best]), np.array([g.brain.get_genome() for g in best], dtype=np.float32).reshape(-1, buffer.shape[2]))
+            conn.send(report)
+        elif command[0] == "migrate":
+            fitness, genomes = buffer.read((island - 1) % num_islands)
+            for f, genome in zip(fitness.tolist(), genomes):
+                simulation.add_genome(genome, f)
+                simulation.spawn_goopie(0.0, 0.0, 0.0, genome=genome)
+            # an extinct island is recolonized from its best goopies, which now include the migrants
+            if len(simulation.goopies) == 0:
+                for _ in range(simulation.num_goopies):
+                    simulation.spawn_goopie(simulation.random_respawn_rate, simulation.mutation_prob, simulation.mutation_amount)
+            conn.send(len(simulation.goopies))
+        elif command[0] == "stop":
+            break
+    buffer.close()
+    conn.close()
+
+
+class IslandRunner:
+    """
+    Runs `num_islands` simulations in worker processes, each seeded differently, alternating
+    evolution epochs and migrations, and keeps a global hall of fame across all the islands.
+    """
+    def __init__(self, num_islands: int, migrants: int = 3, hall_of_fame_size: int = 10, **simulation_kwargs) -> None:
+        from brain import CNNBrainPopulation
+        from vision import default_vision_width
+
+        if simulation_kwargs.get("brain_type", "cnn") != "cnn":
+            raise ValueError("Islands exchange genomes of a fixed size, only CNN brains can migrate.")
+        self.num_islands = num_islands
+        self.migrants = migrants
+        self.hall_of_fame_size = hall_of_fame_size
+        # the brains read a (3, width) vision buffer, whose width depends on the vision mode
+        self.vision_width = simulation_kwargs.get("vision_width") or default_vision_width(simulation_kwargs.get("vision_mode", "wide"))
+        self.n_params = CNNBrainPopulation(self.vision_width, 3, capacity=1).n_params
+        # (fitness, island, genome) of the best genomes ever published by any island
+        self.hall_of_fame: list[tuple[float, int, np.ndarray]] = []
+        # the hall of fame is saved as .npz files with the numpy backend, which never imports torch
+        self.brain_backend = simulation_kwargs.get("brain_backend", "torch")
+        self.buffer = MigrationBuffer(num_islands, migrants, self.n_params)
+
+        seed = simulation_kwargs.pop("seed", 42)
+        # the islands never write checkpoints on their own, the hall of fame is saved by the runner
+        simulation_kwargs["archive_path"] = None
+        self.connections: list[Connection] = []
+        self.processes: list[mp.Process] = []
+        for island in range(num_islands):
+            parent_conn, child_conn = mp.Pipe()
+            kwargs = dict(simulation_kwargs, seed=seed + island)
+            process = mp.Process(target=island_worker, args=(island, num_islands, child_conn, self.buffer.name, migrants, kwargs), daemon=True)
+            process.start()
+            # only the island holds its end, so that the runner gets EOFError if the island dies
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def run(self, epochs: int, epoch_steps: int) -> list[dict]:
+        """
+        Evolves all the islands for the given number of epochs, migrating genomes after each of them.
+        Returns one summary per epoch.
+        """
+        summaries = []
+        for epoch in range(epochs):
+            start_time = timeit.default_timer()
+            reports = self.command(("evolve", epoch_steps))
+            elapsed = timeit.default_timer() - start_time
+            self.update_hall_of_fame()
+
+            populations = self.command(("migrate",))
+
+            summary = {
+                "epoch": epoch,
+                "seconds": elapsed,
+                "steps_per_second": sum(r["steps"] for r in reports) / elapsed,
+                "agent_steps_per_second": sum(r["agent_steps"] for r in reports) / elapsed,
+                "populations": populations,
+                "best_fitness": self.hall_of_fame[0][0] if len(self.hall_of_fame) > 0 else 0.0,
+            }
+            summaries.append(summary)
+            print(f"Epoch {epoch}: {summary['steps_per_second']:.1f} steps/sec, {summary['agent_steps_per_second']:.0f} agent-steps/sec, "
+                  f"populations {populations}, best {summary['best_fitness']:.4f}")
+        return summaries
+
+    def command(self, command: tuple) -> list:
+        """
+        Sends the command to every island and returns their answers, raising a RuntimeError naming the
+        first island that died instead of answering.
+        """
+        for island, conn in enumerate(self.connections):
+            try:
+                conn.send(command)
+            except (BrokenPipeError, ConnectionResetError):
+                self._island_died(island)
+        answers = []
+        for island, conn in enumerate(self.connections):
+            try:
+                answers.append(conn.recv())
+            except (EOFError, ConnectionResetError):
+                self._island_died(island)
+        return answers
+
+    def _island_died(self, island: int):
+        process = self.processes[island]
+        process.join(timeout=5)
+        raise RuntimeError(f"Island {island} died with exit code {process.exitcode}.")
+
+    def update_hall_of_fame(self):
+        for island in range(self.num_islands):
+            fitness, genomes = self.buffer.read(island)
+            self.hall_of_fame.extend(zip(fitness.tolist(), [island] * len(fitness), genomes))
+        # the same genome is published again every epoch while it stays among the best of its island, and by
+        # every island it migrated to: it is kept once, with its best fitness and the island that published it first
+        unique: dict[bytes, tuple[float, int, np.ndarray]] = {}
+        for f, island, genome in self.hall_of_fame:
+            key = genome.tobytes()
+            if key not in unique or f > unique[key][0]:
+                unique[key] = (f, island, genome)
+        self.hall_of_fame = sorted(unique.values(), key=lambda entry: entry[0], reverse=True)[:self.hall_of_fame_size]
+
+    def save_hall_of_fame(self, folder: str):
+        from brain import CNNBrainPopulation
+
+        save_folder = Path(folder)
+        save_folder.mkdir(parents=True, exist_ok=True)
+        population = CNNBrainPopulation(self.vision_width, 3, capacity=1)
+        slot = population.allocate()
+        for fitness, island, genome in self.hall_of_fame:
+            if self.brain_backend == "numpy":
+                np.savez(save_folder / f"best_goopie_{fitness}.npz", **population.layout.to_state_dict(genome))
+                continue
+            import torch
+            population.set_genomes(slot, genome)
+            torch.save(population.state_dict(slot), save_folder / f"best_goopie_{fitness}.pt")
+
+    def close(self):
+        try:
+            for conn in self.connections:
+                try:
+                    conn.send(("stop",))
+                except (BrokenPipeError, ConnectionResetError):
+                    # the island already died, its failure was reported by command()
+                    pass
+                conn.close()
+            for process in self.processes:
+                process.join()
+        finally:
+            self.buffer.close()
+
+
+if __name__ == "__main__":
+    from main import add_simulation_arguments, simulation_kwargs
+
+    parser = argparse.ArgumentParser(description="Island model evolution of goopies on multiple cores.")
+    parser.add_argument("--islands", type=int, default=mp.cpu_count(), help="number of islands, each running in its own process")
+    parser.add_argument("--epochs", type=int, default=10, help="number of evolution epochs, followed by a migration")
+    parser.add_argument("--epoch-steps", type=int, default=2000, help="simulation steps of each island per epoch")
+    parser.add_argument("--migrants", type=int, default=3, help="number of top genomes migrating from each island to its neighbor")
+    parser.add_argument("--hall-of-fame", type=int, default=10, help="size of the global hall of fame")
+    parser.add_argument("--save", type=str, default="checkpoints/islands/", help="folder where the hall of fame is saved")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    runner = IslandRunner(args.islands, args.migrants, args.hall_of_fame, **simulation_kwargs(args))
+    try:
+        runner.run(args.epochs, args.epoch_steps)
+        runner.save_hall_of_fame(args.save)
+    finally:
+        runner.close()
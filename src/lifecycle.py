@@ -0,0 +1,20 @@
+class LifecycleQueue:
+    """
+    Births, deaths and food changes requested during a step. Nothing is added to or removed from the
+    simulation while the step runs: the queue is committed in one batch at its end, with one bulk
+    update of the pymunk space, the spatial grids, the registries and the window.
+    """
+    def __init__(self) -> None:
+        self.births: list = []
+        self.deaths: list = []
+        self.spawned_food: list = []
+        self.eaten_food: list = []
+
+    def __len__(self):
+        return len(self.births) + len(self.deaths) + len(self.spawned_food) + len(self.eaten_food)
+
+    def clear(self):
+        self.births = []
+        self.deaths = []
+        self.spawned_food = []
+        self.eaten_food = []
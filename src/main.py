@@ -1,19 +1,81 @@
+import argparse
 from simulation import Simulation
 
-# parse arguments
-HEADLESS = False
-TEST = False
 
-if __name__ == "__main__":
+def add_simulation_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the arguments configuring a Simulation, shared by all the entry points.
+    """
+    parser.add_argument("--goopies", type=int, default=30, help="initial number of goopies")
+    parser.add_argument("--food", type=int, default=200, help="initial number of food items")
+    parser.add_argument("--space-size", type=float, default=2500, help="half size of the square arena")
+    parser.add_argument("--blueprint", type=str, default=None, help="brain the first goopies are cloned from, a .pt or .npz file or a genome archive, 'none' to start from random brains (checkpoints/best_goopie.pt, or .npz with the numpy backend, by default)")
+    parser.add_argument("--blueprint-record", type=int, default=None, help="record of the blueprint archive to use, the fittest if not given")
+    parser.add_argument("--archive", type=str, default="checkpoints/archive.goop", help="genome archive where the best goopies are appended, 'none' to disable it")
+    parser.add_argument("--random-respawn-rate", type=float, default=0, help="probability of spawning a random goopie instead of a blueprint clone")
+    parser.add_argument("--mutation-prob", type=float, default=0.2, help="probability of mutating each brain parameter of a child")
+    parser.add_argument("--mutation-amount", type=float, default=0.05, help="standard deviation of the mutations")
+    parser.add_argument("--crossover-prob", type=float, default=0.0, help="probability of crossing a child genome with the one of another parent born in the same step")
+    parser.add_argument("--brain-backend", type=str, default="torch", choices=["torch", "numpy"], help="library evaluating the brains, torch is never imported with numpy")
+    parser.add_argument("--brain-type", type=str, default="cnn", choices=["cnn", "neat"], help="brains of fixed topology, or NEAT networks growing hidden nodes and connections")
+    parser.add_argument("--vision", type=str, default="wide", choices=["wide", "rays"], help="vision of the goopies, angular bins or rays stopping at the first thing they hit")
+    parser.add_argument("--vision-width", type=int, default=None, help="bins or rays of the vision, to run brains trained with another width")
+    parser.add_argument("--food-layer", type=str, default="pymunk", choices=["pymunk", "field"], help="food as pymunk bodies, or as NumPy arrays in a grid for worlds with 100k+ food")
+    parser.add_argument("--broadphase", type=str, default="bbtree", choices=["bbtree", "hash", "auto"], help="broadphase of the pymunk space, auto periodically benchmarks both on the live population and keeps the fastest")
+    parser.add_argument("--compile-brains", action="store_true", help="evaluate every brain as a single affine map folded from its layers, recompiled when its genome changes")
+    parser.add_argument("--verify-brains", action="store_true", help="with --compile-brains, check every compiled evaluation against the layers")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the random generators")
+
+
+def simulation_kwargs(args: argparse.Namespace) -> dict:
+    """
+    Keyword arguments of Simulation corresponding to the parsed simulation arguments.
+    """
+    blueprint = args.blueprint
+    if blueprint is None:
+        # the numpy backend never imports torch, so it reads the converted checkpoint
+        blueprint = "checkpoints/best_goopie.npz" if args.brain_backend == "numpy" else "checkpoints/best_goopie.pt"
+    return dict(num_goopies=args.goopies, num_food=args.food, space_size=args.space_size,
+                blueprint=None if blueprint.lower() == "none" else blueprint, blueprint_record=args.blueprint_record,
+                archive_path=None if args.archive.lower() == "none" else args.archive,
+                random_respawn_rate=args.random_respawn_rate, mutation_prob=args.mutation_prob,
+                mutation_amount=args.mutation_amount, crossover_prob=args.crossover_prob, seed=args.seed,
+                brain_backend=args.brain_backend, compile_brains=args.compile_brains, verify_brains=args.verify_brains,
+                brain_type=args.brain_type, vision_mode=args.vision,
+                vision_width=args.vision_width, food_layer=args.food_layer, broadphase=args.broadphase)
+
 
-    if HEADLESS:
-        # Before arcade is imported
-        import os
-        os.environ["ARCADE_HEADLESS"] = "True"
+def parse_args():
+    parser = argparse.ArgumentParser(description="Goopies artificial life simulation.")
+    parser.add_argument("--headless", action="store_true", help="run without a window, in a tight loop, and report the throughput")
+    parser.add_argument("--steps", type=int, default=None, help="number of steps of a headless or offscreen run")
+    parser.add_argument("--seconds", type=float, default=None, help="wall-clock duration of a headless run")
+    parser.add_argument("--metrics", type=str, default=None, help="file where the metrics of the last steps are exported at the end, .jsonl or .csv")
+    parser.add_argument("--steps-per-frame", type=int, default=1, help="simulation steps between two frames of the window")
+    parser.add_argument("--threaded", action="store_true", help="run the simulation on its own thread, the window draws its latest state")
+    parser.add_argument("--unlimited", action="store_true", help="with --threaded, run the simulation as fast as possible instead of at --steps-per-frame steps per frame")
+    parser.add_argument("--record", type=str, default=None, help="zip file the frames of the window are recorded to")
+    parser.add_argument("--record-every", type=int, default=1, help="record one frame every N drawn frames")
+    parser.add_argument("--record-downscale", type=int, default=1, help="divide the resolution of the recorded frames by N")
+    parser.add_argument("--offscreen", action="store_true", help="draw --steps steps in a window that is never shown, as fast as possible, to record without a display (not with --threaded)")
+    parser.add_argument("--test", action="store_true", help="tiny hand-placed scene to look at a single blueprint")
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+    if args.offscreen and args.threaded:
+        parser.error("--offscreen draws exactly --steps steps, which a --threaded simulation does not follow.")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    kwargs = simulation_kwargs(args)
 
-    if TEST:
-        sim = Simulation(1, 2, 500, TEST, blueprint="checkpoints/best_goopie.pt", random_respawn_rate=0,)
+    if args.test:
+        sim = Simulation(1, 2, 500, True, blueprint=kwargs["blueprint"], blueprint_record=args.blueprint_record, random_respawn_rate=0, seed=args.seed, archive_path=None)
     else:
-        sim = Simulation(30, 200, 2500, blueprint="checkpoints/best_goopie.pt", random_respawn_rate=0, mutation_prob=0.2, mutation_amount=0.05)
-        # sim = Simulation(100, 2000, 2500)
-    sim.run(HEADLESS)
\ No newline at end of file
+        sim = Simulation(**kwargs)
+    if args.headless and args.steps is None and args.seconds is None:
+        args.steps = 1000
+    sim.run(args.headless, args.steps, args.seconds, args.metrics,
+            steps_per_frame=args.steps_per_frame, threaded=args.threaded, unlimited=args.unlimited,
+            record_path=args.record, record_every=args.record_every, record_downscale=args.record_downscale, offscreen=args.offscreen)
@@ -0,0 +1,149 @@
+"""
+Instrumentation of the simulation step: named timers and counters, aggregated over the last steps
+into rolling histograms, exportable to JSONL or CSV, plus an on-demand profiler that can be turned
+on for a number of steps while a long run keeps going.
+"""
+import collections
+import cProfile
+import csv
+import io
+import json
+import pstats
+import signal
+from pathlib import Path
+import numpy as np
+
+
+class RollingHistogram:
+    """
+    The last `window` values of a metric, kept in a ring buffer.
+    """
+    def __init__(self, window: int) -> None:
+        self.values = np.zeros(window)
+        self.count = 0
+
+    def add(self, value: float):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def recent(self) -> np.ndarray:
+        """
+        The values in the window, from the oldest to the newest.
+        """
+        if self.count <= len(self.values):
+            return self.values[:self.count]
+        start = self.count % len(self.values)
+        return np.concatenate([self.values[start:], self.values[:start]])
+
+    def histogram(self, bins: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Counts and bin edges of the values in the window.
+        """
+        return np.histogram(self.recent(), bins=bins)
+
+    def summary(self) -> dict:
+        values = self.recent()
+        if len(values) == 0:
+            return {"count": 0}
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {"count": len(values), "mean": float(values.mean()), "p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(values.max())}
+
+
+class Metrics:
+    """
+    Timers (seconds) and counters recorded during a step. When the step ends every metric goes into
+    its rolling histogram and the step becomes a row of the exportable history. Counters not touched
+    during a step are recorded as 0.
+    """
+    def __init__(self, window: int = 1000) -> None:
+        self.window = window
+        self.histograms: dict[str, RollingHistogram] = {}
+        self.rows: collections.deque[dict] = collections.deque(maxlen=window)
+        self.current: dict[str, float] = {}
+        self._profiler: cProfile.Profile = None
+        self._profile_steps = 0
+        self._profile_path: str = None
+
+    def reset(self):
+        """
+        Forgets every recorded step, e.g. the warm-up steps of a benchmark.
+        """
+        self.histograms = {}
+        self.rows.clear()
+        self.current = {}
+
+    def add_time(self, name: str, seconds: float):
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        self.current[name] = self.current.get(name, 0) + n
+
+    def begin_step(self):
+        if self._profile_steps > 0:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            # only the steps are profiled, not what runs between them (e.g. rendering)
+            self._profiler.enable()
+
+    def end_step(self, step: int):
+        for name in self.histograms.keys() - self.current.keys():
+            self.current[name] = 0
+        for name, value in self.current.items():
+            if name not in self.histograms:
+                self.histograms[name] = RollingHistogram(self.window)
+            self.histograms[name].add(value)
+        self.rows.append({"step": step, **self.current})
+        self.current = {}
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profile_steps -= 1
+            if self._profile_steps <= 0:
+                self._stop_profile()
+
+    def profile(self, steps: int, path: str = None):
+        """
+        Profiles the next `steps` steps with cProfile. The statistics are dumped to `path` if given,
+        and the slowest functions are printed.
+        """
+        self._profile_steps = steps
+        self._profile_path = path
+
+    def _stop_profile(self):
+        if self._profile_path is not None:
+            Path(self._profile_path).parent.mkdir(parents=True, exist_ok=True)
+            self._profiler.dump_stats(self._profile_path)
+        output = io.StringIO()
+        pstats.Stats(self._profiler, stream=output).sort_stats("cumulative").print_stats(20)
+        print(output.getvalue())
+        self._profiler = None
+        self._profile_steps = 0
+
+    def summary(self) -> dict[str, dict]:
+        return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def export(self, path: str):
+        """
+        Writes the recorded steps to a .jsonl or .csv file, one row per step.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".jsonl":
+            with open(path, "w") as f:
+                for row in self.rows:
+                    f.write(json.dumps(row) + "\n")
+        elif path.suffix == ".csv":
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["step", *sorted(self.histograms)], restval=0)
+                writer.writeheader()
+                writer.writerows(self.rows)
+        else:
+            raise ValueError(f"Unknown metrics format {path.suffix}, use .jsonl or .csv")
+
+
+def install_profile_signal(metrics: Metrics, steps: int = 100, path: str = "profiles/step.prof"):
+    """
+    Profiles `steps` steps whenever the process receives SIGUSR1 (`kill -USR1 <pid>`), where available.
+    """
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: metrics.profile(steps, path))
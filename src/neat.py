@@ -0,0 +1,454 @@
+"""
+NEAT brains: feed-forward networks of variable topology, grown by structural mutations.
+
+A genome is a list of hidden nodes and of connections (innovation number, source, target, weight,
+enabled), the innovation numbers aligning the connections of two genomes for crossover. Node ids are
+fixed for the inputs (the vision buffer), the bias and the outputs (turn, accelerate), the hidden nodes
+get new ids when a connection is split.
+
+Networks are never evaluated by walking their graph. Every genome is compiled, when it changes, into
+the depth of its nodes and the arrays of its enabled edges; the compiled genomes of the whole population
+are then merged into a single plan, with the nodes of all the networks in one value buffer sorted by
+depth and the edges grouped by the depth of their target. A forward pass is one gather, multiply and
+scatter-add (bincount) per depth level, whatever the number and topologies of the networks.
+"""
+import numpy as np
+import genetics
+
+
+class NeatGenome:
+    """
+    Hidden node ids and connection genes of a NEAT network, as arrays.
+    """
+    __slots__ = ("hidden", "innovation", "source", "target", "weight", "enabled")
+
+    def __init__(self, hidden: np.ndarray, innovation: np.ndarray, source: np.ndarray, target: np.ndarray, weight: np.ndarray, enabled: np.ndarray) -> None:
+        self.hidden = np.asarray(hidden, dtype=np.int64)
+        self.innovation = np.asarray(innovation, dtype=np.int64)
+        self.source = np.asarray(source, dtype=np.int64)
+        self.target = np.asarray(target, dtype=np.int64)
+        self.weight = np.asarray(weight, dtype=np.float32)
+        self.enabled = np.asarray(enabled, dtype=bool)
+
+    def __len__(self):
+        return len(self.innovation)
+
+    def copy(self) -> "NeatGenome":
+        return NeatGenome(self.hidden.copy(), self.innovation.copy(), self.source.copy(), self.target.copy(), self.weight.copy(), self.enabled.copy())
+
+    def to_flat(self) -> np.ndarray:
+        """
+        Flat float32 genome, as stored in the archive and in snapshots:
+        n_hidden | n_connections | hidden | innovation | source | target | weight | enabled.
+        Ids are exact in float32 up to 2**24.
+        """
+        return np.concatenate([[len(self.hidden), len(self.innovation)], self.hidden, self.innovation, self.source,
+                               self.target, self.weight, self.enabled]).astype(np.float32)
+
+    @classmethod
+    def from_flat(cls, flat: np.ndarray) -> "NeatGenome":
+        n_hidden, n = int(flat[0]), int(flat[1])
+        parts = np.split(np.asarray(flat[2:]), np.cumsum([n_hidden, n, n, n, n]))
+        return cls(parts[0].astype(np.int64), parts[1].astype(np.int64), parts[2].astype(np.int64), parts[3].astype(np.int64),
+                   parts[4], parts[5] != 0)
+
+
+class InnovationTracker:
+    """
+    Hands out the innovation numbers of new connections and the ids of new hidden nodes. The same
+    structural mutation gets the same numbers in every genome, so that crossover can align them.
+    """
+    def __init__(self, num_fixed_nodes: int) -> None:
+        self.next_innovation = 0
+        self.next_node = num_fixed_nodes
+        self.connections: dict[tuple[int, int], int] = {}
+        self.splits: dict[int, int] = {}
+
+    def connection(self, source: int, target: int) -> int:
+        key = (source, target)
+        if key not in self.connections:
+            self.connections[key] = self.next_innovation
+            self.next_innovation += 1
+        return self.connections[key]
+
+    def split(self, innovation: int, hidden: np.ndarray) -> int:
+        """
+        Id of the node splitting the given connection, a new one if the genome already has it.
+        """
+        node = self.splits.get(innovation)
+        if node is None or node in hidden:
+            node = self.next_node
+            self.next_node += 1
+            self.splits.setdefault(innovation, node)
+        return node
+
+    def observe(self, genome: NeatGenome):
+        # genomes coming from elsewhere (archive, other islands) must not reuse numbers handed out later
+        if len(genome.innovation) > 0:
+            self.next_innovation = max(self.next_innovation, int(genome.innovation.max()) + 1)
+        if len(genome.hidden) > 0:
+            self.next_node = max(self.next_node, int(genome.hidden.max()) + 1)
+        for innovation, source, target in zip(genome.innovation.tolist(), genome.source.tolist(), genome.target.tolist()):
+            self.connections.setdefault((source, target), innovation)
+
+    def state(self) -> dict:
+        return {"next_innovation": self.next_innovation, "next_node": self.next_node,
+                "connections": [[s, t, i] for (s, t), i in self.connections.items()],
+                "splits": [[i, n] for i, n in self.splits.items()]}
+
+    def load_state(self, state: dict):
+        self.next_innovation = state["next_innovation"]
+        self.next_node = state["next_node"]
+        self.connections = {(s, t): i for s, t, i in state["connections"]}
+        self.splits = {i: n for i, n in state["splits"]}
+
+
+class CompiledGenome:
+    """
+    Evaluation order of one network: the depth of every node (inputs and bias first, then outputs, then
+    hidden nodes) and its enabled edges as local node indices.
+    """
+    __slots__ = ("depth", "source", "target", "weight")
+
+    def __init__(self, depth: np.ndarray, source: np.ndarray, target: np.ndarray, weight: np.ndarray) -> None:
+        self.depth = depth
+        self.source = source
+        self.target = target
+        self.weight = weight
+
+
+def compile_genome(genome: NeatGenome, num_fixed_nodes: int, num_inputs: int) -> CompiledGenome:
+    """
+    Local index and depth of the nodes of a genome, the depth of a node being the length of the longest
+    path from an input to it. Inputs and bias have depth 0, every other node at least 1.
+    """
+    ids = np.concatenate([np.arange(num_fixed_nodes), genome.hidden])
+    order = np.argsort(ids, kind="stable")
+    enabled = genome.enabled
+    source = order[np.searchsorted(ids[order], genome.source[enabled])]
+    target = order[np.searchsorted(ids[order], genome.target[enabled])]
+
+    depth = np.ones(len(ids), dtype=np.int64)
+    depth[:num_inputs] = 0
+    # longest paths by relaxation, one pass per level of the (acyclic) network
+    for _ in range(len(ids)):
+        relaxed = depth.copy()
+        np.maximum.at(relaxed, target, depth[source] + 1)
+        if np.array_equal(relaxed, depth):
+            break
+        depth = relaxed
+    return CompiledGenome(depth, source, target, genome.weight[enabled])
+
+
+class NeatPlan:
+    """
+    Merged evaluation order of all the networks of a population: nodes sorted by depth in one value
+    buffer, edges sorted by the depth of their target, and the slices of both for every depth level.
+    """
+    def __init__(self, compiled: list[CompiledGenome], rows: np.ndarray, num_inputs: int, num_outputs: int) -> None:
+        counts = np.array([len(c.depth) for c in compiled], dtype=np.int64)
+        offsets = (np.cumsum(counts) - counts).astype(np.int64)
+        # small unsigned integers, which numpy sorts with a radix sort
+        depth = np.concatenate([np.zeros(0, dtype=np.int64)] + [c.depth for c in compiled]).astype(np.uint16)
+        order = np.argsort(depth, kind="stable")
+        # position of every (network, local node) in the value buffer
+        position = np.empty(len(depth), dtype=np.int64)
+        position[order] = np.arange(len(depth))
+        self.num_nodes = len(depth)
+        depth = depth[order]
+
+        edge_offsets = np.repeat(offsets, [len(c.source) for c in compiled])
+        source = position[np.concatenate([np.zeros(0, dtype=np.int64)] + [c.source for c in compiled]) + edge_offsets]
+        target = position[np.concatenate([np.zeros(0, dtype=np.int64)] + [c.target for c in compiled]) + edge_offsets]
+        weight = np.concatenate([np.zeros(0, dtype=np.float32)] + [c.weight for c in compiled])
+        edge_depth = depth[target]
+        edge_order = np.argsort(edge_depth, kind="stable")
+        self.source = source[edge_order]
+        self.target = target[edge_order]
+        self.weight = weight[edge_order]
+
+        self.max_depth = int(depth[-1]) if len(depth) > 0 else 0
+        levels = np.arange(self.max_depth + 2)
+        self.node_bounds = np.searchsorted(depth, levels)
+        self.edge_bounds = np.searchsorted(edge_depth[edge_order], levels)
+        self.inputs = position[offsets[:, None] + np.arange(num_inputs)]
+        self.outputs = position[offsets[:, None] + num_inputs + np.arange(num_outputs)]
+        # row of the plan of every slot of the population, -1 if the slot is not in the plan
+        self.rows = rows
+
+    def row(self, slots: np.ndarray) -> np.ndarray:
+        rows = np.full(len(slots), -1, dtype=np.int64)
+        inside = slots < len(self.rows)
+        rows[inside] = self.rows[slots[inside]]
+        return rows
+
+    def evaluate(self, rows: np.ndarray, inputs: np.ndarray) -> np.ndarray:
+        """
+        Outputs of the networks in the given rows, for the given (N, num_inputs) inputs.
+        The other networks of the plan are evaluated on zero inputs, and ignored.
+        """
+        values = np.zeros(self.num_nodes, dtype=np.float32)
+        values[self.inputs[rows]] = inputs
+        for level in range(1, self.max_depth + 1):
+            first, last = self.node_bounds[level], self.node_bounds[level + 1]
+            start, end = self.edge_bounds[level], self.edge_bounds[level + 1]
+            contributions = values[self.source[start:end]] * self.weight[start:end]
+            sums = np.bincount(self.target[start:end] - first, weights=contributions, minlength=last - first)
+            values[first:last] = np.tanh(sums)
+        return values[self.outputs[rows]]
+
+
+class NeatBrainPopulation:
+    """
+    The NEAT networks of a whole population, evaluated together. Has the interface of a
+    brain.CNNBrainPopulation, except that genomes have variable lengths and are read and written
+    one slot at a time, as flat float32 arrays.
+
+    A slot is compiled again whenever its genome changes. Merging the plan of the whole population
+    costs as much as a few evaluations, so it is not redone for every birth: the networks changed since
+    the last merge are taken out of the main plan and evaluated with a small plan of their own, until
+    they are more than REBUILD_FRACTION of the population and everything is merged again.
+    """
+    # probability of each structural mutation of a mutated genome
+    ADD_CONNECTION_PROB = 0.1
+    ADD_NODE_PROB = 0.03
+    # random pairs of nodes tried before giving up adding a connection
+    CONNECTION_ATTEMPTS = 20
+    # fraction of the population that can change before the main plan is merged again
+    REBUILD_FRACTION = 0.05
+
+    def __init__(self, vision_width: int, vision_channels: int, num_outputs: int = 2, generator: np.random.Generator = None,
+                 tracker: InnovationTracker = None) -> None:
+        self.vision_width = vision_width
+        self.vision_channels = vision_channels
+        # the vision buffer and a constant bias
+        self.num_inputs = vision_channels * vision_width + 1
+        self.num_outputs = num_outputs
+        self.num_fixed_nodes = self.num_inputs + num_outputs
+        self.genomes: list[NeatGenome] = []
+        self.compiled: list[CompiledGenome] = []
+        self.free_slots: list[int] = []
+        # plan of all the networks but the recent ones, changed since it was merged
+        self.plan: NeatPlan = None
+        self.recent: set[int] = set()
+        self.recent_plan: NeatPlan = None
+        self.tracker = tracker if tracker is not None else InnovationTracker(self.num_fixed_nodes)
+        self.generator = generator if generator is not None else np.random.default_rng()
+
+    def __len__(self):
+        return len(self.genomes) - len(self.free_slots)
+
+    def allocate(self, initialize: bool = True) -> int:
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.genomes)
+            self.genomes.append(None)
+            self.compiled.append(None)
+        self.set_genome(slot, self.minimal_genome() if initialize else NeatGenome([], [], [], [], [], []), flat=False)
+        return slot
+
+    def free(self, slot: int):
+        self.genomes[slot] = None
+        self.compiled[slot] = None
+        self.free_slots.append(slot)
+        self._invalidate(slot)
+        self.recent.discard(slot)
+
+    def _invalidate(self, slot: int):
+        # the stale network stays in the main plan until the next merge, but is never read from it
+        if self.plan is not None and slot < len(self.plan.rows):
+            self.plan.rows[slot] = -1
+        self.recent_plan = None
+
+    def minimal_genome(self) -> NeatGenome:
+        """
+        Genome connecting every input and the bias directly to every output, with the
+        same initialization bounds as a linear layer.
+        """
+        source = np.repeat(np.arange(self.num_inputs), self.num_outputs)
+        target = np.tile(self.num_inputs + np.arange(self.num_outputs), self.num_inputs)
+        innovation = np.array([self.tracker.connection(s, t) for s, t in zip(source.tolist(), target.tolist())], dtype=np.int64)
+        bound = 1 / np.sqrt(self.num_inputs)
+        weight = self.generator.uniform(-bound, bound, len(source)).astype(np.float32)
+        return NeatGenome([], innovation, source, target, weight, np.ones(len(source), dtype=bool))
+
+    def from_affine(self, weights: np.ndarray, bias: np.ndarray) -> NeatGenome:
+        """
+        Genome computing tanh(weights @ inputs + bias), e.g. a compiled CNN brain.
+        """
+        genome = self.minimal_genome()
+        matrix = np.concatenate([np.asarray(weights).T, np.asarray(bias)[None]])
+        genome.weight = matrix[genome.source, genome.target - self.num_inputs].astype(np.float32)
+        return genome
+
+    def get_genome(self, slot: int) -> np.ndarray:
+        return self.genomes[slot].to_flat()
+
+    def set_genome(self, slot: int, genome, flat: bool = True):
+        genome = NeatGenome.from_flat(genome) if flat else genome
+        self.tracker.observe(genome)
+        self.genomes[slot] = genome
+        self.compiled[slot] = compile_genome(genome, self.num_fixed_nodes, self.num_inputs)
+        self._invalidate(slot)
+        self.recent.add(slot)
+
+    def mutate(self, slots: np.ndarray, mutation_prob: float, mutation_amount: float):
+        for slot in np.atleast_1d(slots).tolist():
+            self.set_genome(slot, self.mutated(self.genomes[slot], mutation_prob, mutation_amount), flat=False)
+
+    def breed(self, parent_slots: np.ndarray, child_slots: np.ndarray, crossover_prob: float, mutation_prob: float, mutation_amount: float):
+        """
+        Sets the genome of every child to the one of its parent, crossed over with the genome of another
+        parent with probability crossover_prob, then mutated.
+        """
+        parents = [self.genomes[slot] for slot in parent_slots.tolist()]
+        crossed = np.zeros(len(parents), dtype=bool)
+        partners = np.arange(len(parents))
+        if crossover_prob > 0 and len(parents) > 1:
+            partners = self.generator.permutation(len(parents))
+            crossed = self.generator.random(len(parents)) < crossover_prob
+        for child, parent, partner, cross in zip(child_slots.tolist(), parents, partners.tolist(), crossed.tolist()):
+            genome = self.crossover(parent, parents[partner]) if cross else parent.copy()
+            self.set_genome(child, self.mutated(genome, mutation_prob, mutation_amount), flat=False)
+
+    def crossover(self, genome: NeatGenome, other: NeatGenome) -> NeatGenome:
+        """
+        Child with the topology of the first genome, taking the weight of every connection shared
+        with the other genome (same innovation) from either of them with equal probability.
+        """
+        child = genome.copy()
+        _, ours, theirs = np.intersect1d(genome.innovation, other.innovation, return_indices=True)
+        take = self.generator.random(len(ours)) < 0.5
+        child.weight[ours[take]] = other.weight[theirs[take]]
+        return child
+
+    def mutated(self, genome: NeatGenome, mutation_prob: float, mutation_amount: float) -> NeatGenome:
+        genome = genome.copy()
+        genome.weight = genetics.mutate(genome.weight, mutation_prob, mutation_amount, self.generator)
+        if self.generator.random() < self.ADD_CONNECTION_PROB:
+            self._add_connection(genome)
+        if self.generator.random() < self.ADD_NODE_PROB:
+            self._add_node(genome)
+        return genome
+
+    def _add_connection(self, genome: NeatGenome):
+        sources = np.concatenate([np.arange(self.num_inputs), genome.hidden])
+        targets = np.concatenate([self.num_inputs + np.arange(self.num_outputs), genome.hidden])
+        existing = set(zip(genome.source.tolist(), genome.target.tolist()))
+        for _ in range(self.CONNECTION_ATTEMPTS):
+            source = int(sources[self.generator.integers(len(sources))])
+            target = int(targets[self.generator.integers(len(targets))])
+            if source == target or (source, target) in existing or self._reaches(genome, target, source):
+                continue
+            self._append(genome, source, target, self.generator.normal(0, 1))
+            return
+
+    def _add_node(self, genome: NeatGenome):
+        enabled = np.flatnonzero(genome.enabled)
+        if len(enabled) == 0:
+            return
+        split = int(enabled[self.generator.integers(len(enabled))])
+        node = self.tracker.split(int(genome.innovation[split]), genome.hidden)
+        genome.enabled[split] = False
+        genome.hidden = np.append(genome.hidden, node)
+        self._append(genome, int(genome.source[split]), node, 1.0)
+        self._append(genome, node, int(genome.target[split]), float(genome.weight[split]))
+
+    def _append(self, genome: NeatGenome, source: int, target: int, weight: float):
+        genome.innovation = np.append(genome.innovation, self.tracker.connection(source, target))
+        genome.source = np.append(genome.source, source)
+        genome.target = np.append(genome.target, target)
+        genome.weight = np.append(genome.weight, np.float32(weight))
+        genome.enabled = np.append(genome.enabled, True)
+
+    def _reaches(self, genome: NeatGenome, start: int, end: int) -> bool:
+        # whether a path goes from start to end, in which case an edge from end to start closes a cycle
+        children: dict[int, list[int]] = {}
+        for source, target in zip(genome.source.tolist(), genome.target.tolist()):
+            children.setdefault(source, []).append(target)
+        stack, seen = [start], {start}
+        while stack:
+            node = stack.pop()
+            if node == end:
+                return True
+            for child in children.get(node, ()):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return False
+
+    def merge(self, slots: list[int]) -> NeatPlan:
+        rows = np.full(len(self.compiled), -1, dtype=np.int64)
+        rows[slots] = np.arange(len(slots))
+        return NeatPlan([self.compiled[slot] for slot in slots], rows, self.num_inputs, self.num_outputs)
+
+    def update_plans(self):
+        if self.plan is None or len(self.recent) > self.REBUILD_FRACTION * len(self):
+            self.plan = self.merge([slot for slot, compiled in enumerate(self.compiled) if compiled is not None])
+            self.recent = set()
+            self.recent_plan = None
+        if len(self.recent) > 0 and self.recent_plan is None:
+            self.recent_plan = self.merge(sorted(self.recent))
+
+    def forward(self, slots: np.ndarray, vision_buffers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the networks in the given slots on a (N, vision_channels, vision_width) batch of vision buffers.
+        Returns the turn and acceleration outputs as two arrays of shape (N,).
+        """
+        if len(slots) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+        self.update_plans()
+        slots = np.asarray(slots)
+        inputs = np.concatenate([vision_buffers.reshape(len(slots), -1), np.ones((len(slots), 1), dtype=np.float32)], axis=1)
+        rows = self.plan.row(slots)
+        main = rows >= 0
+        if main.all():
+            outputs = self.plan.evaluate(rows, inputs)
+        else:
+            outputs = np.empty((len(slots), self.num_outputs), dtype=np.float32)
+            outputs[main] = self.plan.evaluate(rows[main], inputs[main])
+            recent = ~main
+            outputs[recent] = self.recent_plan.evaluate(self.recent_plan.row(slots[recent]), inputs[recent])
+        return outputs[:, 0], outputs[:, 1]
+
+
+class NeatBrain:
+    """
+    Handle to a single network stored in a NeatBrainPopulation, with the interface of a brain.PopulationBrain.
+    """
+    def __init__(self, population: NeatBrainPopulation, initialize: bool = True) -> None:
+        self.population = population
+        self.slot = population.allocate(initialize)
+
+    def __call__(self, vision_buffer: np.ndarray, energy: float, speed: float):
+        turn, accelerate = self.population.forward(np.array([self.slot]), np.asarray(vision_buffer, dtype=np.float32)[None])
+        return turn[0], accelerate[0]
+
+    def mutate(self, mutation_prob: float, mutation_amount: float):
+        self.population.mutate(np.array([self.slot]), mutation_prob, mutation_amount)
+
+    def get_genome(self) -> np.ndarray:
+        """
+        Returns the genome as a flat float32 array, see NeatGenome.to_flat.
+        """
+        return self.population.get_genome(self.slot)
+
+    def set_genome(self, genome: np.ndarray):
+        self.population.set_genome(self.slot, genome)
+
+    def release(self):
+        """
+        Frees the slot in the shared population, moving the genome into a private one
+        so that the brain can still be read (e.g. by the best goopies) after its goopie died.
+        """
+        genome = self.population.genomes[self.slot]
+        self.population.free(self.slot)
+        self.population = NeatBrainPopulation(self.population.vision_width, self.population.vision_channels, self.population.num_outputs,
+                                              generator=self.population.generator, tracker=self.population.tracker)
+        self.slot = self.population.allocate(initialize=False)
+        self.population.set_genome(self.slot, genome, flat=False)
+
+    def __str__(self):
+        genome = self.population.genomes[self.slot]
+        return f"NEAT Brain with {len(genome.hidden)} hidden nodes and {int(genome.enabled.sum())} connections in slot {self.slot}."
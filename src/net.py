@@ -1,5 +1,5 @@
 import torch
-from brain import Brain
+from torch_brain import Brain
 
 model = Brain(10, 3)
 state_dict = torch.load("checkpoints/manual/net.pt")
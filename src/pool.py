@@ -0,0 +1,41 @@
+class ObjectPool:
+    """
+    Free list of objects of the same kind that are expensive to create (pymunk bodies and shapes, sprites).
+    Released objects are handed out again by `acquire`, and the caller re-initializes them in place;
+    on a miss `acquire` returns None and the caller creates a new object.
+
+    Hits and misses are counted, so that the pool can be sized for the steady state of a population:
+    once the births are balanced by the deaths, almost every acquire should be a hit.
+    """
+    def __init__(self, max_size: int = None) -> None:
+        self.max_size = max_size
+        self.free: list = []
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self):
+        if len(self.free) > 0:
+            self.hits += 1
+            return self.free.pop()
+        self.misses += 1
+        return None
+
+    def release(self, obj):
+        if self.max_size is not None and len(self.free) >= self.max_size:
+            self.discarded += 1
+            return
+        self.free.append(obj)
+
+    def stats(self) -> dict:
+        acquired = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / acquired if acquired > 0 else 0.0,
+            "free": len(self.free),
+            "discarded": self.discarded,
+        }
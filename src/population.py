@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class PopulationStore:
+    """
+    Structure-of-arrays store for the state of the goopies. Every goopie owns a slot, and each
+    of its fields lives in a contiguous NumPy array indexed by slot, so that the per-tick updates
+    (metabolism, aging, death, reproduction eligibility) run vectorized over the whole population.
+    """
+
+    # name, dtype and initial value of every field of a goopie, the id is assigned on allocation
+    FIELDS = {
+        "id": (np.int64, -1),
+        "parent_id": (np.int64, -1),
+        "energy": (np.float64, 0.5),
+        "age": (np.float64, 0.0),
+        "fitness": (np.float64, 0.0),
+        "alive": (np.bool_, True),
+        "max_turn": (np.float64, 1.0),
+        "max_acceleration": (np.float64, 20.0),
+        "max_speed": (np.float64, 200.0),
+    }
+
+    def __init__(self, capacity: int = 64) -> None:
+        for name, (dtype, _) in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.next_id = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.energy)
+
+    def __len__(self):
+        return self.capacity - len(self.free_slots)
+
+    def allocate(self) -> int:
+        """
+        Reserves a slot for a new goopie, with all its fields set to their initial value.
+        """
+        if len(self.free_slots) == 0:
+            capacity = self.capacity
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+            self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free_slots.pop()
+        for name, (_, value) in self.FIELDS.items():
+            getattr(self, name)[slot] = value
+        self.id[slot] = self.next_id
+        self.next_id += 1
+        return slot
+
+    def free(self, slot: int):
+        self.alive[slot] = False
+        self.free_slots.append(slot)
+
+    def detach(self, slot: int) -> tuple["PopulationStore", int]:
+        """
+        Frees the slot, moving its fields into a new private store so that they can still be
+        read after the goopie left the simulation. Returns the new store and slot.
+        """
+        store = PopulationStore(capacity=1)
+        new_slot = store.free_slots.pop()
+        for name in self.FIELDS:
+            getattr(store, name)[new_slot] = getattr(self, name)[slot]
+        self.free(slot)
+        return store, new_slot
+
+    def metabolize(self, slots: np.ndarray, dt: float, rate: float) -> float:
+        """
+        Consumes the energy of the goopies in the given slots and makes them older,
+        killing the ones that run out of energy.
+        Returns the total energy consumed, which goes back to the biomass.
+        """
+        self.energy[slots] -= rate * dt
+        self.age[slots] += dt
+        self.alive[slots] &= self.energy[slots] > 0
+        return rate * dt * len(slots)
+
+    def can_reproduce(self, slots: np.ndarray, min_age: float, min_energy: float) -> np.ndarray:
+        """
+        Boolean mask of the goopies in the given slots that are old and fed enough to reproduce.
+        """
+        return (self.age[slots] > min_age) & (self.energy[slots] > min_energy)
@@ -0,0 +1,161 @@
+"""
+Records the frames drawn by the window into a single compressed file.
+
+The render thread only reads the color buffer back into a reused NumPy array and puts it on a bounded
+queue; a background thread downscales, compresses and writes the frames into one zip archive (one
+deflated .npy entry per frame and a metadata.json entry). When the writer falls behind and the queue
+is full, the new frames are dropped and counted instead of stalling the rendering.
+
+The recordings are read back with `load_frames`, or converted to numbered PNG images with
+
+    python src/recorder.py recording.zip --png frames/
+"""
+import argparse
+import io
+import json
+import queue
+import threading
+import zipfile
+import numpy as np
+from pool import ObjectPool
+
+
+class FrameRecorder:
+    """
+    Parameters
+    ----------
+    path : str
+        zip file the frames are written to
+    every : int
+        records one frame every `every` drawn frames
+    downscale : int
+        integer factor the resolution of the frames is divided by, averaging blocks of pixels
+    queue_size : int
+        frames waiting for the writer before new ones are dropped
+    compression : int
+        deflate level of the frames, from 0 (fastest) to 9 (smallest)
+    """
+    def __init__(self, path: str, every: int = 1, downscale: int = 1, queue_size: int = 8, compression: int = 1) -> None:
+        if every < 1 or downscale < 1:
+            raise ValueError("The frame decimation and downscale factor must be at least 1.")
+        self.path = path
+        self.every = every
+        self.downscale = downscale
+        self.frame = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.shape: tuple = None
+        self.buffers = ObjectPool()
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compression)
+        self.error: BaseException = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def capture(self, width: int, height: int):
+        """
+        Reads the color buffer of the current GL context back, to be written by the background thread.
+        Called once per drawn frame, after drawing.
+        """
+        from pyglet import gl
+
+        if self.error is not None:
+            raise RuntimeError("The frame recorder stopped with an error.") from self.error
+        self.frame += 1
+        if (self.frame - 1) % self.every != 0:
+            return
+        if self.queue.full():
+            self.dropped += 1
+            return
+        if self.shape != (height, width, 3):
+            # the window was resized, the buffers of the old size are not reused
+            self.shape = (height, width, 3)
+            self.buffers = ObjectPool()
+        buffer = self.buffers.acquire()
+        if buffer is None:
+            buffer = np.empty(self.shape, dtype=np.uint8)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        gl.glReadPixels(0, 0, width, height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, buffer.ctypes.data)
+        self.queue.put((self.recorded, buffer))
+        self.recorded += 1
+
+    def _write(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                index, buffer = item
+                # OpenGL rows start from the bottom of the image
+                frame = buffer[::-1]
+                if self.downscale > 1:
+                    frame = _downscale(frame, self.downscale)
+                data = io.BytesIO()
+                np.save(data, np.ascontiguousarray(frame))
+                self.archive.writestr(f"frame-{index:06d}.npy", data.getvalue())
+                if buffer.shape == self.shape:
+                    self.buffers.release(buffer)
+        except BaseException as e:
+            self.error = e
+
+    def close(self):
+        """
+        Writes the frames still in the queue and closes the file.
+        """
+        self.queue.put(None)
+        self._thread.join()
+        metadata = {"frames": self.recorded, "dropped": self.dropped, "every": self.every, "downscale": self.downscale}
+        self.archive.writestr("metadata.json", json.dumps(metadata))
+        self.archive.close()
+        if self.error is not None:
+            raise RuntimeError("The frame recorder stopped with an error.") from self.error
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "dropped": self.dropped, "buffers": self.buffers.stats()}
+
+
+def _downscale(frame: np.ndarray, factor: int) -> np.ndarray:
+    height = frame.shape[0] // factor * factor
+    width = frame.shape[1] // factor * factor
+    # integer sums of strided views, several times faster than a float mean over reshaped blocks
+    total = np.zeros((height // factor, width // factor, 3), dtype=np.uint16 if factor <= 16 else np.uint32)
+    for i in range(factor):
+        for j in range(factor):
+            total += frame[i:height:factor, j:width:factor]
+    return (total // (factor * factor)).astype(np.uint8)
+
+
+def load_frames(path: str):
+    """
+    Yields the (height, width, 3) uint8 frames of a recording, in order.
+    """
+    with zipfile.ZipFile(path) as archive:
+        names = sorted(name for name in archive.namelist() if name.endswith(".npy"))
+        for name in names:
+            with archive.open(name) as file:
+                yield np.load(io.BytesIO(file.read()))
+
+
+def export_png(path: str, directory: str):
+    """
+    Writes the frames of a recording as numbered PNG images in the given directory.
+    """
+    from pathlib import Path
+    import pyglet
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    count = 0
+    for i, frame in enumerate(load_frames(path)):
+        height, width, _ = frame.shape
+        image = pyglet.image.ImageData(width, height, "RGB", frame[::-1].tobytes())
+        image.save(str(Path(directory) / f"frame-{i:06d}.png"))
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts a recording of the simulation to PNG images.")
+    parser.add_argument("recording", type=str, help="zip file written by --record")
+    parser.add_argument("--png", type=str, required=True, help="directory the PNG frames are written to")
+    args = parser.parse_args()
+    print(f"{export_png(args.recording, args.png)} frames written to {args.png}")
@@ -0,0 +1,62 @@
+class EntityRegistry:
+    """
+    Dense collection of the entities (goopies or food) living in a simulation.
+
+    Every entity gets a stable integer id, stored in its `entity_id` attribute, which is never reused.
+    Entities are kept in a dense list for fast iteration, and a dict maps each id to its position in
+    the list, so that membership, insertion and removal are all O(1): removing swaps the last entity
+    into the hole. The iteration order is therefore not the insertion order once something was removed.
+
+    Entities can also be marked as consumed for the current tick, so that duplicate events on the same
+    entity (e.g. several goopies touching the same food) are dropped with a single set lookup.
+    """
+    def __init__(self) -> None:
+        self.entities: list = []
+        self.index: dict[int, int] = {}
+        self.consumed: set[int] = set()
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __getitem__(self, i: int):
+        return self.entities[i]
+
+    def __contains__(self, entity) -> bool:
+        return entity.entity_id in self.index
+
+    def add(self, entity) -> int:
+        """
+        Adds the entity, returning its new id.
+        """
+        entity.entity_id = self.next_id
+        self.next_id += 1
+        self.index[entity.entity_id] = len(self.entities)
+        self.entities.append(entity)
+        return entity.entity_id
+
+    def extend(self, entities: list):
+        for entity in entities:
+            self.add(entity)
+
+    def remove(self, entity):
+        position = self.index.pop(entity.entity_id)
+        last = self.entities.pop()
+        if last is not entity:
+            self.entities[position] = last
+            self.index[last.entity_id] = position
+
+    def mark_consumed(self, entity):
+        self.consumed.add(entity.entity_id)
+
+    def is_consumed(self, entity) -> bool:
+        return entity.entity_id in self.consumed
+
+    def clear_consumed(self):
+        """
+        Forgets the consumed marks, at the beginning of every tick.
+        """
+        self.consumed.clear()
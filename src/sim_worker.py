@@ -0,0 +1,132 @@
+"""
+Runs the simulation on a worker thread, decoupled from the rendering.
+
+The worker steps the simulation and, every `steps_per_frame` steps, publishes what the renderer needs
+(positions and angles of goopies and food, a few stats) into the back half of a double buffer, then
+swaps it with the front half. The renderer only ever reads the front half, so it never waits for a
+step to finish: when it falls behind, the snapshots published in between are simply skipped.
+"""
+import contextlib
+import threading
+import timeit
+import numpy as np
+
+
+class RenderSnapshot:
+    """
+    Everything the renderer reads from one step of the simulation. The arrays are reused between
+    publications, and only reallocated when the population outgrows them.
+    """
+    def __init__(self) -> None:
+        self.sequence = 0
+        self.step = 0
+        self.goopies = np.zeros((0, 3), dtype=np.float32)
+        self.food = np.zeros((0, 3), dtype=np.float32)
+        self.best_fitness = 0.0
+        self.last_fitness = 0.0
+        self.steps_per_second = 0.0
+
+    def fill(self, simulation, sequence: int, steps_per_second: float):
+        goopies, food = simulation.render_instances()
+        self.goopies = _copy_into(self.goopies, goopies)
+        self.food = _copy_into(self.food, food)
+        self.sequence = sequence
+        self.step = simulation.num_steps
+        self.best_fitness = simulation.best_fitness
+        self.last_fitness = simulation.best_goopies[-1].fitness if len(simulation.best_goopies) > 0 else 0.0
+        self.steps_per_second = steps_per_second
+
+
+def _copy_into(buffer: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # the returned view has the length of the values, on top of a buffer that only grows
+    if buffer.base is not None and len(buffer.base) >= len(values):
+        buffer = buffer.base
+    elif len(buffer) < len(values):
+        buffer = np.empty((2 * len(values), values.shape[1]), dtype=values.dtype)
+    buffer[:len(values)] = values
+    return buffer[:len(values)]
+
+
+class SimulationWorker:
+    """
+    Steps the simulation on a background thread.
+
+    Parameters
+    ----------
+    steps_per_frame : int
+        simulation steps between two published snapshots
+    unlimited : bool
+        run as fast as possible instead of at `steps_per_frame` steps per frame of the renderer
+    frame_rate : float
+        frames per second of the renderer, which paces the simulation unless unlimited
+    """
+    def __init__(self, simulation, steps_per_frame: int = 1, unlimited: bool = False, frame_rate: float = 60.0) -> None:
+        self.simulation = simulation
+        self.steps_per_frame = steps_per_frame
+        self.unlimited = unlimited
+        self.frame_rate = frame_rate
+        self.buffers = [RenderSnapshot(), RenderSnapshot()]
+        self.buffers[0].fill(simulation, 0, 0.0)
+        self.front = 0
+        self.lock = threading.Lock()
+        self.published = 0
+        self.drawn = 0
+        self.skipped = 0
+        self._last_read = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+        self.error: BaseException = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        timer = timeit.default_timer
+        next_frame_time = timer()
+        last_publish_time = timer()
+        try:
+            while not self._stop.is_set():
+                for _ in range(self.steps_per_frame):
+                    self.simulation.step()
+                now = timer()
+                self._publish(self.steps_per_frame / max(now - last_publish_time, 1e-9))
+                last_publish_time = now
+                if not self.unlimited:
+                    next_frame_time += 1 / self.frame_rate
+                    delay = next_frame_time - timer()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                    else:
+                        # slower than real time, do not try to catch up
+                        next_frame_time = timer()
+        except BaseException as e:
+            self.error = e
+
+    def _publish(self, steps_per_second: float):
+        back = self.buffers[1 - self.front]
+        back.fill(self.simulation, self.published + 1, steps_per_second)
+        with self.lock:
+            self.front = 1 - self.front
+            self.published += 1
+
+    @contextlib.contextmanager
+    def read(self):
+        """
+        Gives the latest published snapshot, which is not modified until the block exits.
+        """
+        if self.error is not None:
+            raise RuntimeError("The simulation worker stopped with an error.") from self.error
+        with self.lock:
+            snapshot = self.buffers[self.front]
+            if snapshot.sequence != self._last_read:
+                self.drawn += 1
+                self.skipped += max(snapshot.sequence - self._last_read - 1, 0)
+                self._last_read = snapshot.sequence
+            yield snapshot
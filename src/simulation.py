@@ -1,16 +1,28 @@
 import pymunk
-from goopie import Goopie, CNNGoopie
-from vision import Vision
+from goopie import Goopie, CNNGoopie, NEATGoopie
+from vision import Vision, WideVision, WideVisionEngine, RayVision, RayVisionEngine, default_vision_width
+from brain import CNNBrainPopulation, load_state_dict_file
+from neat import NeatBrainPopulation
 from food import Food
+from food_field import FoodField
+from broadphase import BroadphaseTuner
+from spatial_index import SpatialGrid
+from population import PopulationStore
+from archive import GenomeArchive
+from metrics import Metrics, install_profile_signal
+from registry import EntityRegistry
+from lifecycle import LifecycleQueue
+from pool import ObjectPool
+import genetics
 import numpy as np
-import torch
 import math
 import timeit
-from pathlib import Path
 
 class Simulation:
     WALL_COLLISION_TYPE = 4
-    def __init__(self, num_goopies, num_food, space_size, test: bool = False, random_respawn_rate: float = 0.5, mutation_prob = 0.5, mutation_amount = 0.1, blueprint: str = None) -> None:
+    def __init__(self, num_goopies, num_food, space_size, test: bool = False, random_respawn_rate: float = 0.5, mutation_prob = 0.5, mutation_amount = 0.1, blueprint: str = None, vision_sensors: bool = False, seed: int = 42, archive_path: str = None, crossover_prob: float = 0.0, blueprint_record: int = None, brain_backend: str = "torch",
+                 compile_brains: bool = False, verify_brains: bool = False, brain_type: str = "cnn", vision_mode: str = "wide",
+                 vision_width: int = None, food_layer: str = "pymunk", broadphase: str = "bbtree") -> None:
         super().__init__()
         self.num_goopies = num_goopies
         self.num_food = num_food
@@ -19,28 +31,64 @@ class Simulation:
         self.random_respawn_rate = random_respawn_rate
         self.mutation_prob = mutation_prob
         self.mutation_amount = mutation_amount
+        # probability of a child genome being crossed over with the genome of another parent born in the same step
+        self.crossover_prob = crossover_prob
+        # perceive through pymunk sensor circles instead of the spatial grids
+        self.vision_sensors = vision_sensors
+        # "torch" or "numpy", torch is never imported with the numpy backend
+        self.brain_backend = brain_backend
+        # evaluate the brains as single affine maps before the tanh, checked against their layers if verify_brains
+        self.compile_brains = compile_brains
+        self.verify_brains = verify_brains
+        # "cnn" brains of fixed topology, or "neat" networks growing their own
+        if brain_type not in ("cnn", "neat"):
+            raise ValueError(f"Unknown brain type {brain_type}, expected cnn or neat.")
+        self.brain_type = brain_type
+        self.goopie_class = NEATGoopie if brain_type == "neat" else CNNGoopie
+        # "wide" angular bins, or "rays" cast around every goopie, both cast from the spatial grids
+        if vision_mode not in ("wide", "rays"):
+            raise ValueError(f"Unknown vision mode {vision_mode}, expected wide or rays.")
+        if vision_mode == "rays" and vision_sensors:
+            raise ValueError("The ray vision is cast from the spatial grids, it cannot use the pymunk vision sensors.")
+        self.vision_mode = vision_mode
+        self.vision_class = RayVision if vision_mode == "rays" else WideVision
+        # bins or rays of the vision, only changed to run brains trained with another width
+        self.vision_width = vision_width if vision_width is not None else default_vision_width(vision_mode)
+        # "pymunk" bodies and circles, or a "field" of NumPy arrays that never enters the space
+        if food_layer not in ("pymunk", "field"):
+            raise ValueError(f"Unknown food layer {food_layer}, expected pymunk or field.")
+        if food_layer == "field" and vision_sensors:
+            raise ValueError("The food field has no pymunk shapes, the pymunk vision sensors cannot see it.")
+        self.food_layer = food_layer
+        # "bbtree" or spatial "hash" broadphase of the pymunk space, or "auto" to periodically pick the fastest
+        self.broadphase = broadphase
+        self.broadphase_tuner = BroadphaseTuner(broadphase)
+        # archive where the best goopies are periodically appended, never if None
+        self.archive = GenomeArchive(archive_path) if archive_path is not None else None
+        self.archived_ids: set[int] = set()
 
         # biomass is collected whenever a goopie consumes energy
         self.biomass = 0
 
-        self.generator = np.random.default_rng(42)
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
         self.goopie_spawn_range = space_size * 0.8
         self.food_spawn_range = space_size - (2 * 10 + Food.RADIUS) # 2 * wall width + food radius
         self.num_steps = 0
+        self.phase_times: dict[str, float] = {}
+        # timers and counters of every step, over a rolling window
+        self.metrics = Metrics()
         self.best_goopies: list[Goopie] = []
         self.fitness_thresh = 0
         self.best_fitness = 0
 
-        if blueprint is not None:
-            self.add_blueprint(blueprint)
-        # create all the goopies, food and walls together with pymunk objects for everything
-        self.space: pymunk.Space = pymunk.Space()
         self.window = None
-        self.set_collision_handlers()
-        
-        self.create_walls()
+        self.create_world()
 
-        self.goopies :list[Goopie] = []
+        if blueprint is not None:
+            self.add_blueprint(blueprint, blueprint_record)
+
+        # create all the goopies and food together with pymunk objects for everything
         if test:
             # goopie1 = CNNGoopie(self, 0, 0, math.pi/4)
             # goopie2 = CNNGoopie(self, 50, 50, math.pi/4)
@@ -52,32 +100,82 @@ class Simulation:
             for _ in range(num_goopies):
                 self.spawn_goopie(random_respawn_rate, 0.0, 0.0)
         
-        self.foods :list[Food] = []
         if test:
             print("FOOD!")
-            food1 = Food(100, 100)
-            food2 = Food(250, 50)
-            food3 = Food(200, -200)
-            food4 = Food(0, -200)
-            #food5 = Food(400, -400)
-            self.add_food(food1)
-            self.add_food(food2)
-            self.add_food(food3)
-            self.add_food(food4)
+            if self.food_field is not None:
+                self.food_field.add(np.array([(100, 100), (250, 50), (200, -200), (0, -200)]))
+            else:
+                food1 = Food(100, 100)
+                food2 = Food(250, 50)
+                food3 = Food(200, -200)
+                food4 = Food(0, -200)
+                #food5 = Food(400, -400)
+                self.add_food(food1)
+                self.add_food(food2)
+                self.add_food(food3)
+                self.add_food(food4)
+        elif self.food_field is not None:
+            self.food_field.add(self.generator.uniform(-self.food_spawn_range, self.food_spawn_range, size=(num_food, 2)))
         else:
             for _ in range(num_food):
-                food = Food(generation_range=self.food_spawn_range, generator=self.generator)
-                self.add_food(food)
+                self.add_food(self.new_food())
+
+
 
+    def create_world(self):
+        """
+        Creates an empty world: the population-wide stores, the spatial grids and the pymunk space with its walls.
+        """
+        # state of every goopie, stored as arrays to update the whole population at once
+        self.population = PopulationStore()
+        # weights of every CNN brain are stored together, so that the whole population thinks in one call
+        if self.brain_type == "neat":
+            self.brains = NeatBrainPopulation(self.vision_width, 3, generator=self.generator)
+        else:
+            self.brains = CNNBrainPopulation(self.vision_width, 3, generator=self.generator, backend=self.brain_backend,
+                                             compiled=self.compile_brains, verify=self.verify_brains)
+        # same for the vision buffers, which are painted all together after the space step
+        if self.vision_mode == "rays":
+            self.vision_engine = RayVisionEngine(self.vision_width, 3, Vision.VISION_RADIUS, Goopie.RADIUS)
+        else:
+            self.vision_engine = WideVisionEngine(self.vision_width, 3, Vision.VISION_RADIUS, Goopie.RADIUS)
+        # spatial indexes used to find what every goopie sees, cells are as big as the vision reach
+        self.goopie_grid = SpatialGrid(Vision.VISION_RADIUS + Goopie.RADIUS)
+        if self.food_layer == "field":
+            # the grid of the food field is also the one seen by the goopies, its cells are as big as the eating
+            # reach: with many food items they keep the eating queries small, and the vision queries tighter
+            self.food_field = FoodField(2 * (Goopie.RADIUS + Food.RADIUS))
+            self.food_grid = self.food_field.grid
+        else:
+            self.food_field = None
+            self.food_grid = SpatialGrid(Vision.VISION_RADIUS + Goopie.RADIUS)
+        # births, deaths and food changes of the current step, committed together at its end
+        self.lifecycle = LifecycleQueue()
+        # bodies and shapes of dead goopies and eaten food, reused for the next ones
+        self.goopie_shape_pool = ObjectPool()
+        self.food_pool = ObjectPool()
 
+        self.space: pymunk.Space = pymunk.Space()
+        self.broadphase_tuner.configure(self.space, self)
+        self.set_collision_handlers()
+        self.create_walls()
+
+        self.goopies: EntityRegistry = EntityRegistry()
+        self.foods: EntityRegistry = EntityRegistry()
 
     def set_collision_handlers(self):
+        # pairs of collision types handled by the simulation
+        self.space_handlers = [(Goopie.COLLISION_TYPE, Food.COLLISION_TYPE)]
         goopie_food_collision_handler = self.space.add_collision_handler(Goopie.COLLISION_TYPE, Food.COLLISION_TYPE)
+        goopie_food_collision_handler.pre_solve = self.goopie_food_collision
+        if not self.vision_sensors:
+            return
+
+        self.space_handlers += [(Vision.VISION_COLLISION_TYPE, t) for t in (Food.COLLISION_TYPE, Goopie.COLLISION_TYPE, self.WALL_COLLISION_TYPE)]
+
         vision_food_collision_handler = self.space.add_collision_handler(Vision.VISION_COLLISION_TYPE, Food.COLLISION_TYPE)
         vision_goopie_collision_handler = self.space.add_collision_handler(Vision.VISION_COLLISION_TYPE, Goopie.COLLISION_TYPE)
         vision_wall_collision_handler = self.space.add_collision_handler(Vision.VISION_COLLISION_TYPE, self.WALL_COLLISION_TYPE)
-
-        goopie_food_collision_handler.pre_solve = self.goopie_food_collision
         vision_food_collision_handler.pre_solve = self.vision_food_collision
         vision_goopie_collision_handler.pre_solve = self.vision_goopie_collision
         vision_wall_collision_handler.pre_solve = self.vision_wall_collision
@@ -86,24 +184,32 @@ class Simulation:
     def goopie_food_collision(self, arbiter: pymunk.Arbiter, space: pymunk.Space, data):
         goopie:Goopie = arbiter.shapes[0].goopie
         food:Food = arbiter.shapes[1].food
-        if food in self.foods:
+        self.metrics.count("food_contacts")
+        # several goopies can touch the same food in a single step
+        if food in self.foods and not self.foods.is_consumed(food):
             if goopie.eat(food):
-                self.remove_food(food)
+                # the food stays visible until the end of the step, like the pymunk sensors still report it
+                self.foods.mark_consumed(food)
+                self.lifecycle.eaten_food.append(food)
+                self.metrics.count("food_eaten")
         return False
 
     def vision_food_collision(self, arbiter: pymunk.Arbiter, space: pymunk.Space, data):
         goopie:Goopie = arbiter.shapes[0].goopie
         goopie.update_vision(arbiter.shapes[1], "food")
+        self.metrics.count("seen_food")
         return False
     
     def vision_goopie_collision(self, arbiter: pymunk.Arbiter, space: pymunk.Space, data):
         goopie:Goopie = arbiter.shapes[0].goopie
         goopie.update_vision(arbiter.shapes[1], "goopie")
+        self.metrics.count("seen_goopies")
         return False
 
     def vision_wall_collision(self, arbiter: pymunk.Arbiter, space: pymunk.Space, data):
         goopie:Goopie = arbiter.shapes[0].goopie
         goopie.update_vision(arbiter.shapes[1], "wall")
+        self.metrics.count("seen_walls")
         return False
     
     def create_walls(self):
@@ -121,77 +227,425 @@ class Simulation:
             wall.elasticity = 0.8
             wall.friction = 1.0
             self.space.add(wall)
+        # endpoints of the walls as arrays, to find the goopies seeing them in bulk
+        self.wall_a = np.array([tuple(wall.a) for wall in self.walls])
+        self.wall_b = np.array([tuple(wall.b) for wall in self.walls])
+        self.wall_radii = np.array([wall.radius for wall in self.walls])
+
+    def add_goopie(self, goopie: Goopie):
+        self.add_goopies([goopie])
+
+    def add_goopies(self, goopies: list[Goopie]):
+        """
+        Adds many goopies at once, with a single space, grid, registry and window update.
+        """
+        if len(goopies) == 0:
+            return
+        vision_shapes = [g.vision_shape for g in goopies if g.vision_shape is not None]
+        self.space.add(*[g.shape.body for g in goopies], *[g.shape for g in goopies], *vision_shapes)
+        positions = np.array([tuple(g.get_position()) for g in goopies]).reshape(-1, 2)
+        angles = np.array([g.shape.body.angle for g in goopies])
+        slots = self.goopie_grid.insert_many(positions, np.array([g.RADIUS for g in goopies]), goopies, angles)
+        for goopie, slot in zip(goopies, slots.tolist()):
+            goopie.grid_slot = slot
+        self.goopies.extend(goopies)
+        if self.window is not None and not self.window.headless:
+            self.window.add_goopie_sprites(goopies)
 
     def remove_goopie(self, goopie: Goopie):
-        self.goopies.remove(goopie)
-        self.space.remove(goopie.shape.body)
-        self.space.remove(goopie.shape)
-        self.space.remove(goopie.vision_shape)
-        if goopie.sprite is not None:
-            goopie.sprite.delete()
-        if goopie.vision_arc is not None:
-            goopie.vision_arc.delete()
+        self.remove_goopies([goopie])
+
+    def remove_goopies(self, goopies: list[Goopie]):
+        """
+        Removes many goopies at once, with a single space, grid, registry and window update.
+        """
+        if len(goopies) == 0:
+            return
+        vision_shapes = [g.vision_shape for g in goopies if g.vision_shape is not None]
+        self.space.remove(*[g.shape.body for g in goopies], *[g.shape for g in goopies], *vision_shapes)
+        self.goopie_grid.remove_many([g.grid_slot for g in goopies])
+        for goopie in goopies:
+            self.goopies.remove(goopie)
+            goopie.release()
+        if self.window is not None and not self.window.headless:
+            self.window.remove_goopie_sprites(goopies)
+
+    def add_food(self, food: Food):
+        self.add_foods([food])
+
+    def add_foods(self, foods: list[Food]):
+        """
+        Adds many foods at once, with a single space, grid, registry and window update.
+        """
+        if len(foods) == 0:
+            return
+        shapes = [food.shape for food in foods]
+        self.space.add(*[shape.body for shape in shapes], *shapes)
+        positions = np.array([tuple(food.get_position()) for food in foods]).reshape(-1, 2)
+        slots = self.food_grid.insert_many(positions, np.array([food.RADIUS for food in foods]), foods)
+        for food, slot in zip(foods, slots.tolist()):
+            food.grid_slot = slot
+        self.foods.extend(foods)
+        if self.window is not None and not self.window.headless:
+            self.window.add_food_sprites(foods)
 
     def remove_food(self, food: Food):
-        self.foods.remove(food)
-        self.space.remove(food.shape.body)
-        self.space.remove(food.shape)
-        if food.sprite is not None:
-            food.sprite.delete()
+        self.remove_foods([food])
 
-    def add_goopie(self, goopie: Goopie):
-        self.space.add(goopie.shape.body, goopie.shape, goopie.vision_shape)
-        self.goopies.append(goopie)
+    def remove_foods(self, foods: list[Food]):
+        """
+        Removes many foods at once, with a single space, grid, registry and window update.
+        """
+        if len(foods) == 0:
+            return
+        shapes = [food.shape for food in foods]
+        self.space.remove(*[shape.body for shape in shapes], *shapes)
+        self.food_grid.remove_many([food.grid_slot for food in foods])
+        for food in foods:
+            self.foods.remove(food)
         if self.window is not None and not self.window.headless:
-            self.window.add_goopie_sprite(goopie)
-    
-    def add_food(self, food: Food):
-        self.space.add(food.shape.body, food.shape)
-        self.foods.append(food)
+            self.window.remove_food_sprites(foods)
+        for food in foods:
+            self.food_pool.release(food)
+
+    def new_food(self, x: float = None, y: float = None) -> Food:
+        """
+        Food at the given or at a random position, recycling eaten food when possible.
+        """
+        food = self.food_pool.acquire()
+        if food is None:
+            return Food(x, y, self.food_spawn_range, self.generator)
+        food.reset(x, y, self.food_spawn_range, self.generator)
+        return food
+
+    def food_count(self) -> int:
+        return len(self.food_field) if self.food_field is not None else len(self.foods)
+
+    def pool_stats(self) -> dict[str, dict]:
+        """
+        Hit and miss counters of the object pools of the simulation and of its window.
+        """
+        pools = {"goopie_shapes": self.goopie_shape_pool, "food": self.food_pool}
         if self.window is not None and not self.window.headless:
-            self.window.add_food_sprite(food)
+            pools.update(self.window.pools)
+        return {name: pool.stats() for name, pool in pools.items()}
+
+    def commit_lifecycle(self) -> list[Goopie]:
+        """
+        Applies all the births, deaths and food changes queued during the step, in bulk.
+        Returns the goopies that died.
+        """
+        queue = self.lifecycle
+        dead = queue.deaths
+        self.remove_goopies(queue.deaths)
+        self.remove_foods(queue.eaten_food)
+        self.add_goopies(queue.births)
+        self.add_foods(queue.spawned_food)
+        queue.clear()
+        if self.food_field is not None:
+            self.food_field.commit()
+        return dead
 
-    def add_blueprint(self, brain_path: str):
-        goopie = CNNGoopie(self)
+    def add_blueprint(self, brain_path: str, record: int = None):
+        """
+        Adds a brain to the best goopies, from a .pt or .npz state dict or from a single record of a genome archive
+        (the one with the highest fitness if no record is given).
+        A CNN state dict becomes the equivalent NEAT network, without hidden nodes, in a NEAT simulation.
+        """
+        if brain_path.endswith(".pt") and self.brain_backend == "numpy":
+            raise ValueError(f"The numpy backend cannot read the torch checkpoint {brain_path}, convert it to .npz with convert_checkpoint.py.")
+        goopie = self.goopie_class(self, generator=self.generator)
         goopie.fitness = 0.05
-        goopie.brain.load_state_dict(torch.load(brain_path))
+        if (brain_path.endswith(".pt") or brain_path.endswith(".npz")) and self.brain_type == "neat":
+            cnn = CNNBrainPopulation(self.vision_width, 3, capacity=1, compiled=True)
+            slot = cnn.allocate(initialize=False)
+            cnn.load_state_dict(slot, load_state_dict_file(brain_path))
+            cnn.compile()
+            goopie.brain.set_genome(self.brains.from_affine(cnn.weights[slot], cnn.biases[slot]).to_flat())
+        elif brain_path.endswith(".pt") or brain_path.endswith(".npz"):
+            goopie.brain.load_state_dict(load_state_dict_file(brain_path))
+        elif self.brain_type == "neat":
+            archive = GenomeArchive(brain_path, read_only=True)
+            genome, metadata = archive.read(archive.best_record() if record is None else record)
+            if metadata["brain_type"] != "neat":
+                raise ValueError(f"Record of {brain_path} is a {metadata['brain_type']} brain, not a NEAT brain.")
+            goopie.brain.set_genome(genome)
+        else:
+            archive = GenomeArchive(brain_path, read_only=True)
+            genome, metadata = archive.read(archive.best_record() if record is None else record)
+            if metadata["brain_type"] != "cnn" or len(genome) != self.brains.n_params:
+                raise ValueError(f"Record of {brain_path} is a {metadata['brain_type']} brain with {len(genome)} parameters, not a CNN brain with {self.brains.n_params}.")
+            goopie.brain.set_genome(genome)
+        # the blueprint never enters the space, so it does not need a row in the population
+        goopie.release()
+        self.update_best_goopies(goopie)
+
+    def add_genome(self, genome: np.ndarray, fitness: float):
+        """
+        Adds a brain evolved outside of this simulation (e.g. in another island) to the best goopies.
+        """
+        goopie = self.goopie_class(self, generator=self.generator)
+        goopie.fitness = fitness
+        goopie.brain.set_genome(genome)
+        goopie.release()
         self.update_best_goopies(goopie)
 
     def step(self):
         dt = 0.01
+        timer = timeit.default_timer
 
-        for goopie in self.goopies:
-            goopie.reset_vision()
+        self.metrics.begin_step()
+        self.foods.clear_consumed()
+        start_time = timer()
+        self.vision_engine.reset()
 
-        space_step_start_time = timeit.default_timer()
+        space_step_start_time = timer()
         self.space.step(dt)
-        self.space_time = timeit.default_timer() - space_step_start_time
-
-        goopie_step_start_time = timeit.default_timer()
-        for goopie in self.goopies:
-            goopie.step(dt)
-            child = goopie.reproduce()
-            # child = None
-            if child is not None:
-                self.add_goopie(child)
-            if not goopie.is_alive():
-                self.remove_goopie(goopie)
-                self.update_best_goopies(goopie)
-                # if len(self.goopies) < self.num_goopies:
-                #     self.spawn_goopie(self.respawn_rate, self.mutation_prob, self.mutation_amount)
-
-        self.goopie_time = timeit.default_timer() - goopie_step_start_time
+        self.space_time = timer() - space_step_start_time
+
+        vision_start_time = timer()
+        self.update_vision(self.goopies)
+
+        eating_start_time = timer()
+        if self.food_field is not None:
+            self.eat_food(self.goopies)
+
+        goopie_step_start_time = timer()
+        slots = np.array([g.slot for g in self.goopies], dtype=np.int64)
+        self.biomass += self.population.metabolize(slots, dt, Goopie.METABOLISM_RATE)
+
+        brain_start_time = timer()
+        turn, accelerate = self.think(self.goopies)
+
+        movement_start_time = timer()
+        self.movement_step(self.goopies, turn, accelerate)
+
+        lifecycle_start_time = timer()
+        goopies = list(self.goopies)
+        can_reproduce = self.population.can_reproduce(slots, Goopie.REPRODUCTION_AGE, Goopie.REPRODUCTION_ENERGY)
+        dead = ~self.population.alive[slots]
+        parents = [goopies[i] for i in np.flatnonzero(can_reproduce).tolist()]
+        children = self.breed(parents)
+        self.lifecycle.births.extend(children)
+        self.lifecycle.deaths.extend(goopies[i] for i in np.flatnonzero(dead).tolist())
+        self.metrics.count("births", len(children))
+        self.metrics.count("deaths", int(dead.sum()))
+        # if len(self.goopies) < self.num_goopies:
+        #     self.spawn_goopie(self.respawn_rate, self.mutation_prob, self.mutation_amount)
+
+        food_start_time = timer()
+        self.goopie_time = food_start_time - goopie_step_start_time
 
         # spawn more food
-        if self.biomass > 1:
-            food = Food(generation_range=self.food_spawn_range, generator=self.generator)
+        if self.food_field is not None:
+            if self.biomass > 1:
+                # all the food paid by the biomass above 1 is spawned in one batch
+                count = math.ceil((self.biomass - 1) / Food.AMOUNT)
+                self.food_field.spawn(self.generator.uniform(-self.food_spawn_range, self.food_spawn_range, size=(count, 2)))
+                self.biomass -= count * Food.AMOUNT
+                self.metrics.count("food_spawns", count)
+        elif self.biomass > 1:
+            food = self.new_food()
             self.biomass -= food.amount
-            self.add_food(food)
+            self.lifecycle.spawned_food.append(food)
+            self.metrics.count("food_spawns")
+
+        commit_start_time = timer()
+        for goopie in self.commit_lifecycle():
+            self.update_best_goopies(goopie)
 
         self.num_steps += 1
-        if self.num_steps % 10000 == 0:
-            self.save_best_goopies("checkpoints/blueprint2/")
+        if self.archive is not None and self.num_steps % 10000 == 0:
+            self.archive_best_goopies()
+        end_time = timer()
+
+        # duration of each phase of the last step, in seconds
+        self.phase_times = {
+            "vision_reset": space_step_start_time - start_time,
+            "space": self.space_time,
+            "vision": eating_start_time - vision_start_time,
+            "eating": goopie_step_start_time - eating_start_time,
+            "metabolism": brain_start_time - goopie_step_start_time,
+            "brain": movement_start_time - brain_start_time,
+            "movement": lifecycle_start_time - movement_start_time,
+            "lifecycle": food_start_time - lifecycle_start_time,
+            "food": commit_start_time - food_start_time,
+            "commit": end_time - commit_start_time,
+        }
+        if self.broadphase_tuner.due(self.num_steps):
+            self.broadphase_tuner.tune(self)
+            self.phase_times["broadphase"] = timer() - end_time
+        for phase, duration in self.phase_times.items():
+            self.metrics.add_time(phase, duration)
+        self.metrics.count("goopie_count", len(self.goopies))
+        self.metrics.count("food_count", self.food_count())
+        self.metrics.end_step(self.num_steps)
         
+    def update_vision(self, goopies: list[Goopie]):
+        """
+        Paints everything seen by the goopies during the space step into their vision buffers,
+        or casts their rays against it with the ray vision.
+        """
+        if len(goopies) == 0:
+            return
+        vision_slots = np.array([g.vision.slot for g in goopies])
+        positions = np.array([tuple(g.get_position()) for g in goopies])
+        angles = np.array([g.shape.body.angle for g in goopies])
+        self.goopie_grid.move(np.array([g.grid_slot for g in goopies]), positions)
+        if self.vision_sensors:
+            self.vision_engine.update_observers(vision_slots, positions, angles)
+            self.vision_engine.flush()
+            return
+
+        if self.vision_mode == "rays":
+            # the rays hit the walls themselves, not the chords painted by the wide vision
+            observers, seen_positions, seen_radii, channels = self.find_seen_objects(goopies, positions, walls=False)
+            wall_observers, wall_indices = self.find_seen_walls(positions)
+            self.vision_engine.cast(vision_slots, positions, angles, observers, seen_positions, seen_radii, channels,
+                                    wall_observers, self.wall_a[wall_indices], self.wall_b[wall_indices], self.wall_radii[wall_indices])
+            return
+
+        observers, seen_positions, seen_radii, channels = self.find_seen_objects(goopies, positions)
+        self.vision_engine.paint(vision_slots[observers], positions[observers], angles[observers], seen_positions, seen_radii, channels)
+
+    def find_seen_objects(self, goopies: list[Goopie], positions: np.ndarray, walls: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Queries the spatial grids for all the objects overlapping the vision circle of each goopie,
+        which are the same pairs the pymunk vision sensors would report. The walls are included, as the
+        circles of their visible chords, unless walls is False.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+            for each seen object the index of the goopie seeing it, its position, radius and vision channel
+        """
+        grid_slots = np.array([g.grid_slot for g in goopies])
+        goopie_observers, goopie_slots = self.goopie_grid.query_pairs(positions, Vision.VISION_RADIUS)
+        # a goopie does not see itself
+        not_self = goopie_slots != grid_slots[goopie_observers]
+        goopie_observers, goopie_slots = goopie_observers[not_self], goopie_slots[not_self]
+        food_observers, food_slots = self.food_grid.query_pairs(positions, Vision.VISION_RADIUS)
+
+        if walls:
+            wall_observers, wall_indices = self.find_seen_walls(positions)
+        else:
+            wall_observers = wall_indices = np.zeros(0, dtype=np.int64)
+        wall_positions, wall_radii = Vision.calculate_wall_vision(positions[wall_observers], self.wall_a[wall_indices],
+                                                                  self.wall_b[wall_indices], self.wall_radii[wall_indices])
+        self.metrics.count("seen_goopies", len(goopie_observers))
+        self.metrics.count("seen_food", len(food_observers))
+
+        observers = np.concatenate([wall_observers, goopie_observers, food_observers])
+        seen_positions = np.concatenate([wall_positions, self.goopie_grid.positions[goopie_slots], self.food_grid.positions[food_slots]])
+        seen_radii = np.concatenate([wall_radii, self.goopie_grid.radii[goopie_slots], self.food_grid.radii[food_slots]])
+        channels = np.concatenate([np.zeros(len(wall_observers), dtype=np.int64),
+                                   np.ones(len(goopie_observers), dtype=np.int64),
+                                   np.full(len(food_observers), 2, dtype=np.int64)])
+        return observers, seen_positions, seen_radii, channels
+
+    def eat_food(self, goopies: list[Goopie]):
+        """
+        Lets the goopies eat the items of the food field overlapping them, found with one bulk query.
+        Every goopie gains the amounts of all the items it eats, up to a full energy, like Goopie.eat does
+        one item at a time for the pymunk food.
+        """
+        if len(goopies) == 0:
+            return
+        # the grid positions were updated from the bodies after the space step by update_vision
+        positions = self.goopie_grid.positions[np.array([g.grid_slot for g in goopies])]
+        eaters, food_slots = self.food_field.find_eaten(positions, Goopie.RADIUS)
+        slots = np.array([g.slot for g in goopies], dtype=np.int64)
+        eaten = np.bincount(eaters, weights=self.food_field.amounts[food_slots], minlength=len(goopies))
+        gain = np.minimum(1 - self.population.energy[slots], eaten)
+        self.population.energy[slots] += gain
+        self.population.fitness[slots] += gain
+        self.metrics.count("food_eaten", len(food_slots))
+
+    def find_seen_walls(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the walls touching the vision circle of each of the given positions, including their radius.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            the index of the position and of the wall for every pair
+        """
+        to_a = positions[:, None, :] - self.wall_a[None, :, :]
+        wall_vectors = self.wall_b - self.wall_a
+        t = np.clip(np.sum(to_a * wall_vectors, axis=2) / np.sum(wall_vectors ** 2, axis=1), 0, 1)
+        closest = self.wall_a + t[:, :, None] * wall_vectors
+        distance = np.linalg.norm(positions[:, None, :] - closest, axis=2)
+        wall_observers, wall_indices = np.nonzero(distance < Vision.VISION_RADIUS + self.wall_radii)
+        self.metrics.count("seen_walls", len(wall_observers))
+        return wall_observers, wall_indices
+
+    def think(self, goopies: list[Goopie]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluates the brains of all the given goopies in a single batched call.
+        Returns the turn and acceleration of every goopie as arrays.
+        """
+        if len(goopies) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+        slots = np.array([g.brain.slot for g in goopies])
+        vision_slots = np.array([g.vision.slot for g in goopies])
+        return self.brains.forward(slots, self.vision_engine.buffers[vision_slots])
+
+    def movement_step(self, goopies: list[Goopie], turn: np.ndarray, accelerate: np.ndarray):
+        """
+        Updates the goopies velocity and angle based on their turn and acceleration. Velocity will always be in the front, never laterally.
+        """
+        bodies = [g.shape.body for g in goopies]
+        slots = np.array([g.slot for g in goopies], dtype=np.int64)
+        max_turn = self.population.max_turn[slots]
+        max_acceleration = self.population.max_acceleration[slots]
+        angles = np.array([b.angle for b in bodies], dtype=np.float64) + max_turn * turn
+        speeds = np.array([b.velocity.length for b in bodies], dtype=np.float64)
+        velocities_x = (speeds * np.cos(angles)).tolist()
+        velocities_y = (speeds * np.sin(angles)).tolist()
+        forces = (accelerate * max_acceleration).tolist()
+        for body, angle, vx, vy, force in zip(bodies, angles.tolist(), velocities_x, velocities_y, forces):
+            body.angle = angle
+            body.velocity = vx, vy
+            body.apply_force_at_local_point((force, 0), (0, 0))
+        self.goopie_grid.set_angles(np.array([g.grid_slot for g in goopies], dtype=np.int64), angles)
+
+    def render_instances(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (x, y, angle) rows of all the goopies and of all the food, read in bulk from the spatial grids
+        without touching the pymunk bodies. The positions are the ones after the last space step.
+        """
+        return self.goopie_grid.instances(), self.food_grid.instances()
+
+    def breed(self, parents: list[Goopie]) -> list[Goopie]:
+        """
+        Creates one child for each of the given parents, processing all the births as a batch:
+        the parent genomes are copied, crossed over and mutated with a single call for all the children.
+        The children are returned without being added to the simulation.
+        """
+        if len(parents) == 0:
+            return []
+        children = [self.goopie_class(self, *p.get_position(), generator=self.generator, random_brain=False) for p in parents]
+
+        if self.brain_type == "neat":
+            # genomes of different lengths, bred one by one
+            self.brains.breed(np.array([p.brain.slot for p in parents]), np.array([c.brain.slot for c in children]),
+                              self.crossover_prob, self.mutation_prob, self.mutation_amount)
+        else:
+            genomes = self.brains.genomes[np.array([p.brain.slot for p in parents])]
+            if self.crossover_prob > 0 and len(parents) > 1:
+                partners = genomes[self.generator.permutation(len(parents))]
+                crossed = self.generator.random(len(parents)) < self.crossover_prob
+                genomes[crossed] = genetics.crossover(genomes[crossed], partners[crossed], self.generator)
+            genomes = genetics.mutate(genomes, self.mutation_prob, self.mutation_amount, self.generator)
+            self.brains.set_genomes(np.array([c.brain.slot for c in children]), genomes)
+
+        parent_slots = np.array([p.slot for p in parents])
+        child_slots = np.array([c.slot for c in children])
+        self.population.parent_id[child_slots] = self.population.id[parent_slots]
+        self.population.energy[parent_slots] -= Goopie.CHILD_ENERGY
+        self.population.energy[child_slots] = Goopie.CHILD_ENERGY
+        return children
+
     def update_best_goopies(self, goopie: Goopie):
         if goopie.fitness > self.fitness_thresh:
             self.best_goopies.append(goopie)
@@ -201,30 +655,103 @@ class Simulation:
             self.fitness_thresh = self.best_goopies[-1].fitness
             self.best_fitness = self.best_goopies[0].fitness
     
-    def spawn_goopie(self, random_prob: float, mutation_prob: float, mutation_amount: float, x=None, y=None):   
+    def spawn_goopie(self, random_prob: float, mutation_prob: float, mutation_amount: float, x=None, y=None, genome: np.ndarray = None):
+        """
+        Spawns a new goopie, with a random brain or one cloned from the best goopies.
+        If a genome is given, the brain is set to it instead.
+        """
         random_spawn = self.generator.uniform() < random_prob
-        goopie = CNNGoopie(self, x=x, y=y, generation_range=self.goopie_spawn_range, generator=self.generator)
-        if len(self.best_goopies) > 0 and not random_spawn:
+        goopie = self.goopie_class(self, x=x, y=y, generation_range=self.goopie_spawn_range, generator=self.generator)
+        if genome is not None:
+            goopie.brain.set_genome(genome)
+        elif len(self.best_goopies) > 0 and not random_spawn:
             # load nn from one of the best fit goopies
-            probs = torch.nn.functional.softmax(torch.tensor([g.fitness / 3 for g in self.best_goopies]), dim=0)
-            index = int(torch.distributions.Categorical(probs=probs).sample())
-            goopie.brain.load_state_dict(self.best_goopies[index].brain.state_dict())
+            logits = np.array([g.fitness / 3 for g in self.best_goopies])
+            probs = np.exp(logits - logits.max())
+            index = int(self.generator.choice(len(self.best_goopies), p=probs / probs.sum()))
+            goopie.brain.set_genome(self.best_goopies[index].brain.get_genome())
             if mutation_prob > 0 and mutation_amount > 0:
                 goopie.mutate(mutation_prob, mutation_amount)
         self.add_goopie(goopie)
         return goopie
 
-    def run(self, headless: bool = False):
-        update_rate = 1e-5 if headless else 1/60
-        from window_pyglet import GameWindow
-        self.window = GameWindow(self)
-        self.window.run()
+    def run(self, headless: bool = False, steps: int = None, seconds: float = None, metrics_path: str = None,
+            steps_per_frame: int = 1, threaded: bool = False, unlimited: bool = False,
+            record_path: str = None, record_every: int = 1, record_downscale: int = 1, offscreen: bool = False):
+        """
+        Runs the simulation in a window, or in a tight loop without ever importing pyglet if headless.
+        The headless run stops after the given number of steps and/or seconds and prints its throughput.
+        The window runs steps_per_frame steps per frame, on a worker thread if threaded (see GameWindow).
+        Its frames are recorded to record_path if given, one every record_every frames with the resolution
+        divided by record_downscale (see FrameRecorder). An offscreen window is never shown and draws the
+        frames of the given number of steps as fast as possible, to make recordings on machines without a display,
+        and cannot be threaded.
+        Sending SIGUSR1 to the process profiles the next steps, the metrics of the last steps are
+        exported to metrics_path at the end if given.
+        """
+        if offscreen and threaded:
+            # the worker thread steps on its own, the drawn frames would not match the given steps
+            raise ValueError("An offscreen run draws the frames of a given number of steps, it cannot be threaded.")
+        install_profile_signal(self.metrics)
+        if headless:
+            from headless import run_headless, format_report
+            report = run_headless(self, steps, seconds)
+            self.close()
+            print(format_report(report))
+        else:
+            frames = None
+            if offscreen:
+                import pyglet
+                pyglet.options["headless"] = True
+                frames = math.ceil((steps or 1000) / steps_per_frame)
+            from window_pyglet import GameWindow
+            from recorder import FrameRecorder
+            recorder = None
+            if record_path is not None:
+                recorder = FrameRecorder(record_path, record_every, record_downscale)
+            self.window = GameWindow(self, steps_per_frame=steps_per_frame, threaded=threaded, unlimited=unlimited, recorder=recorder)
+            try:
+                self.window.run(frames)
+            finally:
+                if recorder is not None:
+                    recorder.close()
+                    print(f"Recorded {recorder.recorded} frames to {record_path}, {recorder.dropped} dropped")
+            self.close()
+            report = None
+        if metrics_path is not None:
+            self.metrics.export(metrics_path)
+        return report
         
 
-    def save_best_goopies(self, folder):
-        save_folder = Path(folder)
-        save_folder.mkdir(exist_ok=True)
-        for f in save_folder.glob("*"):
-            f.unlink()
+    def archive_best_goopies(self):
+        """
+        Appends the best goopies that are not in the archive yet. The writes happen in the background.
+        """
         for g in self.best_goopies:
-            g.save(save_folder / f"best_goopie_{g.fitness}.pt")
\ No newline at end of file
+            if g.id not in self.archived_ids:
+                self.archive.append(g.brain.get_genome(), self.num_steps, g.fitness, g.id, g.parent_id, self.brain_type)
+                self.archived_ids.add(g.id)
+
+    def snapshot(self, path: str):
+        """
+        Saves the complete state of the simulation, see snapshot.save_snapshot.
+        The world is rebuilt from the saved state, so that this simulation and the ones
+        resumed from the snapshot follow the same trajectory.
+        """
+        from snapshot import save_snapshot
+        save_snapshot(self, path)
+
+    @classmethod
+    def resume(cls, path: str, archive_path: str = None) -> "Simulation":
+        """
+        Recreates a simulation from a snapshot, see snapshot.load_snapshot.
+        """
+        from snapshot import load_snapshot
+        return load_snapshot(path, archive_path)
+
+    def close(self):
+        """
+        Waits for the pending archive writes.
+        """
+        if self.archive is not None:
+            self.archive.close()
@@ -0,0 +1,223 @@
+"""
+Snapshots of the complete state of a Simulation, to survive crashes and restarts.
+
+A snapshot is a single uncompressed .npz file: every goopie and food is stored as rows of flat
+arrays (body state, population store fields, genome), together with the best goopies, the
+state of the random generator and the counters of the simulation. Restoring only builds the
+pymunk objects back and bulk-inserts them, without any random draw.
+
+Pymunk keeps solver state that cannot be read back (the bias velocities of the bodies and the
+cached contact impulses), so taking a snapshot also rebuilds the world of the running simulation
+from the saved state: the original and every resumed copy continue on the same trajectory.
+"""
+import gc
+import json
+import numpy as np
+from goopie import Goopie
+from population import PopulationStore
+from vision import Vision, WideVision
+
+SNAPSHOT_VERSION = 1
+
+# position, velocity, angle and the force applied for the next space step
+BODY_COLUMNS = ("x", "y", "vx", "vy", "angle", "fx", "fy", "torque")
+
+CONFIG_ATTRIBUTES = ("num_goopies", "num_food", "space_size", "test", "random_respawn_rate", "mutation_prob",
+                     "mutation_amount", "crossover_prob", "vision_sensors", "seed", "brain_backend", "compile_brains", "verify_brains", "brain_type",
+                     "vision_mode", "vision_width", "food_layer", "broadphase")
+
+
+def _store_fields(goopies: list[Goopie]) -> dict[str, np.ndarray]:
+    """
+    Fields of the given goopies, each possibly stored in a different (detached) population store.
+    """
+    return {name: np.array([getattr(g.population, name)[g.slot] for g in goopies], dtype=dtype)
+            for name, (dtype, _) in PopulationStore.FIELDS.items()}
+
+
+def _pack(genomes: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    # NEAT genomes have different lengths, they are stored one after the other with their lengths
+    lengths = np.array([len(genome) for genome in genomes], dtype=np.int64)
+    return np.concatenate([np.zeros(0, dtype=np.float32)] + genomes), lengths
+
+
+def _unpack(arrays: dict[str, np.ndarray], name: str) -> list[np.ndarray]:
+    if f"{name}_lengths" not in arrays:
+        return list(arrays[name])
+    if len(arrays[f"{name}_lengths"]) == 0:
+        # np.split would return a single empty genome
+        return []
+    return np.split(arrays[name], np.cumsum(arrays[f"{name}_lengths"])[:-1])
+
+
+def _collect(simulation) -> dict[str, np.ndarray]:
+    goopies = simulation.goopies
+    bodies = [g.shape.body for g in goopies]
+    slots = np.array([g.slot for g in goopies], dtype=np.int64)
+    metadata = {
+        "version": SNAPSHOT_VERSION,
+        "config": {name: getattr(simulation, name) for name in CONFIG_ATTRIBUTES},
+        "vision": {"radius": Vision.VISION_RADIUS, "width": WideVision.VISION_BUFFER_WIDTH},
+        "num_steps": simulation.num_steps,
+        "biomass": simulation.biomass,
+        "fitness_thresh": simulation.fitness_thresh,
+        "best_fitness": simulation.best_fitness,
+        "next_id": simulation.population.next_id,
+        "generator": simulation.generator.bit_generator.state,
+    }
+    if simulation.brain_type == "neat":
+        metadata["innovations"] = simulation.brains.tracker.state()
+    arrays = {
+        "metadata": np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8),
+        "goopie_bodies": np.array([(*b.position, *b.velocity, b.angle, *b.force, b.torque) for b in bodies], dtype=np.float64).reshape(-1, len(BODY_COLUMNS)),
+        "archived_ids": np.array(sorted(simulation.archived_ids), dtype=np.int64),
+    }
+    if simulation.food_field is not None:
+        arrays["food_positions"], arrays["food_amounts"] = simulation.food_field.state()
+    else:
+        arrays["food_positions"] = np.array([tuple(f.get_position()) for f in simulation.foods], dtype=np.float64).reshape(-1, 2)
+        arrays["food_amounts"] = np.array([f.amount for f in simulation.foods], dtype=np.float64)
+    if simulation.brain_type == "neat":
+        arrays["goopie_genomes"], arrays["goopie_genomes_lengths"] = _pack([g.brain.get_genome() for g in goopies])
+        arrays["best_genomes"], arrays["best_genomes_lengths"] = _pack([g.brain.get_genome() for g in simulation.best_goopies])
+    else:
+        arrays["goopie_genomes"] = simulation.brains.genomes[np.array([g.brain.slot for g in goopies], dtype=np.int64)]
+        arrays["best_genomes"] = np.array([g.brain.get_genome() for g in simulation.best_goopies], dtype=np.float32).reshape(-1, simulation.brains.n_params)
+    for name in PopulationStore.FIELDS:
+        arrays[f"goopie_{name}"] = getattr(simulation.population, name)[slots]
+    for name, values in _store_fields(simulation.best_goopies).items():
+        arrays[f"best_{name}"] = values
+    return arrays
+
+
+def _restore(simulation, arrays: dict[str, np.ndarray]):
+    """
+    Fills the empty world of the simulation with the saved goopies, food and counters.
+    """
+    # tens of thousands of pymunk objects are created here, the garbage collector would keep scanning them
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _restore_world(simulation, arrays)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _restore_world(simulation, arrays: dict[str, np.ndarray]):
+    metadata = json.loads(arrays["metadata"].tobytes().decode())
+    # goopies, in the same order as before
+    bodies = arrays["goopie_bodies"]
+    goopies = [simulation.goopie_class(simulation, x, y, angle, random_brain=False) for x, y, angle in bodies[:, [0, 1, 4]].tolist()]
+    for goopie, (vx, vy, fx, fy, torque) in zip(goopies, bodies[:, [2, 3, 5, 6, 7]].tolist()):
+        body = goopie.shape.body
+        body.velocity = vx, vy
+        body.force = fx, fy
+        body.torque = torque
+    slots = np.array([g.slot for g in goopies], dtype=np.int64)
+    for name in PopulationStore.FIELDS:
+        getattr(simulation.population, name)[slots] = arrays[f"goopie_{name}"]
+    if simulation.brain_type == "neat":
+        for goopie, genome in zip(goopies, _unpack(arrays, "goopie_genomes")):
+            goopie.brain.set_genome(genome)
+    else:
+        simulation.brains.set_genomes(np.array([g.brain.slot for g in goopies], dtype=np.int64), arrays["goopie_genomes"])
+    for goopie in goopies:
+        simulation.add_goopie(goopie)
+
+    if simulation.food_field is not None:
+        simulation.food_field.add(arrays["food_positions"], arrays["food_amounts"])
+    else:
+        foods = [simulation.new_food(x, y) for x, y in arrays["food_positions"].tolist()]
+        for food, amount in zip(foods, arrays["food_amounts"].tolist()):
+            food.amount = amount
+        simulation.add_foods(foods)
+
+    simulation.best_goopies = []
+    best_genomes = _unpack(arrays, "best_genomes")
+    if len(best_genomes) != len(arrays["best_id"]):
+        raise ValueError(f"Snapshot has {len(best_genomes)} best genomes for {len(arrays['best_id'])} best goopies.")
+    for i, genome in enumerate(best_genomes):
+        goopie = simulation.goopie_class(simulation, 0, 0, 0, random_brain=False)
+        goopie.brain.set_genome(genome)
+        for name in PopulationStore.FIELDS:
+            getattr(goopie.population, name)[goopie.slot] = arrays[f"best_{name}"][i]
+        goopie.release()
+        simulation.best_goopies.append(goopie)
+
+    simulation.num_steps = metadata["num_steps"]
+    simulation.biomass = metadata["biomass"]
+    simulation.fitness_thresh = metadata["fitness_thresh"]
+    simulation.best_fitness = metadata["best_fitness"]
+    simulation.population.next_id = metadata["next_id"]
+    simulation.archived_ids = set(arrays["archived_ids"].tolist())
+    if "innovations" in metadata:
+        simulation.brains.tracker.load_state(metadata["innovations"])
+    # the brains share this generator, so its state is restored in place
+    simulation.generator.bit_generator.state = metadata["generator"]
+
+
+def capture_state(simulation) -> dict[str, np.ndarray]:
+    """
+    Complete state of the simulation as in-memory arrays, the content of a snapshot file.
+    """
+    return _collect(simulation)
+
+
+def restore_state(simulation, arrays: dict[str, np.ndarray]):
+    """
+    Puts the simulation back in a state returned by capture_state, possibly of another simulation with
+    the same configuration. The world is rebuilt in a new space with new bodies and shapes, and new pools:
+    reused bodies keep solver state that cannot be reset (see above), which would make the restored
+    world depend on what ran in the simulation before.
+    """
+    simulation.remove_goopies(list(simulation.goopies))
+    simulation.remove_foods(list(simulation.foods))
+    simulation.create_world()
+    _restore(simulation, arrays)
+
+
+def save_snapshot(simulation, path: str):
+    """
+    Saves the complete state of the simulation, then rebuilds its world from the saved state.
+    """
+    arrays = _collect(simulation)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+    for goopie in simulation.goopies:
+        goopie.release()
+        if goopie.sprite is not None:
+            goopie.sprite.delete()
+        if goopie.vision_arc is not None:
+            goopie.vision_arc.delete()
+    for food in simulation.foods:
+        if food.sprite is not None:
+            food.sprite.delete()
+    simulation.create_world()
+    _restore(simulation, arrays)
+
+
+def load_snapshot(path: str, archive_path: str = None):
+    """
+    Recreates the simulation saved in the snapshot, which continues exactly where it stopped.
+    The archive is not part of the snapshot, and can be given again with archive_path.
+    """
+    from simulation import Simulation
+
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    metadata = json.loads(arrays["metadata"].tobytes().decode())
+    if metadata["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {metadata['version']} is not supported, expected {SNAPSHOT_VERSION}.")
+    if metadata["vision"] != {"radius": Vision.VISION_RADIUS, "width": WideVision.VISION_BUFFER_WIDTH}:
+        raise ValueError(f"Snapshot was taken with vision {metadata['vision']}, which differs from the current one.")
+
+    config = dict(metadata["config"])
+    num_goopies, num_food, test = config.pop("num_goopies"), config.pop("num_food"), config.pop("test")
+    simulation = Simulation(0, 0, archive_path=archive_path, **config)
+    simulation.num_goopies, simulation.num_food, simulation.test = num_goopies, num_food, test
+    # a spatial hash is sized after the configured population, unknown when the empty space was created
+    simulation.broadphase_tuner.configure(simulation.space, simulation)
+    _restore(simulation, arrays)
+    return simulation
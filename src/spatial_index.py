@@ -0,0 +1,171 @@
+import math
+import numpy as np
+
+
+class SpatialGrid:
+    """
+    Uniform grid spatial index over circular entities (goopies, food).
+
+    Every entity gets a slot, its position and radius are stored in contiguous arrays indexed by slot.
+    The grid is kept as a table of slots sorted by cell, which is rebuilt lazily on the first query after
+    an entity was inserted or moved to another cell. Removing an entity only marks its slot as inactive.
+    Queries are answered in bulk for many query points at once, returning the overlapping pairs.
+    """
+
+    # cell coordinates are packed in a single int64 key
+    _KEY_OFFSET = 1 << 20
+    _KEY_SCALE = 1 << 21
+
+    def __init__(self, cell_size: float, capacity: int = 64) -> None:
+        self.cell_size = cell_size
+        self.positions = np.zeros((capacity, 2))
+        self.radii = np.zeros(capacity)
+        # only used for rendering, the index itself ignores the orientation
+        self.angles = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.keys = np.zeros(capacity, dtype=np.int64)
+        self.entities: list = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.max_radius = 0.0
+        self._sorted_keys = np.zeros(0, dtype=np.int64)
+        self._sorted_slots = np.zeros(0, dtype=np.int64)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.entities) - len(self.free_slots)
+
+    def insert(self, x: float, y: float, radius: float, entity=None, angle: float = 0.0) -> int:
+        """
+        Adds an entity to the grid, returning its slot.
+        """
+        if len(self.free_slots) == 0:
+            self._grow()
+        slot = self.free_slots.pop()
+        self.positions[slot] = x, y
+        self.radii[slot] = radius
+        self.angles[slot] = angle
+        self.active[slot] = True
+        self.keys[slot] = self._cell_keys(self.positions[slot:slot + 1])[0]
+        self.entities[slot] = entity
+        self.max_radius = max(self.max_radius, radius)
+        self._dirty = True
+        return slot
+
+    def insert_many(self, positions: np.ndarray, radii: np.ndarray, entities: list, angles: np.ndarray = 0.0) -> np.ndarray:
+        """
+        Adds many entities at once, returning their slots.
+        """
+        while len(self.free_slots) < len(entities):
+            self._grow()
+        slots = np.array([self.free_slots.pop() for _ in range(len(entities))], dtype=np.int64)
+        self.positions[slots] = positions
+        self.radii[slots] = radii
+        self.angles[slots] = angles
+        self.active[slots] = True
+        self.keys[slots] = self._cell_keys(positions)
+        for slot, entity in zip(slots.tolist(), entities):
+            self.entities[slot] = entity
+        if len(entities) > 0:
+            self.max_radius = max(self.max_radius, float(np.max(radii)))
+        self._dirty = True
+        return slots
+
+    def remove(self, slot: int):
+        self.active[slot] = False
+        self.entities[slot] = None
+        self.free_slots.append(slot)
+
+    def remove_many(self, slots: list[int]):
+        self.active[slots] = False
+        for slot in slots:
+            self.entities[slot] = None
+        self.free_slots.extend(slots)
+
+    def move(self, slots: np.ndarray, positions: np.ndarray):
+        """
+        Updates the positions of the entities in the given slots. The sorted table is only
+        invalidated if some entity changed cell.
+        """
+        if len(slots) == 0:
+            return
+        self.positions[slots] = positions
+        keys = self._cell_keys(positions)
+        if np.any(keys != self.keys[slots]):
+            self.keys[slots] = keys
+            self._dirty = True
+
+    def set_angles(self, slots: np.ndarray, angles: np.ndarray):
+        self.angles[slots] = angles
+
+    def instances(self) -> np.ndarray:
+        """
+        (N, 3) float32 array with the x, y and angle of every entity in the grid, for rendering.
+        """
+        slots = np.flatnonzero(self.active)
+        instances = np.empty((len(slots), 3), dtype=np.float32)
+        instances[:, :2] = self.positions[slots]
+        instances[:, 2] = self.angles[slots]
+        return instances
+
+    def query_pairs(self, positions: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds all the entities overlapping a circle of the given radius around each query position.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            the index of the query position and the slot of the entity for every overlapping pair
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if len(positions) == 0 or len(self) == 0:
+            return empty, empty
+        if self._dirty:
+            self._rebuild()
+
+        reach = math.ceil((radius + self.max_radius) / self.cell_size)
+        cells = np.floor(positions / self.cell_size).astype(np.int64)
+        offsets = np.arange(-reach, reach + 1)
+        dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+        # (n_queries, n_cells) keys of the neighboring cells of each query
+        neighbor_keys = self._pack(cells[:, 0:1] + dx.reshape(1, -1), cells[:, 1:2] + dy.reshape(1, -1))
+        lo = np.searchsorted(self._sorted_keys, neighbor_keys, side="left").ravel()
+        hi = np.searchsorted(self._sorted_keys, neighbor_keys, side="right").ravel()
+        counts = hi - lo
+        total = counts.sum()
+        if total == 0:
+            return empty, empty
+
+        # expand every [lo, hi) range of the sorted table into candidate pairs
+        query_index = np.repeat(np.repeat(np.arange(len(positions)), neighbor_keys.shape[1]), counts)
+        range_starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        slots = self._sorted_slots[range_starts + np.arange(total)]
+
+        keep = self.active[slots]
+        delta = self.positions[slots] - positions[query_index]
+        reach_sq = (radius + self.radii[slots]) ** 2
+        keep &= (delta[:, 0] ** 2 + delta[:, 1] ** 2) < reach_sq
+        return query_index[keep], slots[keep]
+
+    def _rebuild(self):
+        slots = np.flatnonzero(self.active)
+        order = np.argsort(self.keys[slots], kind="stable")
+        self._sorted_slots = slots[order]
+        self._sorted_keys = self.keys[self._sorted_slots]
+        self._dirty = False
+
+    def _grow(self):
+        capacity = len(self.entities)
+        self.positions = np.concatenate([self.positions, np.zeros_like(self.positions)])
+        self.radii = np.concatenate([self.radii, np.zeros_like(self.radii)])
+        self.angles = np.concatenate([self.angles, np.zeros_like(self.angles)])
+        self.active = np.concatenate([self.active, np.zeros_like(self.active)])
+        self.keys = np.concatenate([self.keys, np.zeros_like(self.keys)])
+        self.entities.extend([None] * capacity)
+        self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free_slots
+
+    def _cell_keys(self, positions: np.ndarray) -> np.ndarray:
+        cells = np.floor(positions / self.cell_size).astype(np.int64)
+        return self._pack(cells[:, 0], cells[:, 1])
+
+    def _pack(self, cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+        return (cx + self._KEY_OFFSET) * self._KEY_SCALE + (cy + self._KEY_OFFSET)
@@ -0,0 +1,231 @@
+"""
+Tournament between trained brains: every candidate is evaluated on the same seeded arenas, in
+parallel worker processes that never import pyglet, and the candidates are ranked by their mean fitness.
+
+An arena is a headless Simulation whose goopies all start with the brain of the candidate; their
+children are exact clones of it (no mutation nor random respawn). Every arena is built once from its
+seed and kept as the arrays of its initial state (see snapshot.capture_state). Each worker owns a
+single simulation, and evaluates a candidate on an arena by restoring the state of the arena into it
+with the genomes replaced, instead of building the arena again from its seed. A restored arena gives
+exactly the same result whatever was evaluated before in the same worker, which --verify checks.
+
+    python src/tournament.py checkpoints/blueprint --arenas 16 --steps 3000
+"""
+import argparse
+import json
+import multiprocessing as mp
+import timeit
+from pathlib import Path
+import numpy as np
+
+# the evaluation state of a worker process, set by _init_worker
+_worker: dict = {}
+
+
+def load_candidates(paths: list[str], vision_width: int, archive_top: int = 5) -> list[tuple[str, np.ndarray]]:
+    """
+    Reads the genomes of the candidates: .pt and .npz state dicts, directories of them, and genome
+    archives, of which the archive_top fittest CNN records are taken. The brains trained with another
+    vision width than the given one are skipped.
+
+    Returns
+    -------
+    list[tuple[str, np.ndarray]]
+        the name and flat genome of every candidate
+    """
+    from brain import CNNBrainPopulation, load_state_dict_file
+    from archive import GenomeArchive, BRAIN_TYPES
+
+    layout = CNNBrainPopulation(vision_width, 3, capacity=1).layout
+    candidates = []
+    for path in map(Path, paths):
+        files = sorted(p for p in path.iterdir() if p.suffix in (".pt", ".npz")) if path.is_dir() else [path]
+        for file in files:
+            if file.suffix in (".pt", ".npz"):
+                try:
+                    candidates.append((file.stem, layout.from_state_dict(load_state_dict_file(str(file)))))
+                except ValueError as e:
+                    print(f"Skipping {file}: {e}")
+                continue
+            archive = GenomeArchive(str(file), read_only=True)
+            index = archive.index()
+            cnn = (index["brain_type"] == BRAIN_TYPES.index("cnn")) & (index["length"] == layout.n_params)
+            records = np.flatnonzero(cnn)[np.argsort(-index["fitness"][cnn], kind="stable")][:archive_top]
+            for record in records.tolist():
+                candidates.append((f"{file.name}#{record}", archive.read(record)[0]))
+            archive.close()
+    return candidates
+
+
+def build_arenas(seeds: list[int], simulation_kwargs: dict) -> list[dict[str, np.ndarray]]:
+    """
+    Builds the arena of every seed once, and returns the arrays of their initial states.
+    """
+    from simulation import Simulation
+    from snapshot import capture_state
+
+    states = []
+    for seed in seeds:
+        simulation = Simulation(seed=seed, **simulation_kwargs)
+        states.append(capture_state(simulation))
+        simulation.close()
+    return states
+
+
+def evaluate(simulation, state: dict[str, np.ndarray], genome: np.ndarray, steps: int) -> dict:
+    """
+    Runs the arena of the given state with every goopie starting with the given genome, for the given
+    number of steps or until its population dies out.
+
+    Returns
+    -------
+    dict
+        mean fitness (energy eaten) and survival time (age) of the starting goopies, food eaten by the
+        whole lineage, final population and steps run
+    """
+    from snapshot import restore_state
+
+    state = dict(state)
+    state["goopie_genomes"] = np.tile(genome.astype(np.float32), (len(state["goopie_genomes"]), 1))
+    restore_state(simulation, state)
+    founders = list(simulation.goopies)
+    food_eaten = 0
+    num_steps = 0
+    while num_steps < steps and len(simulation.goopies) > 0:
+        simulation.step()
+        food_eaten += simulation.metrics.rows[-1].get("food_eaten", 0)
+        num_steps += 1
+    return {
+        "fitness": float(np.mean([g.fitness for g in founders])) if founders else 0.0,
+        "survival": float(np.mean([g.age for g in founders])) if founders else 0.0,
+        "food_eaten": int(food_eaten),
+        "population": len(simulation.goopies),
+        "steps": num_steps,
+    }
+
+
+def check_reuse(simulation_kwargs: dict, states: list[dict[str, np.ndarray]], genomes: list[np.ndarray], steps: int):
+    """
+    Checks that every candidate evaluated on the first arena gives the same result in a new simulation
+    and in one that evaluated the previous candidate (the last arena first), raising a RuntimeError otherwise.
+    """
+    from simulation import Simulation
+
+    kwargs = dict(simulation_kwargs, num_goopies=0, num_food=0)
+    simulation = Simulation(**kwargs)
+    evaluate(simulation, states[-1], genomes[-1], steps)
+    for candidate, genome in enumerate(genomes):
+        reused = evaluate(simulation, states[0], genome, steps)
+        first = evaluate(Simulation(**kwargs), states[0], genome, steps)
+        if reused != first:
+            raise RuntimeError(f"Candidate {candidate} gave {reused} on an arena restored after another evaluation, instead of {first}.")
+
+
+def _init_worker(simulation_kwargs: dict, states: list[dict], genomes: list[np.ndarray], steps: int):
+    if simulation_kwargs.get("brain_backend", "torch") == "torch":
+        import torch
+        # one core per worker, otherwise the torch threads of all the workers fight for the same cores
+        torch.set_num_threads(1)
+    from simulation import Simulation
+
+    # empty simulation the arenas are restored into, one after the other
+    _worker["simulation"] = Simulation(**dict(simulation_kwargs, num_goopies=0, num_food=0))
+    _worker["states"] = states
+    _worker["genomes"] = genomes
+    _worker["steps"] = steps
+
+
+def _evaluate_task(task: tuple[int, int]) -> tuple[int, int, dict]:
+    candidate, arena = task
+    result = evaluate(_worker["simulation"], _worker["states"][arena], _worker["genomes"][candidate], _worker["steps"])
+    return candidate, arena, result
+
+
+def run_tournament(candidates: list[tuple[str, np.ndarray]], seeds: list[int], steps: int, workers: int, simulation_kwargs: dict, verify: bool = False) -> list[dict]:
+    """
+    Evaluates every candidate on the arena of every seed, spreading the (candidate, arena) pairs over
+    the worker processes, and ranks the candidates by their mean fitness. If verify, check_reuse is
+    run first.
+
+    Returns
+    -------
+    list[dict]
+        one row per candidate, best first, with the mean and variance of the fitness over the arenas,
+        the mean survival time, food eaten and final population, and the result of every arena
+    """
+    simulation_kwargs = dict(simulation_kwargs, blueprint=None, archive_path=None, random_respawn_rate=0.0,
+                             mutation_prob=0.0, mutation_amount=0.0, crossover_prob=0.0)
+    states = build_arenas(seeds, simulation_kwargs)
+    genomes = [genome for _, genome in candidates]
+    if verify:
+        check_reuse(simulation_kwargs, states, genomes, steps)
+    tasks = [(c, a) for c in range(len(candidates)) for a in range(len(seeds))]
+    results: list[list[dict]] = [[None] * len(seeds) for _ in candidates]
+
+    context = mp.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(simulation_kwargs, states, genomes, steps)) as pool:
+        for candidate, arena, result in pool.imap_unordered(_evaluate_task, tasks):
+            results[candidate][arena] = result
+
+    table = []
+    for (name, _), arenas in zip(candidates, results):
+        fitness = np.array([r["fitness"] for r in arenas])
+        table.append({
+            "name": name,
+            "fitness_mean": float(fitness.mean()),
+            "fitness_var": float(fitness.var()),
+            "survival_mean": float(np.mean([r["survival"] for r in arenas])),
+            "food_eaten_mean": float(np.mean([r["food_eaten"] for r in arenas])),
+            "population_mean": float(np.mean([r["population"] for r in arenas])),
+            "arenas": [dict(r, seed=seed) for r, seed in zip(arenas, seeds)],
+        })
+    table.sort(key=lambda row: row["fitness_mean"], reverse=True)
+    return table
+
+
+def format_table(table: list[dict]) -> str:
+    name_width = max([len("candidate")] + [len(row["name"]) for row in table])
+    lines = [f"{'rank':>4}  {'candidate':<{name_width}}  {'fitness':>8}  {'variance':>9}  {'survival':>8}  {'food':>7}  {'population':>10}"]
+    for rank, row in enumerate(table, 1):
+        lines.append(f"{rank:>4}  {row['name']:<{name_width}}  {row['fitness_mean']:8.4f}  {row['fitness_var']:9.5f}  "
+                     f"{row['survival_mean']:8.2f}  {row['food_eaten_mean']:7.1f}  {row['population_mean']:10.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks trained brains by their fitness on the same seeded arenas.")
+    parser.add_argument("brains", type=str, nargs="+", help=".pt or .npz brains, directories of them, or genome archives")
+    parser.add_argument("--archive-top", type=int, default=5, help="fittest records taken from every genome archive")
+    parser.add_argument("--arenas", type=int, default=8, help="number of arenas every brain is evaluated on")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first arena, the others follow")
+    parser.add_argument("--steps", type=int, default=3000, help="steps of every evaluation, fewer if the population dies out")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count(), help="number of worker processes")
+    parser.add_argument("--goopies", type=int, default=10, help="goopies at the start of every arena")
+    parser.add_argument("--food", type=int, default=100, help="food at the start of every arena")
+    parser.add_argument("--space-size", type=float, default=1500, help="half size of the square arenas")
+    parser.add_argument("--brain-backend", type=str, default="numpy", choices=["torch", "numpy"], help="library evaluating the brains in the workers")
+    parser.add_argument("--compile-brains", action="store_true", help="evaluate every brain as a single affine map")
+    parser.add_argument("--vision", type=str, default="wide", choices=["wide", "rays"], help="vision the brains were trained with")
+    parser.add_argument("--vision-width", type=int, default=None, help="bins or rays of the vision the brains were trained with, the current one by default")
+    parser.add_argument("--verify", action="store_true", help="first check that an arena restored after another evaluation gives the same result as a new one")
+    parser.add_argument("--output", type=str, default=None, help="JSON file the table, with the result of every arena, is written to")
+    args = parser.parse_args()
+
+    from vision import default_vision_width
+
+    vision_width = args.vision_width or default_vision_width(args.vision)
+    candidates = load_candidates(args.brains, vision_width, args.archive_top)
+    if len(candidates) == 0:
+        parser.error("No brain found in the given paths.")
+    seeds = list(range(args.seed, args.seed + args.arenas))
+    kwargs = dict(num_goopies=args.goopies, num_food=args.food, space_size=args.space_size,
+                  brain_backend=args.brain_backend, compile_brains=args.compile_brains, vision_mode=args.vision,
+                  vision_width=vision_width)
+    start_time = timeit.default_timer()
+    table = run_tournament(candidates, seeds, args.steps, args.workers, kwargs, args.verify)
+    elapsed = timeit.default_timer() - start_time
+    print(format_table(table))
+    print(f"{len(candidates)} brains x {len(seeds)} arenas in {elapsed:.1f} s with {args.workers} workers")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"seeds": seeds, "steps": args.steps, "config": kwargs, "table": table}, f, indent=2)
@@ -1,10 +1,12 @@
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
 import pymunk
 import math
-import torch
-import shapely.geometry as G
+import numpy as np
 from food import Food
-import goopie
+if TYPE_CHECKING:
+    # goopie imports this module
+    import goopie
 
 
 class Vision(ABC):
@@ -23,25 +25,51 @@ class Vision(ABC):
     def update(self, shape: pymunk.Shape, type: str):
         ...
 
+    def release(self):
+        """
+        Frees any resource shared with the rest of the population, called when the goopie leaves the simulation.
+        """
+        pass
+
     def _calculate_approx_wall_vision(self, wall_shape: pymunk.Segment) -> tuple[pymunk.Vec2d, float]:
         """
         Given the shape of the wall the goopie is seeing, calculates the 
         position and radius of its visible portion by the goopie.
         """
-        # need to add to the radius the wall width, otherwise there could be a collision in the shapes that generates no interception
-        circle = G.Point(*self.goopie.get_position()).buffer(self.VISION_RADIUS + 10).boundary
-        # extend the wall such that it will always create 2 collisions, even with big vision radius of goopies in the corners
-        wall_center: pymunk.Vec2d = (wall_shape.a + wall_shape.b) / 2
-        a = wall_center + (wall_center - wall_shape.a) * 10
-        b = wall_center + (wall_center - wall_shape.b) * 10
-        line = G.LineString([a, b])
-        intersection: G.MultiPoint = circle.intersection(line)
-        p1 = pymunk.Vec2d(*intersection.geoms[0].coords[0])
-        p2 = pymunk.Vec2d(*intersection.geoms[1].coords[0])
-
-        position = (p1 + p2) / 2
-        radius = (p1 - p2).length / 2
-        return position, radius
+        positions, radii = self.calculate_wall_vision(np.array([tuple(self.goopie.get_position())]),
+                                                      np.array([tuple(wall_shape.a)]),
+                                                      np.array([tuple(wall_shape.b)]),
+                                                      np.array([wall_shape.radius]))
+        return pymunk.Vec2d(*positions[0]), float(radii[0])
+
+    @classmethod
+    def calculate_wall_vision(cls, observer_positions: np.ndarray, wall_a: np.ndarray, wall_b: np.ndarray, wall_radii: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Calculates in closed form the visible portion of P straight walls, as the chord cut
+        by the vision circle (enlarged by the wall width) on the line through each wall.
+
+        Parameters
+        ----------
+        observer_positions : np.ndarray
+            (P, 2) position of the goopie seeing each wall
+        wall_a, wall_b : np.ndarray
+            (P, 2) endpoints of each wall
+        wall_radii : np.ndarray
+            (P,) radius of each wall segment
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            (P, 2) midpoint and (P,) half length of each visible chord
+        """
+        direction = wall_b - wall_a
+        direction = direction / np.linalg.norm(direction, axis=1, keepdims=True)
+        # the midpoint of the chord is the projection of the goopie on the wall line
+        projection = np.sum((observer_positions - wall_a) * direction, axis=1, keepdims=True)
+        positions = wall_a + projection * direction
+        distance_sq = np.sum((observer_positions - positions) ** 2, axis=1)
+        radii = np.sqrt(np.maximum((cls.VISION_RADIUS + wall_radii) ** 2 - distance_sq, 0))
+        return positions, radii
 
 class WideVision(Vision):
 
@@ -49,14 +77,26 @@ class WideVision(Vision):
 
     def __init__(self, goopie):
         super().__init__(goopie)
-        self.visual_buffer = torch.zeros((3, self.VISION_BUFFER_WIDTH))
+        self.engine: WideVisionEngine = goopie.simulation.vision_engine
+        self.slot = self.engine.allocate()
+
+    @property
+    def visual_buffer(self) -> np.ndarray:
+        """
+        The (3, VISION_BUFFER_WIDTH) row of the engine buffer arena belonging to this goopie.
+        """
+        return self.engine.buffers[self.slot]
 
     def reset(self):
-        self.visual_buffer = torch.zeros((3, self.VISION_BUFFER_WIDTH))
+        self.engine.buffers[self.slot].fill(0)
+
+    def release(self):
+        self.engine.free(self.slot)
+        self.slot = None
 
     def update(self, shape: pymunk.Shape, type: str):
         """
-        Update the vision buffer with the given shape, drawing its approximate figure into the vision buffer
+        Queue the given shape in the engine, which will draw its approximate figure into the vision buffer
         """
         if type == "wall":
             # print("SEEING WALL")
@@ -76,37 +116,319 @@ class WideVision(Vision):
             channel = 2
         else:
             raise("With what are you colliding?????")
-        self._update_approx_vision(position, radius, channel)
-
-    def _update_approx_vision(self, position: pymunk.Vec2d, radius: float, channel: int):
-        # the angle in radiants (-pi < angle < pi)
-        vec_to_obj = position - self.goopie.get_position()
-        a = position + vec_to_obj.perpendicular_normal() * radius
-        b = position - vec_to_obj.perpendicular_normal() * radius
-        a_angle = math.remainder(self.goopie.shape.body.angle - (a - self.goopie.get_position()).angle, math.tau)
-        b_angle = math.remainder(self.goopie.shape.body.angle - (b - self.goopie.get_position()).angle, math.tau)
-        a_index = math.floor((a_angle + math.pi) * (self.VISION_BUFFER_WIDTH / (2 * math.pi))) % self.VISION_RADIUS
-        b_index = math.floor((b_angle + math.pi) * (self.VISION_BUFFER_WIDTH / (2 * math.pi))) % self.VISION_RADIUS
-        
-        distance = (position - self.goopie.get_position()).length
-        activation = min(max(0, 1 - ((distance - self.goopie.RADIUS)/self.VISION_RADIUS)), 1)
-
-        if a_index <= b_index:
-            act_tensor = torch.tensor([activation]*(b_index - a_index + 1))
-            self.visual_buffer[channel][a_index: b_index + 1] = torch.max(self.visual_buffer[channel][a_index: b_index + 1], act_tensor)
-        else:
-            act_tensor1 = torch.tensor([activation]*(b_index + 1))
-            act_tensor2 = torch.tensor([activation]*(self.VISION_BUFFER_WIDTH - a_index))
-            self.visual_buffer[channel][:b_index + 1] = torch.max(self.visual_buffer[channel][:b_index + 1], act_tensor1)
-            self.visual_buffer[channel][a_index:] = torch.max(self.visual_buffer[channel][a_index:], act_tensor2)
-
-        # print(self.visual_buffer)
-        # print("a angle:", a_angle)
-        # print("b angle:", b_angle)
-        # print("indexes:", a_index, b_index)
-        # print("vision position:", position)
-        # print("vision relative position:", position - self.get_position())
-        # print("vision radius:", radius)
+        self.engine.queue(self.slot, position, radius, channel)
+
+class WideVisionEngine:
+    """
+    Computes the wide vision of the whole population at once.
+
+    The vision buffers of all the goopies live in a single preallocated (capacity, channels, width) arena,
+    which is zeroed in place every tick. The seen objects are collected as (observer, object, radius, channel)
+    pairs and painted into the arena with a single vectorized pass.
+    """
+    def __init__(self, width: int = WideVision.VISION_BUFFER_WIDTH, channels: int = 3, vision_radius: float = Vision.VISION_RADIUS, observer_radius: float = 30, capacity: int = 64) -> None:
+        self.width = width
+        self.channels = channels
+        self.vision_radius = vision_radius
+        self.observer_radius = observer_radius
+        self.buffers = np.zeros((capacity, channels, width), dtype=np.float32)
+        self.observer_positions = np.zeros((capacity, 2))
+        self.observer_angles = np.zeros(capacity)
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self._bins = np.arange(width)
+        self._clear_queue()
+
+    def allocate(self) -> int:
+        if len(self.free_slots) == 0:
+            capacity = self.buffers.shape[0]
+            self.buffers = np.concatenate([self.buffers, np.zeros_like(self.buffers)])
+            self.observer_positions = np.concatenate([self.observer_positions, np.zeros_like(self.observer_positions)])
+            self.observer_angles = np.concatenate([self.observer_angles, np.zeros_like(self.observer_angles)])
+            self.free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+        slot = self.free_slots.pop()
+        self.buffers[slot] = 0
+        return slot
+
+    def free(self, slot: int):
+        self.free_slots.append(slot)
+
+    def reset(self):
+        self.buffers.fill(0)
+        self._clear_queue()
+
+    def _clear_queue(self):
+        self._queued_slots: list[int] = []
+        self._queued_positions: list[tuple[float, float]] = []
+        self._queued_radii: list[float] = []
+        self._queued_channels: list[int] = []
+
+    def queue(self, slot: int, position: pymunk.Vec2d, radius: float, channel: int):
+        """
+        Remembers that the observer in the given slot sees an object, to be painted by flush().
+        """
+        self._queued_slots.append(slot)
+        self._queued_positions.append((position.x, position.y))
+        self._queued_radii.append(radius)
+        self._queued_channels.append(channel)
+
+    def update_observers(self, slots: np.ndarray, positions: np.ndarray, angles: np.ndarray):
+        """
+        Sets the position and angle of the observers in the given slots, used by flush().
+        """
+        self.observer_positions[slots] = positions
+        self.observer_angles[slots] = angles
+
+    def flush(self):
+        """
+        Paints all the queued objects into the buffers of their observers.
+        """
+        if len(self._queued_slots) > 0:
+            slots = np.array(self._queued_slots)
+            self.paint(slots, self.observer_positions[slots], self.observer_angles[slots],
+                       np.array(self._queued_positions), np.array(self._queued_radii, dtype=np.float64), np.array(self._queued_channels))
+        self._clear_queue()
+
+    def paint(self, slots: np.ndarray, observer_positions: np.ndarray, observer_angles: np.ndarray, positions: np.ndarray, radii: np.ndarray, channels: np.ndarray):
+        """
+        Draws the approximate figure of P objects into the vision buffers of their observers.
+
+        Parameters
+        ----------
+        slots : np.ndarray
+            (P,) buffer slot of the observer of each object
+        observer_positions : np.ndarray
+            (P, 2) position of the observer of each object
+        observer_angles : np.ndarray
+            (P,) angle of the observer of each object
+        positions : np.ndarray
+            (P, 2) position of each object
+        radii : np.ndarray
+            (P,) radius of each object
+        channels : np.ndarray
+            (P,) channel in which each object is drawn
+        """
+        if len(slots) == 0:
+            return
+        vec_to_obj = positions - observer_positions
+        distance = np.hypot(vec_to_obj[:, 0], vec_to_obj[:, 1])
+        # perpendicular normal of the vector to the object, zero if the object is in the same position
+        safe_distance = np.where(distance > 0, distance, 1)
+        normal = np.stack([-vec_to_obj[:, 1], vec_to_obj[:, 0]], axis=1) / safe_distance[:, None]
+        normal[distance == 0] = 0
+        a = vec_to_obj + normal * radii[:, None]
+        b = vec_to_obj - normal * radii[:, None]
+        a_index = self._angle_to_index(observer_angles - np.arctan2(a[:, 1], a[:, 0]))
+        b_index = self._angle_to_index(observer_angles - np.arctan2(b[:, 1], b[:, 0]))
+        activation = np.clip(1 - ((distance - self.observer_radius) / self.vision_radius), 0, 1)
+
+        # (P, width) mask of the bins covered by each object, wrapping around the back of the goopie
+        a_index = a_index[:, None]
+        b_index = b_index[:, None]
+        covered = np.where(a_index <= b_index,
+                           (self._bins >= a_index) & (self._bins <= b_index),
+                           (self._bins <= b_index) | (self._bins >= a_index))
+        values = np.where(covered, activation[:, None], 0).astype(np.float32)
+
+        # max-reduce the objects painted on the same row, then merge the result into the arena
+        keys = slots * self.channels + channels
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = values[order]
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        rows = keys[starts]
+        flat_buffers = self.buffers.reshape(-1, self.width)
+        flat_buffers[rows] = np.maximum(flat_buffers[rows], np.maximum.reduceat(values, starts, axis=0))
+
+    def _angle_to_index(self, angle: np.ndarray) -> np.ndarray:
+        # IEEE remainder, same as math.remainder(angle, math.tau): the angle in radiants (-pi <= angle <= pi)
+        angle = angle - math.tau * np.round(angle / math.tau)
+        return np.floor((angle + math.pi) * (self.width / (2 * math.pi))).astype(np.int64) % self.width
+
+class RayVision(Vision):
+    """
+    Casts NUM_RAYS rays all around the goopie, evenly spaced like the bins of the WideVision. Each ray
+    stops at the first wall, goopie or food it hits: its closeness is written in the channel of the type
+    of the hit (0 wall, 1 goopie, 2 food) and the other channels are left at zero, so the vision buffer
+    has the same (3, NUM_RAYS) layout as the one of the WideVision.
+
+    The rays of the whole population are cast together by the RayVisionEngine of the simulation.
+    """
+    NUM_RAYS = 32
+
+    def __init__(self, goopie):
+        super().__init__(goopie)
+        self.engine: RayVisionEngine = goopie.simulation.vision_engine
+        self.slot = self.engine.allocate()
+
+    @property
+    def visual_buffer(self) -> np.ndarray:
+        """
+        The (3, NUM_RAYS) row of the engine buffer arena belonging to this goopie.
+        """
+        return self.engine.buffers[self.slot]
+
+    def reset(self):
+        self.engine.buffers[self.slot].fill(0)
+
+    def release(self):
+        self.engine.free(self.slot)
+        self.slot = None
+
+    def update(self, shape: pymunk.Shape, type: str):
+        """
+        Does nothing: the rays are cast by the RayVisionEngine from the spatial grids, and the simulation never
+        gives pymunk vision sensors to goopies with a ray vision.
+        """
+        pass
+
+class RayVisionEngine(WideVisionEngine):
+    """
+    Casts the rays of the whole population at once, into a buffer arena managed like the one of the
+    WideVisionEngine.
+
+    The candidates hit by the rays of each goopie are the objects overlapping its vision circle, found
+    through the spatial grids. Every candidate is intersected only with the rays crossing its angular
+    span, usually one or two (all of them for the few walls), and the nearest hit of each ray is found
+    with a min-reduce over the candidates of the same observer.
+    """
+    def __init__(self, num_rays: int = RayVision.NUM_RAYS, channels: int = 3, vision_radius: float = Vision.VISION_RADIUS, observer_radius: float = 30, capacity: int = 64) -> None:
+        super().__init__(num_rays, channels, vision_radius, observer_radius, capacity)
+        # ray k looks at the center of bin k of a WideVision of the same width
+        self._ray_offsets = -math.pi + (np.arange(num_rays) + 0.5) * (2 * math.pi / num_rays)
+
+    def cast(self, slots: np.ndarray, observer_positions: np.ndarray, observer_angles: np.ndarray,
+             observers: np.ndarray, positions: np.ndarray, radii: np.ndarray, channels: np.ndarray,
+             wall_observers: np.ndarray, wall_a: np.ndarray, wall_b: np.ndarray, wall_radii: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Casts the rays of N observers against P circles and W wall segments, and writes the closeness
+        of the hits into the vision buffers.
+
+        Parameters
+        ----------
+        slots : np.ndarray
+            (N,) buffer slot of each observer
+        observer_positions : np.ndarray
+            (N, 2) position of each observer
+        observer_angles : np.ndarray
+            (N,) angle of each observer
+        observers : np.ndarray
+            (P,) index of the observer of each circle
+        positions : np.ndarray
+            (P, 2) center of each circle
+        radii : np.ndarray
+            (P,) radius of each circle
+        channels : np.ndarray
+            (P,) type of each circle, 1 goopie or 2 food
+        wall_observers : np.ndarray
+            (W,) index of the observer of each wall
+        wall_a, wall_b : np.ndarray
+            (W, 2) endpoints of each wall
+        wall_radii : np.ndarray
+            (W,) radius of each wall segment
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            (N, rays) distance from the center of the observer to the first hit of each ray, inf if
+            nothing is hit within the vision radius, and (N, rays) channel of the hit, -1 if none
+        """
+        n = len(slots)
+        # nearest hit of every (observer, channel, ray)
+        nearest = np.full(n * self.channels * self.width, np.inf)
+        if len(observers) > 0:
+            rays, directions, centers, circle_radii, pairs = self._circle_rays(observer_angles[observers], positions - observer_positions[observers], radii)
+            rows = observers[pairs] * self.channels + channels[pairs]
+            np.minimum.at(nearest, rows * self.width + rays, self._hit_circles(directions, centers, circle_radii))
+        if len(wall_observers) > 0:
+            # there are few walls, every ray of their observers is tested against them
+            ray_angles = observer_angles[wall_observers, None] - self._ray_offsets[None, :]
+            directions = np.stack([np.cos(ray_angles), np.sin(ray_angles)], axis=2)
+            rows = wall_observers * self.channels
+            np.minimum.at(nearest, rows[:, None] * self.width + np.arange(self.width),
+                          self._hit_segments(directions, wall_a - observer_positions[wall_observers],
+                                             wall_b - observer_positions[wall_observers], wall_radii))
+        nearest = nearest.reshape(n, self.channels, self.width)
+
+        # only the closest type is seen by each ray, the others are hidden behind it
+        hit_channels = np.argmin(nearest, axis=1)
+        distances = np.take_along_axis(nearest, hit_channels[:, None, :], axis=1)[:, 0, :]
+        hit = distances <= self.vision_radius
+        hit_channels[~hit] = -1
+        distances[~hit] = np.inf
+
+        activation = np.clip(1 - ((distances - self.observer_radius) / self.vision_radius), 0, 1).astype(np.float32)
+        values = np.zeros((n, self.channels, self.width), dtype=np.float32)
+        np.put_along_axis(values, np.maximum(hit_channels, 0)[:, None, :], activation[:, None, :], axis=1)
+        self.buffers[slots] = values
+        return distances, hit_channels
+
+    def _circle_rays(self, observer_angles: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> tuple[np.ndarray, ...]:
+        """
+        Expands P circles into the (circle, ray) pairs of the rays passing through the angular span of
+        each circle, usually one or two, instead of testing all the rays against every circle.
+
+        Returns
+        -------
+        tuple[np.ndarray, ...]
+            for each (circle, ray) pair the index of the ray, its (2,) direction, the center and radius
+            of the circle relative to the observer, and the index of the circle
+        """
+        distance = np.hypot(centers[:, 0], centers[:, 1])
+        relative = observer_angles - np.arctan2(centers[:, 1], centers[:, 0])
+        relative = relative - math.tau * np.round(relative / math.tau)
+        # a circle around the observer is crossed by all the rays
+        half_span = np.where(distance > radii, np.arcsin(np.minimum(radii / np.maximum(distance, 1e-12), 1)), math.pi)
+        spacing = math.tau / self.width
+        first = np.ceil((relative - half_span + math.pi) / spacing - 0.5).astype(np.int64)
+        last = np.floor((relative + half_span + math.pi) / spacing - 0.5).astype(np.int64)
+        counts = np.clip(last - first + 1, 0, self.width)
+
+        pairs = np.repeat(np.arange(len(centers)), counts)
+        starts = np.repeat(first - (np.cumsum(counts) - counts), counts)
+        rays = (starts + np.arange(len(pairs))) % self.width
+        ray_angles = observer_angles[pairs] - self._ray_offsets[rays]
+        directions = np.stack([np.cos(ray_angles), np.sin(ray_angles)], axis=1)
+        return rays, directions, centers[pairs], radii[pairs], pairs
+
+    @staticmethod
+    def _hit_circles(directions: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        Distance along each ray from the origin to the circle of its pair, inf if missed.
+        A ray starting inside a circle hits it at distance 0.
+        """
+        projection = np.sum(directions * centers, axis=-1)
+        # squared distance of the center from the line of the ray
+        miss_sq = np.sum(centers ** 2, axis=-1) - projection ** 2
+        half_chord_sq = radii ** 2 - miss_sq
+        half_chord = np.sqrt(np.maximum(half_chord_sq, 0))
+        hit = (half_chord_sq >= 0) & (projection + half_chord >= 0)
+        return np.where(hit, np.maximum(projection - half_chord, 0), np.inf)
+
+    @staticmethod
+    def _hit_segments(directions: np.ndarray, a: np.ndarray, b: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        (W, rays) distance along each ray from the origin to the wall of its pair, inf if missed.
+        The wall is the segment a-b thickened by its radius on both sides, the rounded ends are ignored.
+        """
+        along = b - a
+        length = np.hypot(along[:, 0], along[:, 1])
+        # 2D cross products, with the ray direction d and the segment a + u * along:
+        # t = cross(a, along) / cross(d, along), u = cross(a, d) / cross(d, along)
+        denominator = directions[:, :, 0] * along[:, None, 1] - directions[:, :, 1] * along[:, None, 0]
+        parallel = np.abs(denominator) < 1e-12 * length[:, None]
+        safe_denominator = np.where(parallel, 1, denominator)
+        t = (a[:, 0] * along[:, 1] - a[:, 1] * along[:, 0])[:, None] / safe_denominator
+        u = (a[:, None, 0] * directions[:, :, 1] - a[:, None, 1] * directions[:, :, 0]) / safe_denominator
+        # the faces of the wall are radius / sin(incidence) before and after its center line along the ray
+        thickness = radii[:, None] * length[:, None] / np.abs(safe_denominator)
+        hit = ~parallel & (u >= 0) & (u <= 1) & (t + thickness >= 0)
+        return np.where(hit, np.maximum(t - thickness, 0), np.inf)
+
+def default_vision_width(vision_mode: str) -> int:
+    """
+    Width of the vision buffer read by the brains: the bins of the wide vision, or the rays of the ray vision.
+    """
+    return RayVision.NUM_RAYS if vision_mode == "rays" else WideVision.VISION_BUFFER_WIDTH
 
 class ClosestVision(Vision):
     """
@@ -6,7 +6,12 @@ from pyglet.window import Window
 from camera_group import CenteredCameraGroup
 from goopie import Goopie
 from food import Food
+from vision import Vision
 from simulation import Simulation
+from pool import ObjectPool
+from instanced_renderer import InstancedCircles
+from sim_worker import SimulationWorker
+from recorder import FrameRecorder
 
 
 SCREEN_WIDTH = 1000
@@ -17,8 +22,26 @@ GOOPIE_IMAGE_SIZE = 460
 FOOD_IMAGE_SIZE = 460
 
 class GameWindow(Window):
-    def __init__(self, simulation: Simulation, width:int = SCREEN_WIDTH, height:int = SCREEN_HEIGHT, title:str=WINDOW_TITLE):
+    """
+    Window showing the simulation. By default goopies, food and vision circles are drawn with one
+    instanced draw call each, from the arrays of the simulation; with instanced=False every entity
+    gets its own sprite (and vision arc), updated from Python every frame.
+
+    Every frame runs `steps_per_frame` simulation steps. With threaded=True the simulation runs on a
+    worker thread instead, paced at `steps_per_frame` steps per frame (or as fast as possible if
+    unlimited), and every frame draws the latest snapshot it published, skipping the ones in between.
+
+    The drawn frames are handed to the FrameRecorder if one is given.
+    """
+    def __init__(self, simulation: Simulation, width:int = SCREEN_WIDTH, height:int = SCREEN_HEIGHT, title:str=WINDOW_TITLE, instanced: bool = True,
+                 steps_per_frame: int = 1, threaded: bool = False, unlimited: bool = False, recorder: FrameRecorder = None):
+        if threaded and not instanced:
+            raise ValueError("The threaded viewer needs the instanced renderer, sprites can only be updated from the main thread.")
+        if simulation.food_field is not None and not instanced:
+            raise ValueError("The food field has no food objects to attach sprites to, it needs the instanced renderer.")
         super().__init__(width=width, height=height, caption=title)
+        self.instanced = instanced
+        self.steps_per_frame = steps_per_frame
         pyglet.gl.glClearColor(0, 0, 0, 0)
         self.set_location(900, 200)
         
@@ -35,15 +58,20 @@ class GameWindow(Window):
         self.food_img.anchor_y = self.food_img.height // 2
         self.set_icon(self.goopie_img)
 
+        if instanced:
+            self.food_renderer = InstancedCircles(Food.RADIUS, self.food_img.get_texture())
+            self.goopie_renderer = InstancedCircles(Goopie.RADIUS, self.goopie_img.get_texture())
+            self.vision_renderer = InstancedCircles(Vision.VISION_RADIUS)
+
+        # sprites and vision arcs of dead goopies and eaten food are hidden and reused
+        self.pools = {"goopie_sprites": ObjectPool(), "food_sprites": ObjectPool()}
         self.goopie_sprites = pyglet.graphics.Batch()
         self.goopie_vision_arcs_batch = pyglet.graphics.Batch()
-        for goopie in simulation.goopies:
-            self.add_goopie_sprite(goopie)
+        self.add_goopie_sprites(simulation.goopies)
 
 
         self.food_sprites = pyglet.graphics.Batch()
-        for food in simulation.foods:
-            self.add_food_sprite(food)
+        self.add_food_sprites(simulation.foods)
 
         self.wall_lines = pyglet.graphics.Batch()
         self.walls = []
@@ -56,48 +84,129 @@ class GameWindow(Window):
         self.frame = 0
         self.headless = False
         self.step_time = None
+        self.worker = SimulationWorker(simulation, steps_per_frame, unlimited) if threaded else None
+        self.drawn_sequence = None
+        self.recorder = recorder
+
+    def add_goopie_sprites(self, goopies: list[Goopie]):
+        # the instanced renderer reads all the goopies from the simulation arrays every frame
+        if self.instanced:
+            return
+        for goopie in goopies:
+            self.add_goopie_sprite(goopie)
+
+    def remove_goopie_sprites(self, goopies: list[Goopie]):
+        if self.instanced:
+            return
+        for goopie in goopies:
+            goopie.sprite.visible = False
+            goopie.vision_arc.visible = False
+            self.pools["goopie_sprites"].release((goopie.sprite, goopie.vision_arc))
+            goopie.sprite = None
+            goopie.vision_arc = None
+
+    def add_food_sprites(self, foods: list[Food]):
+        if self.instanced:
+            return
+        for food in foods:
+            self.add_food_sprite(food)
+
+    def remove_food_sprites(self, foods: list[Food]):
+        if self.instanced:
+            return
+        for food in foods:
+            food.sprite.visible = False
+            self.pools["food_sprites"].release(food.sprite)
+            food.sprite = None
 
     def add_goopie_sprite(self, goopie: Goopie):
-        scale = 2 * goopie.RADIUS / GOOPIE_IMAGE_SIZE
-        sprite = pyglet.sprite.Sprite(self.goopie_img, batch=self.goopie_sprites, group=self.camera)
-        sprite.scale = scale
         x, y = goopie.get_position()
+        recycled = self.pools["goopie_sprites"].acquire()
+        if recycled is None:
+            scale = 2 * goopie.RADIUS / GOOPIE_IMAGE_SIZE
+            sprite = pyglet.sprite.Sprite(self.goopie_img, batch=self.goopie_sprites, group=self.camera)
+            sprite.scale = scale
+            vision_arc = pyglet.shapes.Arc(x, y, radius=goopie.vision.VISION_RADIUS, thickness=1, batch=self.goopie_vision_arcs_batch, group=self.camera)
+        else:
+            sprite, vision_arc = recycled
+            sprite.visible = True
+            vision_arc.visible = True
+            vision_arc.position = x, y
         sprite.position = (x, y, 0)
         goopie.set_sprite(sprite)
-
-        vision_arc = pyglet.shapes.Arc(x, y, radius=goopie.vision.VISION_RADIUS, thickness=1, batch=self.goopie_vision_arcs_batch, group=self.camera)
         goopie.vision_arc = vision_arc
         
 
     def add_food_sprite(self, food: Food):
-        scale = 2 * food.RADIUS / GOOPIE_IMAGE_SIZE
-        
-        sprite = pyglet.sprite.Sprite(self.food_img, batch=self.food_sprites, group=self.camera)
-        sprite.scale = scale
+        sprite = self.pools["food_sprites"].acquire()
+        if sprite is None:
+            scale = 2 * food.RADIUS / GOOPIE_IMAGE_SIZE
+            sprite = pyglet.sprite.Sprite(self.food_img, batch=self.food_sprites, group=self.camera)
+            sprite.scale = scale
+        else:
+            sprite.visible = True
         x, y = food.get_position()
         sprite.position = (x, y, 0)
         food.set_sprite(sprite)
 
-    def run(self):
-        app.run()
+    def run(self, frames: int = None):
+        """
+        Runs the pyglet event loop, or draws the given number of frames directly without it
+        (for offscreen recordings, where nothing schedules the drawing).
+        """
+        if self.worker is not None:
+            self.worker.start()
+        try:
+            if frames is None:
+                app.run()
+            else:
+                for _ in range(frames):
+                    self.switch_to()
+                    self.on_draw()
+                    self.flip()
+        finally:
+            if self.worker is not None:
+                self.worker.stop()
 
     def on_draw(self):
 
-        step_start_time = timeit.default_timer()
-        self.simulation.step()
-        self.step_time = timeit.default_timer() - step_start_time
-        self.update_sprites()
+        if self.worker is not None:
+            # the simulation runs on its own thread, only its latest snapshot is drawn
+            self.step_time = 0
+            with self.worker.read() as snapshot:
+                if snapshot.sequence != self.drawn_sequence:
+                    self.update_instances(snapshot.goopies, snapshot.food)
+                    self.drawn_sequence = snapshot.sequence
+                best_fitness, last_fitness = snapshot.best_fitness, snapshot.last_fitness
+                steps_per_second = snapshot.steps_per_second
+        else:
+            step_start_time = timeit.default_timer()
+            for _ in range(self.steps_per_frame):
+                self.simulation.step()
+            self.step_time = timeit.default_timer() - step_start_time
+            self.update_sprites()
+            best_fitness = self.simulation.best_fitness
+            last_fitness = 0
+            if len(self.simulation.best_goopies) > 0:
+                last_fitness = self.simulation.best_goopies[-1].fitness
+            steps_per_second = self.steps_per_frame / max(self.step_time, 1e-9)
 
 
         self.clear()
 
         draw_start_time = timeit.default_timer()
 
-        self.goopie_sprites.draw()
-        self.food_sprites.draw()
-
-        # vision shape
-        self.goopie_vision_arcs_batch.draw()
+        if self.instanced:
+            self.camera.set_state()
+            self.goopie_renderer.draw()
+            self.food_renderer.draw()
+            self.vision_renderer.draw()
+            self.camera.unset_state()
+        else:
+            self.goopie_sprites.draw()
+            self.food_sprites.draw()
+            # vision shape
+            self.goopie_vision_arcs_batch.draw()
         
         # draw walls
         self.wall_lines.draw()
@@ -120,19 +229,28 @@ class GameWindow(Window):
         # pyglet.text.Label(f"Age: {self.simulation.goopies[0].age}", 20, 80, color=[255, 255, 255], height=100).draw()
 
         # show stats
-        last_fitness = 0
-        if len(self.simulation.best_goopies) > 0:
-            last_fitness = self.simulation.best_goopies[-1].fitness
         # output1 = f"Step:  {self.step_time:.4f}       Drawing: {self.draw_time:.4f}"
         # output2 = f"Space: {self.simulation.space_time:.4f}      Goopie: {self.simulation.goopie_time:.4f}"
-        output2 = f"FPS: {(1 / (self.step_time + self.draw_time)):.1f}"
-        output3 = f"Best:  {self.simulation.best_fitness:.4f}      Last:   {last_fitness}"
+        output2 = f"FPS: {(1 / max(self.step_time + self.draw_time, 1e-9)):.1f}      Steps/sec: {steps_per_second:.0f}"
+        if self.worker is not None:
+            output2 += f"      Skipped: {self.worker.skipped}"
+        output3 = f"Best:  {best_fitness:.4f}      Last:   {last_fitness}"
         # pyglet.text.Label(output1, 20, 60, color=[255, 255, 255], height=100).draw()
         pyglet.text.Label(output2, 20, 40, color=[255, 255, 255], height=100).draw()
         pyglet.text.Label(output3, 20, 20, color=[255, 255, 255], height=100).draw()
+        if self.recorder is not None:
+            self.recorder.capture(*self.get_framebuffer_size())
         self.draw_time = timeit.default_timer() - draw_start_time
 
+    def update_instances(self, goopies, food):
+        self.goopie_renderer.update(goopies)
+        self.vision_renderer.update(goopies)
+        self.food_renderer.update(food)
+
     def update_sprites(self):
+        if self.instanced:
+            self.update_instances(*self.simulation.render_instances())
+            return
         for goopie in self.simulation.goopies:
             # update goopie sprite
             pos = goopie.get_position()